@@ -20,6 +20,9 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'security/ai_livebot_security.xml',
+        'data/ai_chat_job_cron.xml',
+        'data/ai_sales_rollup_cron.xml',
         'views/ai_config_views.xml',
     ],
     'installable': True,
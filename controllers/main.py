@@ -2,6 +2,9 @@ from odoo import http
 from odoo.http import request
 import json
 
+from odoo.addons.ai_livebot.models.function_cache import get_function_cache_stats
+from odoo.addons.ai_livebot.models.llm_provider import get_pool_stats
+
 class AILiveBotController(http.Controller):
     
     @http.route('/ai_livebot/chat', type='json', auth='user', methods=['POST'])
@@ -41,3 +44,10 @@ class AILiveBotController(http.Controller):
         """Endpoint per validare un ordine"""
         warehouse_ops = request.env['warehouse.operations']
         return warehouse_ops.validate_delivery(picking_id)
+
+    @http.route('/ai_livebot/llm/pool_stats', type='json', auth='user', methods=['POST'])
+    def llm_pool_stats(self):
+        """Statistiche del pool HTTP LLM e della cache risultati funzioni del worker che serve la richiesta"""
+        stats = get_pool_stats()
+        stats["function_cache"] = get_function_cache_stats(request.env.cr.dbname)
+        return stats
@@ -1,4 +1,13 @@
 from . import ai_config
+from . import ai_chat_job
+from . import ai_pending_action
+from . import ai_conversation
+from . import product_template
+from . import product_product
+from . import ai_sales_daily_rollup
+from . import sale_order
+from . import stock_picking
+from . import stock_quant
 from . import warehouse_operations
 from . import ai_chatbot
 from . import odoobot_override
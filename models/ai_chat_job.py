@@ -0,0 +1,182 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Numero massimo di tentativi per job prima di marcarlo come fallito
+MAX_ATTEMPTS = 2
+# Job completati più vecchi di N giorni vengono eliminati dal cron
+DONE_RETENTION_DAYS = 7
+# Job rimasti 'running' oltre N minuti (worker morto) tornano in coda
+STALE_RUNNING_MINUTES = 15
+# Attesa prima di ritentare un job fallito (moltiplicata per il numero di tentativi)
+RETRY_DELAY_SECONDS = 60
+
+
+class AIChatJob(models.Model):
+    """
+    Turno di chat AI accodato per l'esecuzione in background.
+
+    In modalità asincrona (`ai.config.async_mode`) il messaggio dell'utente
+    viene committato subito e il worker HTTP si libera: il turno LLM viene
+    eseguito dal cron `ir_cron_ai_chat_job` e la risposta del bot arriva
+    al client tramite le normali notifiche bus di `message_post`.
+
+    La stessa coda esegue, in qualsiasi modalità, i job 'summary' che
+    aggiornano il riassunto dei turni usciti dal contesto (`ai.conversation`).
+    """
+    _name = 'ai.chat.job'
+    _description = 'AI Chat Job'
+    _order = 'id'
+
+    channel_id = fields.Many2one('discuss.channel', string='Canale', required=True, ondelete='cascade', index=True)
+    kind = fields.Selection([
+        ('channel', 'Canale AI Assistant'),
+        ('odoobot', 'Chat OdooBot'),
+        ('summary', 'Riassunto conversazione'),
+    ], string='Tipo', required=True, default='channel')
+    body = fields.Text(string='Messaggio utente', required=True)
+    state = fields.Selection([
+        ('queued', 'In coda'),
+        ('running', 'In esecuzione'),
+        ('done', 'Completato'),
+        ('failed', 'Fallito'),
+    ], string='Stato', default='queued', required=True, index=True)
+    attempts = fields.Integer(string='Tentativi', default=0)
+    error = fields.Text(string='Errore')
+    retry_after = fields.Datetime(string='Riprova dopo')
+    date_started = fields.Datetime(string='Avviato il')
+    date_done = fields.Datetime(string='Completato il')
+
+    @api.model
+    def _enqueue(self, channel, body, kind='channel'):
+        """Accoda un turno di chat e sveglia il cron worker."""
+        job = self.sudo().create({
+            'channel_id': channel.id,
+            'body': body,
+            'kind': kind,
+        })
+        cron = self.env.ref('ai_livebot.ir_cron_ai_chat_job', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+        _logger.info(f"📥 Turno AI accodato: job {job.id} ({kind}) per canale {channel.id}")
+        return job
+
+    @api.model
+    def _cron_process_jobs(self, limit=20):
+        """
+        Esegue i job in coda, uno per transazione.
+
+        I job vengono presi con FOR UPDATE SKIP LOCKED e marcati 'running'
+        (tentativo incluso) in una transazione committata prima del turno:
+        più cron worker consumano la stessa coda senza eseguire due volte lo
+        stesso turno, e un worker morto a metà turno lascia il job 'running'
+        con il tentativo contato, ripreso (o fallito) dal recupero dei job
+        bloccati.
+        """
+        for job in self.search([
+            ('state', '=', 'running'),
+            ('date_started', '<', fields.Datetime.now() - timedelta(minutes=STALE_RUNNING_MINUTES)),
+        ]):
+            _logger.warning(f"⚠️ Job AI {job.id} bloccato in esecuzione (worker terminato?)")
+            job._fail_or_retry("Esecuzione interrotta (worker terminato)")
+        self.env.cr.commit()
+
+        processed = 0
+        while processed < limit:
+            self.env.cr.execute("""
+                SELECT id FROM ai_chat_job
+                 WHERE state = 'queued'
+                   AND (retry_after IS NULL OR retry_after <= %s)
+              ORDER BY id
+                 LIMIT 1
+            FOR UPDATE SKIP LOCKED
+            """, [fields.Datetime.now()])
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+
+            job = self.browse(row[0])
+            job.write({
+                'state': 'running',
+                'attempts': job.attempts + 1,
+                'date_started': fields.Datetime.now(),
+            })
+            # Presa in carico visibile agli altri worker prima del turno
+            self.env.cr.commit()
+
+            job._run()
+            # Fine turno: rende visibile la risposta
+            self.env.cr.commit()
+            processed += 1
+
+        if processed >= limit:
+            # Coda ancora piena: riprogramma subito il cron invece di aspettare l'intervallo
+            cron = self.env.ref('ai_livebot.ir_cron_ai_chat_job', raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+        self.search([
+            ('state', '=', 'done'),
+            ('date_done', '<', fields.Datetime.now() - timedelta(days=DONE_RETENTION_DAYS)),
+        ]).unlink()
+
+        return processed
+
+    def _run(self):
+        """Esegue il turno (già preso in carico) nel contesto dell'utente che ha scritto il messaggio."""
+        self.ensure_one()
+        user = self.create_uid
+        channel = self.channel_id.with_user(user)
+
+        try:
+            with self.env.cr.savepoint():
+                if self.kind == 'summary':
+                    self.env['ai.conversation'].with_user(user)._summarize_channel(channel)
+                elif self.kind == 'odoobot':
+                    self.env['mail.bot'].with_user(user)._reply_with_ai(channel, self.body)
+                else:
+                    channel._generate_ai_response(self.body)
+        except Exception as e:
+            _logger.error(f"❌ Job AI {self.id} fallito: {e}", exc_info=True)
+            self._fail_or_retry(str(e))
+            return False
+
+        self.write({
+            'state': 'done',
+            'date_done': fields.Datetime.now(),
+            'error': False,
+            'retry_after': False,
+        })
+        return True
+
+    def _fail_or_retry(self, error):
+        """Rimette in coda il job con attesa crescente, o lo marca fallito dopo MAX_ATTEMPTS."""
+        self.ensure_one()
+        if self.attempts < MAX_ATTEMPTS:
+            retry_after = fields.Datetime.now() + timedelta(seconds=RETRY_DELAY_SECONDS * max(self.attempts, 1))
+            self.write({'state': 'queued', 'error': error, 'retry_after': retry_after})
+            # Non ripreso nello stesso giro del cron: nuovo tentativo dopo l'attesa
+            cron = self.env.ref('ai_livebot.ir_cron_ai_chat_job', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger(at=retry_after)
+            return
+
+        self.write({'state': 'failed', 'error': error, 'retry_after': False})
+        self._notify_failure()
+
+    def _notify_failure(self):
+        """Avvisa l'utente nel canale che il turno non avrà risposta (i riassunti restano silenziosi)."""
+        if self.kind == 'summary':
+            return
+        try:
+            with self.env.cr.savepoint():
+                self.channel_id.sudo().with_context(ai_livebot_skip_bot_logic=True).message_post(
+                    body="⚠️ Non sono riuscito a completare la richiesta. Riprova tra qualche minuto.",
+                    author_id=self.env.ref('base.partner_root').id,
+                    message_type='comment',
+                    subtype_xmlid='mail.mt_comment',
+                )
+        except Exception as e:
+            _logger.error(f"❌ Avviso di fallimento del job AI {self.id} non pubblicato: {e}")
@@ -5,30 +5,32 @@ import json
 import logging
 import re
 
+from .llm_provider import (
+    DEFAULT_CACHE_TTL,
+    GEMINI_API_BASE,
+    NATIVE_TOOLS_INSTRUCTION,
+    LLMReply,
+    coerce_tool_args,
+    gemini_tools,
+    get_gemini_context_cache,
+    get_http_client,
+    get_task_profile,
+    iter_sse_json,
+    openai_tools,
+)
+from .ai_functions import FunctionArgumentError, call_in_savepoint, get_function_registry
+from .ai_pending_action import PENDING_CANCEL_MARKER, PENDING_SO_MARKER
+from .chat_stream import current_stream, streamed_reply
+from .function_cache import cached_call
+from .function_executor import execute_calls
+from .function_tags import IncrementalTagDetector, parse_function_tags, strip_function_tags
+from .product_normalizer import get_lexicon, normalize_term
+from .turn_analyzer import get_turn_verdict, lookup_search_term, turn_memo, turn_scoped
+
 _logger = logging.getLogger(__name__)
 
-# Marker for pending sales order confirmation
-PENDING_SO_MARKER = "[PENDING_SO]"
-# Marker per conferma cancellazione ordine
-PENDING_CANCEL_MARKER = "[PENDING_CANCEL]"
-
-
-def _balanced_json_extract_simple(txt):
-    """Estrae un JSON bilanciato da una stringa (versione semplice per ai_chatbot)."""
-    if not txt:
-        return None
-    i = txt.find('{')
-    if i == -1:
-        return None
-    depth = 0
-    for k, ch in enumerate(txt[i:], start=i):
-        if ch == '{':
-            depth += 1
-        elif ch == '}':
-            depth -= 1
-            if depth == 0:
-                return txt[i:k+1]
-    return None
+def _function_memo_key(function_name, parameters):
+    return json.dumps([function_name, parameters], sort_keys=True, default=str)
 
 
 def format_html_response(text):
@@ -79,22 +81,40 @@ class DiscussChannel(models.Model):
     @api.model
     def _normalize_product_search_term(self, search_term):
         """
-        Task-specific prompt: normalizza termini di ricerca prodotti usando LLM.
+        Normalizza termini di ricerca prodotti (minuscolo, senza articoli, al singolare).
         
         PROBLEMA: Odoo search è case-sensitive e non gestisce varianti (plurali, articoli, case).
-        SOLUZIONE: LLM normalizza il termine in un formato standard per massimizzare match.
+        SOLUZIONE: normalizzatore locale (`product_normalizer`) guidato dal lessico dei
+        nomi prodotto; l'LLM (verdetto del turno o prompt dedicato) interviene solo se
+        abilitato in configurazione e la confidenza locale è sotto soglia.
         
         Esempio:
         - "i Cestini Rossi" → "cestino rosso"
         - "la Sedia ERGONOMICA" → "sedia ergonomica"
         - "Prodotto casuale" → "prodotto casuale"
-        
-        Questo riduce ~200 token dal system prompt spostando la logica qui.
         """
         if not search_term or len(search_term.strip()) < 2:
             return search_term
         
         original_term = search_term
+
+        normalized, confidence = normalize_term(search_term, get_lexicon(self.env))
+        config = self.env['ai.config'].sudo().search([('active', '=', True)], limit=1)
+        if not config.normalizer_llm_fallback or confidence >= config.normalizer_confidence_threshold:
+            _logger.info(f"✅ Normalizzazione locale: '{original_term}' → '{normalized}' (conf {confidence:.2f})")
+            return normalized or search_term
+
+        _logger.info(f"ℹ️ Normalizzazione locale incerta: '{original_term}' → '{normalized}' (conf {confidence:.2f}) - uso LLM")
+
+        # Verdetto del turno: il termine è già stato normalizzato dall'analisi combinata
+        verdict = get_turn_verdict()
+        normalized = lookup_search_term(verdict, search_term)
+        if normalized is None and verdict and verdict['search_terms'] and get_turn_verdict(search_term):
+            # Termine = intero messaggio utente (es. _prepare_search_params): primo prodotto citato
+            normalized = next(iter(verdict['search_terms'].values()))
+        if normalized is not None:
+            _logger.info(f"✅ Normalizzazione da analisi turno: '{original_term}' → '{normalized}'")
+            return normalized or search_term
         
         try:
             config = self.env['ai.config'].get_active_config()
@@ -117,7 +137,9 @@ class DiscussChannel(models.Model):
                 "Output: "
             )
             
-            response = self._get_gemini_response(config, [{'role': 'user', 'content': prompt}])
+            response = self._get_gemini_response(
+                config, [{'role': 'user', 'content': prompt}], task='normalize_search_term'
+            )
             normalized = response.strip().lower()
             
             # Pulizia finale
@@ -182,7 +204,22 @@ class DiscussChannel(models.Model):
             _logger.info(f"Intent chiaro: CONFIRM (order: {order_name or 'da ultimo bot msg'})")
             return ('confirm', order_name)
         
-        # STEP 2: Ambiguo → chiedi all'LLM (task-specific prompt)
+        # STEP 2: Ambiguo → verdetto dell'analisi turno se disponibile, altrimenti LLM dedicato
+        verdict = get_turn_verdict(user_message)
+        if verdict:
+            if verdict['intent'] == 'create':
+                _logger.info("Analisi turno: CREATE")
+                return ('create', None)
+            if verdict['intent'] == 'confirm':
+                order_name = None
+                match = re.search(r'\b(SO?\d+|S\d{5})\b', user_message + (last_bot_message_text or ''), re.I)
+                if match:
+                    order_name = match.group(1).upper()
+                _logger.info(f"Analisi turno: CONFIRM (order: {order_name})")
+                return ('confirm', order_name)
+            _logger.info("Analisi turno: UNCLEAR → None")
+            return (None, None)
+
         _logger.info(" Intent ambiguo, uso LLM classifier...")
         try:
             config = self.env['ai.config'].get_active_config()
@@ -200,7 +237,9 @@ class DiscussChannel(models.Model):
                 "RISPONDI UNA SOLA PAROLA: CREATE o CONFIRM o UNCLEAR"
             )
             
-            response = self._get_gemini_response(config, [{'role': 'user', 'content': prompt}])
+            response = self._get_gemini_response(
+                config, [{'role': 'user', 'content': prompt}], task='classify_order_intent'
+            )
             intent_str = response.strip().upper()
             
             if 'CREATE' in intent_str:
@@ -222,26 +261,102 @@ class DiscussChannel(models.Model):
             _logger.error(f"Intent classification failed: {e}", exc_info=True)
             return (None, None)
     
+    def _analyze_turn(self, user_message):
+        """
+        Task-specific prompt: analisi combinata del turno in UNA chiamata LLM.
+
+        Sostituisce la catena di classificatori (gate-cancel, catalogo completo,
+        normalizzazione termini, data di consegna, intent ordine): gli helper
+        leggono il verdetto tramite `turn_analyzer.get_turn_verdict`.
+
+        Returns:
+            dict: JSON grezzo dell'LLM (validato da `turn_analyzer.coerce_verdict`)
+        """
+        from odoo import fields
+
+        config = self.env['ai.config'].get_active_config()
+        now = fields.Datetime.context_timestamp(self, fields.Datetime.now())
+
+        last_bot_text = ''
+        if self and len(self) == 1:
+            last_bot_msg = self.env['mail.message'].search([
+                ('model', '=', self._name),
+                ('res_id', '=', self.id),
+                ('message_type', '=', 'comment'),
+                ('author_id', '!=', self.env.user.partner_id.id),
+            ], order='id desc', limit=1)
+            if last_bot_msg:
+                last_bot_text = re.sub(r'<[^>]+>', '', last_bot_msg.body or '').strip()[:300]
+
+        prompt = (
+            "Analizza il messaggio utente e rispondi con UN SOLO oggetto JSON:\n"
+            '{"intent": "create|confirm|other", "cancel_gate": true|false, "full_catalog": true|false, '
+            '"search_terms": [{"raw": "...", "normalized": "..."}], '
+            '"when": {"absolute": "YYYY-MM-DD HH:MM:SS"} | {"relative": "PnYnMnWnDTnHnMnS"} | {}}\n\n'
+            "REGOLE:\n"
+            "- intent: create = vuole creare un NUOVO ordine; confirm = vuole confermare un ordine ESISTENTE in bozza; "
+            "altrimenti other\n"
+            "- cancel_gate: true SOLO se vuole annullare/fermare l'operazione in attesa di conferma "
+            "('no grazie', 'annulla', 'annulla tutto', 'non procedere', 'stop'); false se parla di documenti "
+            "('annulla ordine', 'elimina preventivo', 'annulla consegna WH/OUT/00012') o vuole modificare dati/date\n"
+            "- full_catalog: true SOLO se chiede TUTTI i prodotti o il catalogo completo senza filtri\n"
+            "- search_terms: un elemento per ogni prodotto citato; raw = testo esatto del messaggio, "
+            "normalized = minuscolo, senza articoli, al SINGOLARE, aggettivi mantenuti "
+            "('i Cestini Rossi' → 'cestino rosso', '5 armadi metallici' → 'armadio metallico'); [] se nessuno\n"
+            "- when: data/ora di consegna richiesta; absolute se risolvibile rispetto a NOW, "
+            "altrimenti relative ISO 8601 (5 giorni → P5D, 1 settimana → P1W); {} se assente\n\n"
+            f"NOW: {now.strftime('%Y-%m-%d %H:%M:%S')} Europe/Rome\n"
+            f"Ultimo messaggio bot: {last_bot_text or 'nessuno'}\n"
+            f"Messaggio utente: {user_message}"
+        )
+
+        response = self._get_gemini_response(
+            config, [{'role': 'user', 'content': prompt}], task='analyze_turn'
+        )
+        match = re.search(r'\{.*\}', response or '', re.S)
+        if not match:
+            raise ValueError(f"risposta senza JSON: {(response or '')[:100]}")
+        data = json.loads(match.group(0))
+        _logger.info(f"🧭 Analisi turno: {json.dumps(data, ensure_ascii=False)}")
+        return data
+
     @api.model
-    def _get_gemini_response(self, config, messages, retry_count=0, max_retries=2):
+    def _get_gemini_response(self, config, messages, retry_count=0, max_retries=2, task=None, stream=None):
         """Dispatcher LLM: usa Gemini o OpenRouter in base al provider.
 
         Args:
             config: record `ai.config` attivo
             messages: lista di dict `{"role": "user"|"assistant", "content": "..."}`
+            task: nome di un profilo in `LLM_TASK_PROFILES` (o un `LLMTaskProfile`)
+                per le chiamate di servizio: usa il suo system prompt minimale,
+                max token e temperatura invece di quelli della configurazione
+            stream: `ChatStream` che riceve testo e chiamate funzione man mano
+                che arrivano (risposta in streaming); il valore restituito è
+                comunque la risposta completa
         """
 
         provider = (config.provider or 'gemini').lower()
         if provider == 'openrouter':
-            return self._call_openrouter(config, messages)
+            return self._call_openrouter(config, messages, task=task, stream=stream)
 
         # Default: comportamento attuale Gemini
-        return self._call_gemini(config, messages, retry_count=retry_count, max_retries=max_retries)
+        return self._call_gemini(config, messages, retry_count=retry_count, max_retries=max_retries, task=task, stream=stream)
 
     @api.model
-    def _call_gemini(self, config, messages, retry_count=0, max_retries=2):
+    def _call_gemini(self, config, messages, retry_count=0, max_retries=2, task=None, stream=None):
         """Chiama l'API di Gemini con retry automatico su errori 503."""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.model_name}:generateContent"
+        profile = get_task_profile(task)
+        system_prompt = profile.system_prompt if profile else config.system_prompt
+        # Function calling nativo solo per le chiamate conversazionali
+        native_tools = not profile and config.function_calling == 'native'
+        if native_tools and system_prompt:
+            system_prompt += NATIVE_TOOLS_INSTRUCTION
+        base_url = self.env['ir.config_parameter'].sudo().get_param('ai_livebot.gemini_api_base') or GEMINI_API_BASE
+        url = f"{base_url}/models/{config.model_name}:generateContent"
+        request_params = {"key": None}
+        if stream is not None:
+            url = f"{base_url}/models/{config.model_name}:streamGenerateContent"
+            request_params["alt"] = "sse"
         
         # Costruisci il payload per Gemini
         contents = []
@@ -258,41 +373,99 @@ class DiscussChannel(models.Model):
         payload = {
             "contents": contents,
             "generationConfig": {
-                "temperature": config.temperature,
-                "maxOutputTokens": config.max_tokens,
+                "temperature": profile.temperature if profile else config.temperature,
+                "maxOutputTokens": profile.max_tokens if profile else config.max_tokens,
             }
         }
 
-        # Aggiungo system_instruction se il prompt è definito
-        if config.system_prompt:
-            payload["system_instruction"] = {
-                "parts": [{"text": config.system_prompt}]
+        # Modelli 2.5 "thinking": i token di ragionamento consumano maxOutputTokens,
+        # per le chiamate di servizio li azzeriamo (flash) o li limitiamo al minimo (pro)
+        if profile and 'gemini-2.5' in (config.model_name or ''):
+            thinking_budget = 0 if 'flash' in config.model_name else 128
+            payload["generationConfig"]["thinkingConfig"] = {"thinkingBudget": thinking_budget}
+            payload["generationConfig"]["maxOutputTokens"] += thinking_budget
+
+        # Scegli la chiave corretta (campo provider-specifico se presente)
+        api_key = config.gemini_api_key or config.api_key
+        request_params["key"] = api_key
+        client = get_http_client(config.http_pool_size)
+
+        # Dichiarazioni delle funzioni: con il context cache vanno nel contenuto cachato
+        # (Gemini rifiuta tools inline insieme a cachedContent)
+        tool_fields = None
+        if native_tools:
+            tool_fields = {
+                "tools": gemini_tools(self._get_available_functions()),
+                "toolConfig": {"functionCallingConfig": {"mode": "AUTO"}},
             }
-            _logger.debug(f"System instruction presente ({len(config.system_prompt)} caratteri)")
+
+        # System prompt: riferimento al context cache lato server se disponibile,
+        # altrimenti system_instruction inline (i prompt dei task sono troppo corti per il cache)
+        system_instruction = None
+        cached_content = None
+        if system_prompt:
+            system_instruction = {"parts": [{"text": system_prompt}]}
+            if config.gemini_context_cache and not profile:
+                cached_content = get_gemini_context_cache().get_handle(
+                    client, base_url, api_key, config.model_name, system_prompt,
+                    ttl=config.gemini_cache_ttl or DEFAULT_CACHE_TTL,
+                    extra_fields=tool_fields,
+                )
+
+            if cached_content:
+                payload["cachedContent"] = cached_content
+                _logger.debug(f"System instruction da context cache {cached_content}")
+            else:
+                payload["system_instruction"] = system_instruction
+                _logger.debug(f"System instruction presente ({len(system_prompt)} caratteri)")
         else:
             _logger.debug("System instruction omesso (prompt vuoto/None)")
-        
-        # Scegli la chiave corretta (campo provider-specifico se presente)
-        api_key = config.gemini_api_key or config.api_key
+
+        if tool_fields and not cached_content:
+            payload.update(tool_fields)
 
         headers = {
             "Content-Type": "application/json"
         }
         
         try:
-            response = requests.post(
+            response = client.post(
                 url,
-                params={"key": api_key},
+                params=request_params,
                 headers=headers,
                 json=payload,
-                timeout=30
+                timeout=30,
+                stream=stream is not None,
             )
+
+            # Handle rifiutato (scaduto/eliminato lato server): scarta e riprova inline
+            if cached_content and response.status_code in (400, 403, 404):
+                _logger.warning(f"⚠️ Context cache {cached_content} rifiutato ({response.status_code}) - riprovo inline")
+                get_gemini_context_cache().invalidate(cached_content)
+                payload.pop("cachedContent", None)
+                payload["system_instruction"] = system_instruction
+                if tool_fields:
+                    payload.update(tool_fields)
+                response = client.post(
+                    url,
+                    params=request_params,
+                    headers=headers,
+                    json=payload,
+                    timeout=30,
+                    stream=stream is not None,
+                )
             response.raise_for_status()
             
+            if stream is not None:
+                return self._read_gemini_stream(response, stream)
+            
             data = response.json()
             
             # debug
             _logger.info(f"Gemini API response: {json.dumps(data, indent=2)}")
+            usage = data.get('usageMetadata') or {}
+            if usage.get('cachedContentTokenCount'):
+                _logger.info(f"🗄️ Token da context cache: {usage['cachedContentTokenCount']}/{usage.get('promptTokenCount')}")
             
             # Gestione risposta
             if 'candidates' not in data or len(data['candidates']) == 0:
@@ -318,7 +491,17 @@ class DiscussChannel(models.Model):
                 _logger.error(f"Campo 'parts' mancante o vuoto in content: {content}")
                 return "Errore: risposta API malformata (manca 'parts')"
             
-            text = content['parts'][0].get('text', '')
+            # Testo (tutte le parti, esclusi i "pensieri") e tool call native
+            text = ''.join(
+                part.get('text', '') for part in content['parts'] if 'text' in part and not part.get('thought')
+            )
+            function_calls = [
+                (part['functionCall'].get('name'), coerce_tool_args(part['functionCall'].get('args') or {}))
+                for part in content['parts'] if part.get('functionCall')
+            ]
+            if function_calls:
+                _logger.info(f"🛠️ Tool call native Gemini: {[name for name, _ in function_calls]}")
+                return LLMReply(text, function_calls)
             if not text:
                 _logger.warning(f"Testo vuoto nella risposta: {content}")
                 return "Errore: risposta AI vuota"
@@ -334,7 +517,7 @@ class DiscussChannel(models.Model):
                 wait_time = (retry_count + 1) * 2  # Backoff esponenziale: 2s, 4s, 6s...
                 _logger.warning(f"⚠️ Errore 503 da Gemini (tentativo {retry_count + 1}/{max_retries + 1}) - riprovo tra {wait_time}s...")
                 time.sleep(wait_time)
-                return self._get_gemini_response(config, messages, retry_count=retry_count + 1, max_retries=max_retries)
+                return self._get_gemini_response(config, messages, retry_count=retry_count + 1, max_retries=max_retries, task=task, stream=stream)
             
             _logger.error(f"Errore chiamata Gemini API: {e}")
             
@@ -354,14 +537,124 @@ class DiscussChannel(models.Model):
             return f"Errore imprevisto: {str(e)}"
 
     @api.model
-    def _call_openrouter(self, config, messages):
+    def _feed_stream(self, detector, chunk, stream):
+        """Passa un chunk di testo al rilevatore di tag e inoltra testo e tag completi allo stream."""
+        text, tags = detector.feed(chunk)
+        stream.push_text(text)
+        for tag in tags:
+            stream.push_function(tag.name, tag.params)
+
+    @api.model
+    def _finish_stream(self, detector, stream):
+        text, tags = detector.finish()
+        stream.push_text(text)
+        for tag in tags:
+            stream.push_function(tag.name, tag.params)
+        stream.flush()
+
+    @api.model
+    def _read_gemini_stream(self, response, stream):
+        """
+        Consuma la risposta SSE di `streamGenerateContent`: ogni evento è una
+        GenerateContentResponse parziale con le nuove parti di testo o le
+        functionCall complete.
+        """
+        detector = IncrementalTagDetector()
+        native_calls = []
+        finish_reason = None
+        usage = {}
+        try:
+            for event in iter_sse_json(response):
+                usage = event.get('usageMetadata') or usage
+                candidates = event.get('candidates') or []
+                if not candidates:
+                    continue
+                candidate = candidates[0]
+                finish_reason = candidate.get('finishReason') or finish_reason
+                for part in (candidate.get('content') or {}).get('parts') or []:
+                    if part.get('functionCall'):
+                        call = (part['functionCall'].get('name'), coerce_tool_args(part['functionCall'].get('args') or {}))
+                        native_calls.append(call)
+                        stream.push_function(*call)
+                    elif 'text' in part and not part.get('thought'):
+                        self._feed_stream(detector, part['text'], stream)
+        finally:
+            response.close()
+        self._finish_stream(detector, stream)
+
+        if usage.get('cachedContentTokenCount'):
+            _logger.info(f"🗄️ Token da context cache: {usage['cachedContentTokenCount']}/{usage.get('promptTokenCount')}")
+        _logger.info(f"Gemini stream completato: {len(detector.text)} caratteri, finishReason={finish_reason}")
+
+        if finish_reason and finish_reason != 'STOP':
+            _logger.warning(f"Risposta bloccata: {finish_reason}")
+            return f"La risposta è stata bloccata per motivi di sicurezza ({finish_reason})"
+        if native_calls:
+            return LLMReply(detector.text, native_calls)
+        if not detector.text:
+            return "Errore: risposta AI vuota"
+        return detector.text
+
+    @api.model
+    def _read_openrouter_stream(self, response, stream):
+        """
+        Consuma la risposta SSE di OpenRouter: `delta.content` per il testo,
+        `delta.tool_calls` con gli argomenti a pezzi (una tool call è
+        completa quando inizia la successiva o finisce lo stream).
+        """
+        detector = IncrementalTagDetector()
+        tool_calls = []
+
+        def complete_call(call):
+            call['args'] = coerce_tool_args(''.join(call['arguments']))
+            stream.push_function(call['name'], call['args'])
+
+        try:
+            for event in iter_sse_json(response):
+                choices = event.get('choices') or []
+                if not choices:
+                    continue
+                delta = choices[0].get('delta') or {}
+                if delta.get('content'):
+                    self._feed_stream(detector, delta['content'], stream)
+                for call_delta in delta.get('tool_calls') or []:
+                    index = call_delta.get('index', max(len(tool_calls) - 1, 0))
+                    if index >= len(tool_calls):
+                        if tool_calls:
+                            complete_call(tool_calls[-1])
+                        tool_calls.append({'name': '', 'arguments': []})
+                        index = len(tool_calls) - 1
+                    function = call_delta.get('function') or {}
+                    if function.get('name'):
+                        tool_calls[index]['name'] = function['name']
+                    if function.get('arguments'):
+                        tool_calls[index]['arguments'].append(function['arguments'])
+        finally:
+            response.close()
+        if tool_calls:
+            complete_call(tool_calls[-1])
+        self._finish_stream(detector, stream)
+
+        _logger.info(f"OpenRouter stream completato: {len(detector.text)} caratteri, {len(tool_calls)} tool call")
+        if tool_calls:
+            return LLMReply(detector.text, [(call['name'], call['args']) for call in tool_calls])
+        if not detector.text:
+            return "Errore: risposta AI vuota"
+        return detector.text
+
+    @api.model
+    def _call_openrouter(self, config, messages, task=None, stream=None):
         """Chiama OpenRouter (endpoint stile OpenAI chat/completions)."""
 
         url = "https://openrouter.ai/api/v1/chat/completions"
+        profile = get_task_profile(task)
+        native_tools = not profile and config.function_calling == 'native'
 
         # Mappa i messaggi nel formato OpenAI-like
         chat_messages = []
-        system_prompt = (config.system_prompt or '').strip()
+        system_prompt = ((profile.system_prompt if profile else config.system_prompt) or '').strip()
+        if native_tools and system_prompt:
+            system_prompt += NATIVE_TOOLS_INSTRUCTION
         if system_prompt:
             chat_messages.append({
                 "role": "system",
@@ -380,11 +673,18 @@ class DiscussChannel(models.Model):
         payload = {
             "model": config.model_name,
             "messages": chat_messages,
-            "temperature": config.temperature,
+            "temperature": profile.temperature if profile else config.temperature,
         }
+        if native_tools:
+            payload["tools"] = openai_tools(self._get_available_functions())
+            payload["tool_choice"] = "auto"
+        if stream is not None:
+            payload["stream"] = True
 
         # Usa max_tokens se presente nel modello (anche se nascosto dalla vista)
-        if getattr(config, 'max_tokens', None):
+        if profile:
+            payload["max_tokens"] = profile.max_tokens
+        elif getattr(config, 'max_tokens', None):
             try:
                 mt = int(config.max_tokens)
                 if mt > 0:
@@ -401,14 +701,18 @@ class DiscussChannel(models.Model):
         }
 
         try:
-            response = requests.post(
+            response = get_http_client(config.http_pool_size).post(
                 url,
                 headers=headers,
                 json=payload,
                 timeout=30,
+                stream=stream is not None,
             )
             response.raise_for_status()
 
+            if stream is not None:
+                return self._read_openrouter_stream(response, stream)
+
             data = response.json()
             _logger.info(f"OpenRouter API response: {json.dumps(data, indent=2)}")
 
@@ -418,7 +722,14 @@ class DiscussChannel(models.Model):
                 return "Errore: risposta API senza risultati"
 
             message = choices[0].get('message') or {}
-            content = message.get('content', '')
+            content = message.get('content') or ''
+            function_calls = [
+                ((call.get('function') or {}).get('name'), coerce_tool_args((call.get('function') or {}).get('arguments')))
+                for call in message.get('tool_calls') or []
+            ]
+            if function_calls:
+                _logger.info(f"🛠️ Tool call native OpenRouter: {[name for name, _ in function_calls]}")
+                return LLMReply(content, function_calls)
             if not content:
                 _logger.warning(f"Testo vuoto nella risposta OpenRouter: {message}")
                 return "Errore: risposta AI vuota"
@@ -437,591 +748,195 @@ class DiscussChannel(models.Model):
     
     @api.model
     def _get_available_functions(self):
-        """Definisce le funzioni disponibili per l'AI"""
-        return {
-            "get_stock_info": {
-                "description": "Ottiene informazioni sullo stock di un prodotto specifico",
-                "parameters": {
-                    "product_name": "Nome del prodotto da cercare"
-                }
-            },
-            "search_partners": {
-                "description": "Cerca clienti/partner per nome/email/telefono",
-                "parameters": {
-                    "search_term": "Testo da cercare (es. 'Marco')",
-                    "limit": "Numero massimo risultati (default 5)"
-                }
-            },
-            "search_products": {
-                "description": "Cerca prodotti nel catalogo. Supporta filtro per tipo: beni fisici, servizi, combo",
-                "parameters": {
-                    "search_term": "Termine di ricerca (opzionale)",
-                    "limit": "Numero massimo risultati (default 50)",
-                    "product_type": "Filtra per tipo (opzionale): 'product' (beni fisici/goods), 'service' (servizio), 'combo' (prodotto combo), None (tutti i tipi)"
-                }
-            },
-            "get_pending_orders": {
-                "description": "Ottiene ordini in sospeso. Può filtrare per tipo: ricezioni (incoming) o consegne (outgoing)",
-                "parameters": {
-                    "order_type": "Opzionale: 'incoming' per ricezioni, 'outgoing' per consegne. Se omesso mostra tutti",
-                    "limit": "Numero massimo risultati (default 10)"
-                }
-            },
-            "get_delivery_details": {
-                "description": "Ottiene dettagli completi di un Delivery/Transfer, inclusi TUTTI i movimenti con move_id. USA QUESTA funzione PRIMA di update_delivery per sapere quali prodotti ci sono e i loro move_id",
-                "parameters": {
-                    "picking_name": "Nome del delivery (es. 'WH/OUT/00013') OPPURE",
-                    "picking_id": "ID numerico del picking"
-                }
-            },
-            "validate_delivery": {
-                "description": "Valida ed evade un ordine di consegna (spedizione fisica). Scarica lo stock dal magazzino",
-                "parameters": {
-                    "picking_id": "ID numerico del picking (es. 35) OPPURE",
-                    "picking_name": "Nome del delivery (es. 'WH/OUT/00035')"
-                }
-            },
-            "process_delivery_decision": {
-                "description": "Applica la scelta utente dopo tentativo di validazione quando quantità non completamente prenotate. Usa wizard nativi Odoo per gestire backorder o trasferimento immediato",
-                "parameters": {
-                    "picking_id": "ID numerico del picking (es. 35) OPPURE",
-                    "picking_name": "Nome del delivery (es. 'WH/OUT/00035')",
-                    "decision": "Scelta utente: 'backorder' (crea backorder) | 'no_backorder' (scarta residuo) | 'immediate' (trasferimento immediato)"
-                }
-            },
-            "create_sales_order": {
-                "description": "FLUSSO STANDARD per 'ordini da evadere': crea un Sales Order e lo conferma. La conferma genera automaticamente i Delivery secondo le regole di magazzino (1/2/3 step). Assicura tracciabilità commerciale completa (preventivo→ordine→consegna→fattura) con prezzi, sconti e tasse corretti",
-                "parameters": {
-                    "partner_name": "Nome del cliente",
-                    "order_lines": "Lista righe: [{'product_id': 1, 'quantity': 5, 'price_unit': 100.0}]. price_unit è opzionale (usa listino se omesso)",
-                    "confirm": "Opzionale (default True): se True conferma l'ordine e genera i picking automaticamente",
-                    "scheduled_date": "Opzionale: Data pianificata consegna (formato ISO: '2025-10-21' o '2025-10-21 14:00:00'). Se specificata, imposta la data del delivery"
-                }
-            },
-            "create_partner": {
-                "description": "Crea un nuovo cliente (res.partner) se non esiste. Usa questo quando l'utente chiede di creare un ordine per un cliente non presente.",
-                "parameters": {
-                    "name": "Nome completo del cliente (obbligatorio)",
-                    "email": "Email (opzionale)",
-                    "phone": "Telefono (opzionale)",
-                    "mobile": "Cellulare (opzionale)",
-                    "street": "Indirizzo (opzionale)",
-                    "city": "Città (opzionale)",
-                    "zip": "CAP (opzionale)",
-                    "country_code": "Codice nazione ISO-2 es. IT (opzionale)",
-                    "vat": "Partita IVA (opzionale)",
-                    "company_name": "Azienda collegata (opzionale)",
-                    "is_company": "True se il partner è un'azienda (default False)"
-                }
-            },
-            "create_delivery_order": {
-                "description": "SOLO per casi ECCEZIONALI (omaggi, sostituzioni, campionature): crea un Transfer diretto senza Sales Order. ATTENZIONE: salta prezzi, condizioni commerciali e collegamento fatturazione. Per ordini commerciali normali usa create_sales_order",
-                "parameters": {
-                    "partner_name": "Nome del destinatario",
-                    "product_items": "Lista prodotti: [{'product_id': 1, 'quantity': 5}]"
-                }
-            },
-            "update_sales_order": {
-                "description": "Aggiorna un Sales Order esistente (SOLO in stato draft/sent): modifica quantità, aggiungi/rimuovi righe, cambia data consegna. NON funziona su ordini già confermati. SUPPORTA product_name per ricerca automatica prodotto!",
-                "parameters": {
-                    "order_name": "Nome ordine (es. 'SO042') OPPURE",
-                    "order_id": "ID numerico dell'ordine",
-                    "order_lines_updates": "Lista modifiche: [{'line_id': 123, 'quantity': 10}, {'product_id': 25, 'quantity': 5}, {'product_name': 'sedia ufficio', 'quantity': 3}, {'line_id': 124, 'delete': True}]",
-                    "scheduled_date": "Data consegna pianificata (formato ISO: '2025-10-21' o '2025-10-21 14:00:00') - OPZIONALE"
-                }
-            },
-            "confirm_sales_order": {
-                "description": "Conferma un Sales Order passandolo da draft/sent a sale. Genera automaticamente i Delivery Order. Usa questa funzione quando l'utente vuole confermare, validare o far passare un ordine a 'sale order'",
-                "parameters": {
-                    "order_name": "Nome ordine (es. 'S00042') OPPURE",
-                    "order_id": "ID numerico dell'ordine"
-                }
-            },
-            "cancel_sales_order": {
-                "description": "Cancella un Sales Order (stato -> cancel). Cancella automaticamente i Delivery NON ancora evasi. NON può cancellare ordini con delivery già validati. Usa quando l'utente vuole annullare, cancellare o eliminare un ordine",
-                "parameters": {
-                    "order_name": "Nome ordine (es. 'S00042') OPPURE",
-                    "order_id": "ID numerico dell'ordine"
-                }
-            },
-            "update_delivery": {
-                "description": "Modifica quantità su Delivery/Transfer NON ancora validato (state != done). Per modificare delivery già evasi è impossibile",
-                "parameters": {
-                    "picking_name": "Nome delivery (es. 'WH/OUT/00025') OPPURE",
-                    "picking_id": "ID numerico del picking",
-                    "move_updates": "Lista modifiche: [{'move_id': 123, 'quantity': 10}, {'product_id': 25, 'quantity': 5}, {'move_id': 124, 'delete': True}]"
-                }
-            },
-            "get_sales_overview": {
-                "description": "Ottiene panoramica ordini di vendita con statistiche e lista ordini. Ideale per vedere situazione vendite nel periodo",
-                "parameters": {
-                    "period": "Periodo: 'day', 'week', 'month' (default), 'year', 'all'",
-                    "state": "Filtra per stato ('draft', 'sent', 'sale', 'done', 'cancel'). Se omesso mostra tutti",
-                    "limit": "Massimo ordini (default 100)"
-                }
-            },
-            "get_sales_order_details": {
-                "description": "Ottiene dettagli completi di un ordine di vendita specifico: righe prodotto, delivery collegati, fatture",
-                "parameters": {
-                    "order_name": "Nome ordine (es. 'S00034') OPPURE",
-                    "order_id": "ID numerico ordine"
-                }
-            },
-            "get_top_customers": {
-                "description": "Classifica top clienti per fatturato nel periodo con statistiche vendite",
-                "parameters": {
-                    "period": "Periodo: 'month' (default), 'quarter', 'year', 'all'",
-                    "limit": "Numero clienti da mostrare (default 10)"
-                }
-            },
-            "get_products_sales_stats": {
-                "description": "Statistiche prodotti più venduti nel periodo con quantità e fatturato",
-                "parameters": {
-                    "period": "Periodo: 'month' (default), 'quarter', 'year', 'all'",
-                    "limit": "Numero prodotti da mostrare (default 20)"
-                }
-            }
-        }
+        """Definisce le funzioni disponibili per l'AI (dal registro `ai_functions`)"""
+        return get_function_registry(self.env).available_functions
     
+    @api.model
+    def _prefetch_function(self, function_name, parameters):
+        """
+        Esegue in anticipo una funzione di sola lettura arrivata nello stream:
+        `_execute_function` con gli stessi parametri, nello stesso turno, riusa il risultato.
+        """
+        memo = turn_memo()
+        if memo is None or function_name not in get_function_registry(self.env).read_only:
+            return
+        key = _function_memo_key(function_name, parameters)
+        if key not in memo:
+            _logger.info(f"⚡ Esecuzione anticipata durante lo stream: {function_name}")
+            memo[key] = self._execute_function(function_name, parameters)
+
+    @api.model
+    def _prefetched_result(self, function_name, parameters):
+        """Risultato di una funzione già eseguita in anticipo nel turno (consumato), o None."""
+        memo = turn_memo()
+        if not memo or function_name not in get_function_registry(self.env).read_only:
+            return None
+        result = memo.pop(_function_memo_key(function_name, parameters), None)
+        if result is not None:
+            _logger.info(f"⚡ Risultato anticipato riusato: {function_name}")
+        return result
+
     @api.model
     def _execute_function(self, function_name, parameters):
-        """Esegue una funzione di warehouse operations"""
-        warehouse_ops = self.env['warehouse.operations']
-        
-        try:
-            if function_name == 'get_stock_info':
-                return warehouse_ops.get_stock_info(**parameters)
-            elif function_name == 'search_partners':
-                call_params = dict(parameters)
-                if 'limit' in call_params:
-                    try:
-                        call_params['limit'] = int(call_params['limit'])
-                    except (TypeError, ValueError):
-                        call_params['limit'] = 5
-                return warehouse_ops.search_partners(**call_params)
-            elif function_name == 'search_products':
-                call_params = dict(parameters)
-                
-                # NORMALIZZA SEARCH TERM: plurali italiani singolare + rimuovi articoli
-                if 'search_term' in call_params:
-                    call_params['search_term'] = self._normalize_product_search_term(call_params['search_term'])
-                
-                # Cast limit to int (AI può passarlo come stringa)
-                if 'limit' in call_params:
-                    try:
-                        call_params['limit'] = int(call_params['limit'])
-                    except (TypeError, ValueError):
-                        call_params['limit'] = 100  
-                else:
-                    # Se l'AI non specifica limit, usa un valore alto per "mostra tutti"
-                    call_params['limit'] = 100
-                
-                result = warehouse_ops.search_products(**call_params)
-                
-                # LOG DEBUG: verifica che list_price sia presente
-                _logger.info(f"=== search_products: {len(result)} risultati (limit={call_params.get('limit')}) ===")
-                for prod in result[:5]: 
-                    _logger.info(f"  • {prod['name']} (ID: {prod['id']}) - €{prod.get('list_price', 'N/A')} - {prod.get('qty_available', 'N/A')} unità - tipo: {prod.get('detailed_type', 'N/A')}")
-                if len(result) > 5:
-                    _logger.info(f"  ... e altri {len(result) - 5} prodotti")
-                _logger.info(f"=====================================")
-                
-                return result
-            elif function_name == 'get_pending_orders':
-                call_params = dict(parameters)
-                if 'limit' in call_params:
-                    try:
-                        call_params['limit'] = int(call_params['limit'])
-                    except (TypeError, ValueError):
-                        call_params['limit'] = 10
-                return warehouse_ops.get_pending_orders(**call_params)
-            elif function_name == 'get_delivery_details':
-                call_params = dict(parameters)
-                if 'picking_id' in call_params:
-                    try:
-                        call_params['picking_id'] = int(call_params['picking_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "picking_id deve essere un numero"}
-                return warehouse_ops.get_delivery_details(**call_params)
-            elif function_name == 'validate_delivery':
-                # Supporta picking_id O picking_name
-                call_params = dict(parameters)
-                if 'picking_id' in call_params:
-                    try:
-                        call_params['picking_id'] = int(call_params['picking_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "picking_id deve essere un numero"}
-                return warehouse_ops.validate_delivery(**call_params)
-            
-            elif function_name == 'process_delivery_decision':
-                # Gestione wizard backorder/immediate transfer
-                call_params = dict(parameters)
-                if 'picking_id' in call_params:
-                    try:
-                        call_params['picking_id'] = int(call_params['picking_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "picking_id deve essere un numero"}
-                return warehouse_ops.process_delivery_decision(**call_params)
-            
-            elif function_name == 'create_sales_order':
-                # VALIDAZIONE PARAMETRI - Correggi errori comuni dell'AI
-                call_params = dict(parameters)
-                
-                # Correggi "customer" → "partner_name"
-                if 'customer' in call_params:
-                    _logger.warning("AI ha usato 'customer' invece di 'partner_name' - correggo automaticamente")
-                    call_params['partner_name'] = call_params.pop('customer')
-                
-                # Correggi "cliente" → "partner_name"
-                if 'cliente' in call_params:
-                    _logger.warning("AI ha usato 'cliente' invece di 'partner_name' - correggo automaticamente")
-                    call_params['partner_name'] = call_params.pop('cliente')
-                
-                # Blocca "products" (impossibile correggere automaticamente)
-                if 'products' in call_params:
-                    _logger.error("AI ha usato 'products' invece di 'order_lines' - impossibile correggere")
-                    return {
-                        "error": "Parametri non validi",
-                        "details": "Usa 'partner_name' e 'order_lines', NON 'customer' e 'products'",
-                        "correct_format": "[FUNCTION:create_sales_order|partner_name:CLIENTE|order_lines:[{\"product_id\":ID,\"quantity\":QTY}]|confirm:true]",
-                        "ai_instruction": "RIPROVA con il formato corretto sopra. USA search_products PRIMA per trovare il product_id."
-                    }
-                
-                # Verifica parametri obbligatori
-                if 'partner_name' not in call_params:
-                    return {
-                        "error": "Parametro obbligatorio 'partner_name' mancante",
-                        "ai_instruction": "USA: partner_name (NON customer, NON cliente)"
-                    }
-                
-                if 'order_lines' not in call_params:
-                    return {
-                        "error": "Parametro obbligatorio 'order_lines' mancante",
-                        "ai_instruction": "USA: order_lines:[{\"product_id\":ID,\"quantity\":QTY}] (NON products, NON items). Devi chiamare search_products PRIMA per ottenere il product_id."
-                    }
-                
-                # Gestisci confirm
-                if 'confirm' in call_params:
-                    confirm_val = call_params['confirm']
-                    if isinstance(confirm_val, str):
-                        call_params['confirm'] = confirm_val.lower() in ('true', '1', 'yes')
-                    else:
-                        call_params['confirm'] = bool(confirm_val)
-                
-                # Gestisci scheduled_date (converte stringa ISO in datetime se necessario)
-                if 'scheduled_date' in call_params and call_params['scheduled_date']:
-                    scheduled_str = call_params['scheduled_date']
-                    if isinstance(scheduled_str, str):
-                        try:
-                            from datetime import datetime
-                            # Prova formati: "2025-10-21" o "2025-10-21 14:00:00"
-                            if ' ' in scheduled_str:
-                                call_params['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d %H:%M:%S")
-                            else:
-                                call_params['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d")
-                        except ValueError as e:
-                            _logger.warning(f"Formato data non valido '{scheduled_str}': {e} - ignoro scheduled_date")
-                            call_params.pop('scheduled_date', None)
-                
-                # 🚨 GATE DI CONFERMA: NON eseguire create_sales_order direttamente
-                # Invece, restituisci un marker per richiedere conferma all'utente
-                _logger.warning("⚠️ AI ha tentato create_sales_order senza conferma - RICHIEDO CONFERMA")
-                
-                # Prepara JSON per il marker (converti datetime in stringa)
-                marker_params = dict(call_params)
-                if 'scheduled_date' in marker_params and hasattr(marker_params['scheduled_date'], 'strftime'):
-                    marker_params['scheduled_date'] = marker_params['scheduled_date'].strftime("%Y-%m-%d")
-                
-                # Calcola totale stimato
-                total_estimate = 0.0
-                product_list = []
-                for line in call_params.get('order_lines', []):
-                    product_id = line.get('product_id')
-                    quantity = line.get('quantity', 0)
-                    if product_id:
-                        product = self.env['product.product'].browse(product_id)
-                        if product.exists():
-                            price = line.get('price_unit', product.list_price)
-                            total_estimate += price * quantity
-                            product_list.append(f"{product.name} ({quantity} pz) - €{price * quantity:.2f}")
-                
-                # Restituisci messaggio con marker invece di eseguire
-                return {
-                    "requires_confirmation": True,
-                    "pending_params": marker_params,
-                    "summary": {
-                        "partner_name": call_params.get('partner_name'),
-                        "products": product_list,
-                        "scheduled_date": marker_params.get('scheduled_date', 'oggi'),
-                        "total_estimate": total_estimate
-                    },
-                    "message": (
-                        f"📦 Riepilogo Ordine\n\n"
-                        f"Cliente: {call_params.get('partner_name')}\n"
-                        f"Prodotti:\n  • " + "\n  • ".join(product_list) + "\n"
-                        f"Data consegna: {marker_params.get('scheduled_date', 'oggi')}\n"
-                        f"Totale stimato: €{total_estimate:.2f}\n\n"
-                        f"{PENDING_SO_MARKER} {json.dumps(marker_params)}\n\n"
-                        f"Confermi? (rispondi SÌ/CONFERMO/OK VAI)"
-                    )
-                }
-            elif function_name == 'create_partner':
-                call_params = dict(parameters)
-                # Normalizza is_company
-                if 'is_company' in call_params:
-                    v = call_params['is_company']
-                    call_params['is_company'] = (str(v).lower() in ('true', '1', 'yes')) if isinstance(v, str) else bool(v)
-                return warehouse_ops.create_partner(**call_params)
-            
-            elif function_name == 'create_delivery_order':
-                # VALIDAZIONE per delivery_order
-                call_params = dict(parameters)
-                
-                if 'customer' in call_params:
-                    _logger.warning("AI ha usato 'customer' invece di 'partner_name' in delivery_order - correggo")
-                    call_params['partner_name'] = call_params.pop('customer')
-                
-                if 'products' in call_params:
-                    return {
-                        "error": "Usa 'product_items' invece di 'products'",
-                        "correct_format": "product_items:[{\"product_id\":ID,\"quantity\":QTY}]"
-                    }
-                
-                return warehouse_ops.create_delivery_order(**call_params)
-            
-            elif function_name == 'update_sales_order':
-                call_params = dict(parameters)
-                
-                # Converti order_id se presente
-                if 'order_id' in call_params:
-                    try:
-                        call_params['order_id'] = int(call_params['order_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "order_id deve essere un numero"}
-                
-                return warehouse_ops.update_sales_order(**call_params)
-            
-            elif function_name == 'confirm_sales_order':
-                call_params = dict(parameters)
-                
-                # Converti order_id se presente
-                if 'order_id' in call_params:
-                    try:
-                        call_params['order_id'] = int(call_params['order_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "order_id deve essere un numero"}
-                
-                return warehouse_ops.confirm_sales_order(**call_params)
-            
-            elif function_name == 'cancel_sales_order':
-                call_params = dict(parameters)
-                
-                # Converti order_id se presente
-                if 'order_id' in call_params:
-                    try:
-                        call_params['order_id'] = int(call_params['order_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "order_id deve essere un numero"}
-
-                # Gestione conferma: se non esplicitamente confermato, richiedi conferma all'utente
-                confirm_flag = call_params.pop('confirm', False)
-                if isinstance(confirm_flag, str):
-                    confirm_flag = confirm_flag.lower() in ('true', '1', 'yes', 'si', 'sì', 's')
-
-                if not confirm_flag:
-                    # Non eseguire la cancellazione: chiedi conferma usando un marker JSON
-                    try:
-                        params_for_marker = {}
-                        # Mantieni solo order_name/order_id per il marker
-                        if 'order_id' in call_params:
-                            params_for_marker['order_id'] = call_params['order_id']
-                        if 'order_name' in call_params:
-                            params_for_marker['order_name'] = call_params['order_name']
-
-                        marker_json = json.dumps(params_for_marker)
-                        message = (
-                            f"⚠️ Stai per cancellare l'ordine {params_for_marker.get('order_name', params_for_marker.get('order_id', ''))}. "
-                            "Questa operazione è distruttiva e non può essere annullata.\n\n"
-                            "Confermi la cancellazione? (rispondi SÌ/CONFERMO per procedere)\n\n"
-                            f"{PENDING_CANCEL_MARKER} {marker_json}"
-                        )
-                        return {"requires_confirmation": True, "message": message}
-                    except Exception:
-                        # In caso di problema con il marker, fall back alla cancellazione diretta
-                        _logger.exception("Errore creando marker conferma cancellazione - procedo con cancellazione diretta")
+        """Esegue una funzione del registro (`ai_functions`) con argomenti convertiti, dalla cache se ammesso"""
+        function = get_function_registry(self.env).get(function_name)
+        if function is None:
+            return {"error": f"Funzione '{function_name}' non trovata"}
 
-                # Confermato: esegui la cancellazione
-                return warehouse_ops.cancel_sales_order(**call_params)
-            
-            elif function_name == 'update_delivery':
-                call_params = dict(parameters)
-                
-                # Converti picking_id se presente
-                if 'picking_id' in call_params:
-                    try:
-                        call_params['picking_id'] = int(call_params['picking_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "picking_id deve essere un numero"}
-                
-                return warehouse_ops.update_delivery(**call_params)
-            
-            # ========== SALES MANAGEMENT ==========
-            elif function_name == 'get_sales_overview':
-                return warehouse_ops.get_sales_overview(**parameters)
-            
-            elif function_name == 'get_sales_order_details':
-                call_params = dict(parameters)
-                if 'order_id' in call_params:
-                    try:
-                        call_params['order_id'] = int(call_params['order_id'])
-                    except (TypeError, ValueError):
-                        return {"error": "order_id deve essere un numero"}
-                
-                # 🔧 SUPPORTO FLAG "internal" per chiamate silenziose
-                # Se internal=true, ritorna solo il JSON grezzo senza formattazione
-                # Serve per workflow multi-step dove l'AI deve estrarre line_id
-                # e continuare con update_sales_order nello stesso turno
-                is_internal = call_params.pop('internal', False)
-                if isinstance(is_internal, str):
-                    is_internal = is_internal.lower() in ('true', '1', 'yes')
-                
-                result = warehouse_ops.get_sales_order_details(**call_params)
-                
-                # Se chiamata interna, aggiungi marker per impedire formattazione
-                if is_internal:
-                    if isinstance(result, dict):
-                        result['_internal_call'] = True  # Marker per odoobot_override.py
-                
-                return result
-            
-            elif function_name == 'get_top_customers':
-                return warehouse_ops.get_top_customers(**parameters)
-            
-            elif function_name == 'get_products_sales_stats':
-                return warehouse_ops.get_products_sales_stats(**parameters)
-            
+        prefetched = self._prefetched_result(function_name, parameters)
+        if prefetched is not None:
+            return prefetched
+
+        try:
+            params = function.coerce(parameters)
+            if function.handler:
+                compute = lambda: getattr(self, function.handler)(function, params)
             else:
-                return {"error": f"Funzione '{function_name}' non trovata"}
+                compute = lambda: function.call(self.env, params)
+            if not function.read_only:
+                # Scritture nella transazione del turno, annullate solo per questa chiamata se fallisce
+                return call_in_savepoint(self.env.cr, compute)
+            return cached_call(self.env, function, params, compute)
+        except FunctionArgumentError as e:
+            _logger.warning(f"Argomenti non validi per {function_name}: {e}")
+            return e.to_result()
         except Exception as e:
             _logger.error(f"Errore esecuzione funzione {function_name}: {e}")
             return {"error": str(e)}
+
+    # ========== HANDLER DELLE FUNZIONI ==========
+
+    @api.model
+    def _ai_search_products(self, function, params):
+        """search_products: termine normalizzato e limite alto se l'AI non lo specifica"""
+        # NORMALIZZA SEARCH TERM: plurali italiani singolare + rimuovi articoli
+        if 'search_term' in params:
+            params['search_term'] = self._normalize_product_search_term(params['search_term'])
+        # Se l'AI non specifica limit, usa un valore alto per "mostra tutti"
+        params.setdefault('limit', 100)
+
+        result = function.call(self.env, params)
+
+        # LOG DEBUG: verifica che list_price sia presente
+        _logger.info(f"=== search_products: {len(result)} risultati (limit={params.get('limit')}) ===")
+        for prod in result[:5]:
+            _logger.info(f"  • {prod['name']} (ID: {prod['id']}) - €{prod.get('list_price', 'N/A')} - {prod.get('qty_available', 'N/A')} unità - tipo: {prod.get('detailed_type', 'N/A')}")
+        if len(result) > 5:
+            _logger.info(f"  ... e altri {len(result) - 5} prodotti")
+        _logger.info(f"=====================================")
+        return result
+
+    @api.model
+    def _ai_request_sales_order_confirmation(self, function, params):
+        """
+        create_sales_order: GATE DI CONFERMA. L'ordine non viene creato qui:
+        si restituisce il riepilogo con il marker da confermare in chat.
+        """
+        # Valida scheduled_date: "2025-10-21" o "2025-10-21 14:00:00"
+        scheduled_str = params.get('scheduled_date')
+        if scheduled_str:
+            try:
+                from datetime import datetime
+                fmt = "%Y-%m-%d %H:%M:%S" if ' ' in scheduled_str else "%Y-%m-%d"
+                params['scheduled_date'] = datetime.strptime(scheduled_str, fmt).strftime("%Y-%m-%d")
+            except ValueError as e:
+                _logger.warning(f"Formato data non valido '{scheduled_str}': {e} - ignoro scheduled_date")
+                params.pop('scheduled_date', None)
+
+        _logger.warning("⚠️ AI ha tentato create_sales_order senza conferma - RICHIEDO CONFERMA")
+        pending = self._ai_register_pending_action('create_sales_order', params)
+
+        # Calcola totale stimato
+        total_estimate = 0.0
+        product_list = []
+        for line in params['order_lines']:
+            product_id = line.get('product_id')
+            quantity = line.get('quantity', 0)
+            if product_id:
+                product = self.env['product.product'].browse(product_id)
+                if product.exists():
+                    price = line.get('price_unit', product.list_price)
+                    total_estimate += price * quantity
+                    product_list.append(f"{product.name} ({quantity} pz) - €{price * quantity:.2f}")
+
+        # Restituisci messaggio con marker invece di eseguire
+        return {
+            "requires_confirmation": True,
+            "pending_action_id": pending.id,
+            "pending_params": params,
+            "summary": {
+                "partner_name": params.get('partner_name'),
+                "products": product_list,
+                "scheduled_date": params.get('scheduled_date', 'oggi'),
+                "total_estimate": total_estimate
+            },
+            "message": (
+                f"📦 Riepilogo Ordine\n\n"
+                f"Cliente: {params.get('partner_name')}\n"
+                f"Prodotti:\n  • " + "\n  • ".join(product_list) + "\n"
+                f"Data consegna: {params.get('scheduled_date', 'oggi')}\n"
+                f"Totale stimato: €{total_estimate:.2f}\n\n"
+                f"{PENDING_SO_MARKER} {json.dumps(params)}\n\n"
+                f"Confermi? (rispondi SÌ/CONFERMO/OK VAI)"
+            )
+        }
+
+    @api.model
+    def _ai_request_cancel_confirmation(self, function, params):
+        """cancel_sales_order: senza conferma esplicita chiede conferma all'utente con un marker"""
+        if params.pop('confirm', False):
+            return function.call(self.env, params)
+
+        # Mantieni solo order_name/order_id per il marker
+        marker_params = {key: params[key] for key in ('order_id', 'order_name') if key in params}
+        pending = self._ai_register_pending_action('cancel_sales_order', marker_params)
+        message = (
+            f"⚠️ Stai per cancellare l'ordine {marker_params.get('order_name', marker_params.get('order_id', ''))}. "
+            "Questa operazione è distruttiva e non può essere annullata.\n\n"
+            "Confermi la cancellazione? (rispondi SÌ/CONFERMO per procedere)\n\n"
+            f"{PENDING_CANCEL_MARKER} {json.dumps(marker_params)}"
+        )
+        return {"requires_confirmation": True, "pending_action_id": pending.id, "message": message}
+
+    def _ai_register_pending_action(self, kind, params):
+        """
+        Registra l'azione da confermare sul canale del turno. Chiamate senza
+        canale (recordset vuoto): l'azione viene registrata dal marker quando
+        la risposta viene pubblicata (`ai.pending.action._sync_with_reply`).
+        """
+        if len(self) != 1:
+            return self.env['ai.pending.action']
+        return self.env['ai.pending.action']._register(self, kind, params)
+
+    @api.model
+    def _ai_get_sales_order_details(self, function, params):
+        """
+        get_sales_order_details: con internal=true il risultato è marcato per
+        i workflow multi-step (l'AI estrae i line_id e continua con
+        update_sales_order nello stesso turno, senza formattazione per l'utente)
+        """
+        is_internal = params.pop('internal', False)
+        result = function.call(self.env, params)
+        if is_internal and isinstance(result, dict):
+            result['_internal_call'] = True  # Marker per odoobot_override.py
+        return result
     
     @api.model
     def _parse_ai_function_calls(self, ai_response):
         """
         Analizza la risposta dell'AI per individuare tutte le funzioni richieste.
         Restituisce una lista di tuple (function_name, parameters) e la risposta senza tag.
+        
+        Con il function calling nativo (`LLMReply` con tool call) usa direttamente
+        le chiamate strutturate; la scansione dei tag resta come fallback.
         """
-        # trova [FUNCTION:nome] (case-insensitive) e cattura tutto
-        # fino alla ']' corrispondente
-        function_calls = []
-        clean_response = ai_response
+        native_calls = getattr(ai_response, 'function_calls', None)
+        if native_calls:
+            _logger.info(f"Parsed {len(native_calls)} native function calls")
+            return list(native_calls), ai_response.text
         
-        # Cerca tutti i tag FUNCTION nell'ordine in cui appaiono senza guardare 
-        idx = 0
-        tag_re = re.compile(r"\[(?:FUNCTION|Function|function):")
-        while idx < len(clean_response or ""):
-            m = tag_re.search(clean_response, idx)
-            start = -1 if not m else m.start()
-            if start == -1:
-                break
-            
-            _logger.info(f"Parser: trovato tag FUNCTION a posizione {start}")
-            
-            # Trova il nome della funzione
-            name_end = clean_response.find('|', start)
-            if name_end == -1:
-                name_end = clean_response.find(']', start)
-            
-            if name_end == -1:
-                _logger.warning(f"Parser: non trovo | o ] dopo posizione {start}")
-                idx = (start + 10)
-                continue
-                
-            function_name = clean_response[start+10:name_end].strip()
-            _logger.info(f"Parser: nome funzione = '{function_name}'")
-            # Rimuovi eventuali virgolette attorno al nome funzione
-            if (function_name.startswith('"') and function_name.endswith('"')) or \
-               (function_name.startswith("'") and function_name.endswith("'")):
-                function_name = function_name[1:-1].strip()
-            
-            # Trova la chiusura del tag, gestendo [] annidati
-            bracket_count = 1
-            pos = name_end
-            tag_end = -1
-            
-            while pos < len(clean_response) and bracket_count > 0:
-                pos += 1
-                if pos >= len(clean_response):
-                    break
-                if clean_response[pos] == '[':
-                    bracket_count += 1
-                elif clean_response[pos] == ']':
-                    bracket_count -= 1
-                    if bracket_count == 0:
-                        tag_end = pos
-                        break
-            
-            if tag_end == -1:
-                idx = start + 10
-                continue
-            
-            # Estrai i parametri
-            params_str = clean_response[name_end:tag_end].strip()
-            if params_str.startswith('|'):
-                params_str = params_str[1:]
-            
-            parameters = {}
-            if params_str:
-                # Split per | ma attenzione ai JSON
-                parts = []
-                current = ""
-                bracket_level = 0
-                brace_level = 0
-                
-                for char in params_str:
-                    if char == '[':
-                        bracket_level += 1
-                    elif char == ']':
-                        bracket_level -= 1
-                    elif char == '{':
-                        brace_level += 1
-                    elif char == '}':
-                        brace_level -= 1
-                    elif char == '|' and bracket_level == 0 and brace_level == 0:
-                        parts.append(current)
-                        current = ""
-                        continue
-                    current += char
-                
-                if current:
-                    parts.append(current)
-                
-                # Parse ogni parametro
-                for part in parts:
-                    if ':' not in part:
-                        continue
-                    key, value = part.split(':', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Provo a parsare come JSON
-                    if value.startswith('[') or value.startswith('{'):
-                        try:
-                            value = json.loads(value)
-                        except Exception as e:
-                            _logger.warning(f"Impossibile parsare JSON per {key}: {e}")
-                    
-                    parameters[key] = value
-            
-            function_calls.append((function_name, parameters))
-            
-            # Rimuovi il tag dalla risposta
-            full_tag = clean_response[start:tag_end+1]
-            clean_response = clean_response[:start] + clean_response[tag_end+1:]
-            idx = start  # Riparti dalla stessa posizione
-
-        clean_response = clean_response.strip()
+        # Passata singola: tag completi, parametri JSON decodificati, testo pulito con un join
+        function_calls, clean_response = parse_function_tags(ai_response)
         
         _logger.info(f"Parsed {len(function_calls)} function calls")
         if function_calls:
@@ -1053,188 +968,28 @@ class DiscussChannel(models.Model):
             # controllo se ci sono ordini di vendita in attesa prima di chiamare l'ai
             user_message = re.sub(r'<[^>]+>', '', body or '').strip()
 
-            # Flag per tracciare se abbiamo gestito una conferma (evita di chiamare l'AI dopo)
-            confirmation_handled = False
-
-            if re.search(r'\b(S[IÌI]|CONFERMO|OK\s*VAI|PERFETTO)\b', user_message, re.I):
-                _logger.info("Possibile conferma rilevata, verifico marker [PENDING_SO]")
-
-                bot_partner_ids = []
-                for xmlid in ('base.partner_root', 'base.partner_odoobot'):
-                    partner = self.env.ref(xmlid, raise_if_not_found=False)
-                    if partner:
-                        bot_partner_ids.append(partner.id)
-
-                if bot_partner_ids:
-                    last_bot_msg = self.env['mail.message'].search([
-                        ('model', '=', self._name),
-                        ('res_id', '=', self.id),
-                        ('author_id', 'in', bot_partner_ids),
-                        ('message_type', '=', 'comment'),
-                    ], order='date desc', limit=1)
-
-                    if last_bot_msg and last_bot_msg.body:
-                        msg_text = re.sub(r'<[^>]+>', '', last_bot_msg.body or '').strip()
-                        _logger.debug(f"Ultimo messaggio bot (200 char): {msg_text[:200]}")
-
-                        # Uso parser a contatore di graffe per JSON annidati
-                        text = msg_text
-                        idx = text.find(PENDING_SO_MARKER)
-                        if idx != -1:
-                            jstart = text.find('{', idx)
-                            if jstart != -1:
-                                depth = 0
-                                end = None
-                                for k, ch in enumerate(text[jstart:], start=jstart):
-                                    if ch == '{':
-                                        depth += 1
-                                    elif ch == '}':
-                                        depth -= 1
-                                        if depth == 0:
-                                            end = k + 1
-                                            break
-                                if end:
-                                    json_str = text[jstart:end]
-                                    _logger.info("Marker [PENDING_SO] trovato: eseguo create_sales_order senza AI")
-                                    try:
-                                        params = json.loads(json_str)
-
-                                        if 'scheduled_date' in params and isinstance(params['scheduled_date'], str):
-                                            from datetime import datetime
-                                            scheduled_str = params['scheduled_date']
-                                            try:
-                                                if ' ' in scheduled_str:
-                                                    params['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d %H:%M:%S")
-                                                else:
-                                                    params['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d")
-                                            except ValueError:
-                                                _logger.warning(f"Formato scheduled_date non valido: {scheduled_str}, rimuovo il parametro")
-                                                params.pop('scheduled_date', None)
-
-                                        warehouse_ops = self.env['warehouse.operations']
-                                        result_create = warehouse_ops.create_sales_order(**params)
-
-                                        lines = []
-                                        if isinstance(result_create, dict) and result_create.get('error'):
-                                            lines.append(f"⚠️ Errore: {result_create.get('error')}")
-                                            if result_create.get('details'):
-                                                lines.append(result_create['details'])
-                                        else:
-                                            order_name = result_create.get('sale_order_name') or result_create.get('order_name')
-                                            order_id = result_create.get('sale_order_id') or result_create.get('order_id')
-                                            if order_name:
-                                                lines.append(f"✅ Ordine creato: {order_name}")
-                                            if order_id:
-                                                lines.append(f"ID interno: {order_id}")
-
-                                            state = result_create.get('state', 'N/A')
-                                            state_map = {'draft': 'Bozza', 'sent': 'Inviato', 'sale': 'Confermato', 'done': 'Evaso'}
-                                            lines.append(f"Stato: {state_map.get(state, state)}")
-
-                                            pickings = result_create.get('pickings', [])
-                                            if pickings:
-                                                lines.append("\nConsegne generate:")
-                                                for p in pickings:
-                                                    lines.append(f"  • {p.get('picking_name')} - {p.get('scheduled_date', 'N/A')}")
-
-                                            lines.append(f"\nTotale: €{result_create.get('amount_total', 0):.2f}")
-
-                                        self.message_post(
-                                            body=format_html_response("\n\n".join(lines) if lines else "Operazione completata."),
-                                            message_type='comment',
-                                            subtype_xmlid='mail.mt_comment',
-                                            author_id=last_bot_msg.author_id.id if last_bot_msg else bot_partner_ids[0],
-                                        )
-
-                                        confirmation_handled = True
-                                        return result
-                                    except Exception as e:
-                                        _logger.error(f"Errore durante l'esecuzione diretta di create_sales_order: {e}", exc_info=True)
-                        else:
-                            _logger.info("Nessun marker [PENDING_SO] trovato nell'ultimo messaggio del bot")
-
-                # --- Gestione conferma cancellazione (PENDING_CANCEL) ---
-                if re.search(r'\b(S[IÌI]|CONFERMO|OK\s*VAI|PERFETTO)\b', user_message, re.I):
-                    _logger.info("Possibile conferma rilevata, verifico marker [PENDING_CANCEL]")
-
-                    bot_partner_ids = []
-                    for xmlid in ('base.partner_root', 'base.partner_odoobot'):
-                        partner = self.env.ref(xmlid, raise_if_not_found=False)
-                        if partner:
-                            bot_partner_ids.append(partner.id)
-
-                    if bot_partner_ids:
-                        last_bot_msg = self.env['mail.message'].search([
-                            ('model', '=', self._name),
-                            ('res_id', '=', self.id),
-                            ('author_id', 'in', bot_partner_ids),
-                            ('message_type', '=', 'comment'),
-                        ], order='date desc', limit=1)
-
-                        if last_bot_msg and last_bot_msg.body:
-                            msg_text = re.sub(r'<[^>]+>', '', last_bot_msg.body or '').strip()
-                            _logger.debug(f"Ultimo messaggio bot (200 char): {msg_text[:200]}")
-
-                            # Cerca marker PENDING_CANCEL
-                            text = msg_text
-                            idx = text.find(PENDING_CANCEL_MARKER)
-                            if idx != -1:
-                                jstart = text.find('{', idx)
-                                if jstart != -1:
-                                    depth = 0
-                                    end = None
-                                    for k, ch in enumerate(text[jstart:], start=jstart):
-                                        if ch == '{':
-                                            depth += 1
-                                        elif ch == '}':
-                                            depth -= 1
-                                            if depth == 0:
-                                                end = k + 1
-                                                break
-                                    if end:
-                                        json_str = text[jstart:end]
-                                        _logger.info("Marker [PENDING_CANCEL] trovato: eseguo cancel_sales_order senza AI")
-                                        try:
-                                            params = json.loads(json_str)
-
-                                            warehouse_ops = self.env['warehouse.operations']
-                                            result_cancel = warehouse_ops.cancel_sales_order(**params)
-
-                                            lines = []
-                                            if isinstance(result_cancel, dict) and result_cancel.get('error'):
-                                                lines.append(f"⚠️ Errore: {result_cancel.get('error')}")
-                                                if result_cancel.get('details'):
-                                                    lines.append(result_cancel['details'])
-                                            else:
-                                                order_name = result_cancel.get('order_name') or params.get('order_name')
-                                                order_id = result_cancel.get('order_id') or params.get('order_id')
-                                                if order_name:
-                                                    lines.append(f"✅ Ordine cancellato: {order_name}")
-                                                if order_id:
-                                                    lines.append(f"ID interno: {order_id}")
-
-                                            self.message_post(
-                                                body=format_html_response("\n\n".join(lines) if lines else "Operazione completata."),
-                                                message_type='comment',
-                                                subtype_xmlid='mail.mt_comment',
-                                                author_id=last_bot_msg.author_id.id if last_bot_msg else bot_partner_ids[0],
-                                            )
-
-                                            confirmation_handled = True
-                                            return result
-                                        except Exception as e:
-                                            _logger.error(f"Errore durante l'esecuzione diretta di cancel_sales_order: {e}", exc_info=True)
-                            else:
-                                _logger.info("Nessun marker [PENDING_CANCEL] trovato nell'ultimo messaggio del bot")
-                    else:
-                        _logger.info("ℹ️ Nessun messaggio del bot trovato per verificare la conferma")
-            
-            # Chiama l'AI per generare una risposta SOLO se NON abbiamo già gestito una conferma
-            if not confirmation_handled:
+            # Conferma di un'azione in attesa (ordine da creare / da cancellare): eseguita senza AI
+            confirmation = self.env['ai.pending.action']._confirm(self, user_message)
+            if confirmation is not None:
+                self.message_post(
+                    body=format_html_response(confirmation),
+                    message_type='comment',
+                    subtype_xmlid='mail.mt_comment',
+                    author_id=self.env.ref('base.partner_root').id,
+                )
+                return result
+
+            # Chiama l'AI per generare una risposta
+            if self.env['ai.config']._is_async_enabled():
+                # Modalità asincrona: il worker HTTP si libera subito, la risposta arriva via bus
+                self.env['ai.chat.job']._enqueue(self, body, kind='channel')
+            else:
                 self._generate_ai_response(body)
         
         return result
     
+    @turn_scoped
+    @streamed_reply
     def _generate_ai_response(self, user_message):
         """Genera e invia una risposta AI"""
         try:
@@ -1311,8 +1066,8 @@ class DiscussChannel(models.Model):
                 'content': context_enriched_message
             })
             
-            # Ottieni risposta dall'AI
-            ai_response = self._get_gemini_response(config, messages)
+            # Ottieni risposta dall'AI (in streaming se attivo: anteprima in chat)
+            ai_response = self._get_gemini_response(config, messages, stream=current_stream())
 
             # LOG DETTAGLIATO
             _logger.info(f"========== AI RAW RESPONSE ==========")
@@ -1325,54 +1080,16 @@ class DiscussChannel(models.Model):
             # Verifica se l'AI vuole eseguire una o più funzioni
             function_calls, clean_response = self._parse_ai_function_calls(ai_response)
             
-            # Se il parser non ha trovato nulla ma la risposta contiene '[FUNCTION:',
-            # provo una pulizia piu stringente
-            if not function_calls and '[FUNCTION:' in (ai_response or ''):
-                _logger.warning("Parser non ha trovato FUNCTION ma la stringa li contiene. Cleaning + fallback...")
-                try:
-                    # 1) Pulizia base
-                    cleaned = re.sub(r'```.*?```', '', ai_response, flags=re.S)   # rimuovi code blocks
-                    cleaned = cleaned.replace('`', '')                            # rimuovi backticks
-                    # normalizza newline DENTRO al tag 
-                    cleaned = re.sub(
-                        r'\[(?:FUNCTION|Function|function):([^\]]+)\]',
-                        lambda m: '[FUNCTION:' + m.group(1).replace('\n','').replace('\r','') + ']',
-                        cleaned
-                    )
-                    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-                    _logger.info(f"Cleaned response: {repr(cleaned)}")
-
-                    # 2) Riprova il parser 
-                    function_calls, clean_response = self._parse_ai_function_calls(cleaned)
-                    if not function_calls:
-                        # 3) Fallback: tag senza parametri (es. [FUNCTION:search_products])
-                        bare = re.findall(r'\[(?:FUNCTION|Function|function):\s*([A-Za-z0-9_]+)\s*\]', cleaned)
-                        if bare:
-                            function_calls = [(name.strip(), {}) for name in bare]
-                            clean_response = re.sub(r'\[(?:FUNCTION|Function|function):[^\]]+\]', '', cleaned).strip()
-                            _logger.info(f"Fallback bare FUNCTION: create {len(function_calls)} call(s) with empty params.")
-                        else:
-                            _logger.error(f"Anche dopo cleaning/fallback non trovo tag. cleaned={cleaned}")
-
-                    # 4) Se abbiamo trovato qualcosa, uso la versione base
-                    if function_calls:
-                        ai_response = cleaned
-
-                except Exception:
-                    _logger.error("Errore durante cleaning/fallback FUNCTION tags", exc_info=True)
-
             _logger.info(f"AI response: {ai_response}")
             _logger.info(f"Function calls trovate: {len(function_calls)}")
             _logger.info(f"Clean response: {clean_response}")
 
             if function_calls:
-                # Esegui tutte le funzioni richieste
-                executed_calls = []
-
-                for function_name, parameters in function_calls:
-                    _logger.info(f"Eseguo funzione: {function_name} con parametri: {parameters}")
-                    result = self._execute_function(function_name, parameters)
-                    executed_calls.append((function_name, parameters, result))
+                # Esegui tutte le funzioni richieste (letture consecutive in parallelo)
+                executed_calls = execute_calls(
+                    self, function_calls, get_function_registry(self.env).read_only,
+                    max_workers=config.function_workers,
+                )
 
                 # uso interno 
                 summary_blocks = []
@@ -1452,7 +1169,7 @@ class DiscussChannel(models.Model):
                     # Rimuovi eventuali tag [FUNCTION:...] dalla risposta finale
                     if '[FUNCTION:' in final_response:
                         _logger.warning(f"AI ha incluso tag FUNCTION nella risposta finale, li rimuovo: {final_response}")
-                        final_response = re.sub(r'\[FUNCTION:[^\]]+\]', '', final_response).strip()
+                        final_response = strip_function_tags(final_response)
 
                     # fallback
                     if not final_response:
@@ -1471,14 +1188,15 @@ class DiscussChannel(models.Model):
             # Rimuovi eventuali tag [FUNCTION:...] residui dalla risposta finale
             try:
                 if final_response and '[FUNCTION:' in final_response:
-                    final_response = re.sub(r'\[FUNCTION:[^\]]+\]', '', final_response).strip()
+                    final_response = strip_function_tags(final_response)
             except Exception:
                 pass
 
             # Formatta con HTML
             formatted_response = format_html_response(final_response)
+            self.env['ai.pending.action']._sync_with_reply(self, final_response)
 
-            # Invia la risposta nella chat
+            # Invia la risposta nella chat (l'anteprima dello streaming sparisce al commit)
             self.message_post(
                 body=formatted_response,
                 message_type='comment',
@@ -1011,7 +1011,8 @@ get_sales_overview:
   PARAMETRI:
     period: string ('day', 'week', 'month', 'year', 'all') - default: 'month'
     state: string opzionale ('draft', 'sent', 'sale', 'done', 'cancel') - filtra per stato
-    limit: int - massimo ordini da mostrare (default: 100)
+    limit: int - massimo ordini nella lista (default: 10); totali e stati coprono sempre tutto il periodo
+    cursor: string opzionale - 'next_cursor' del risultato precedente per mostrare altri ordini
   
   ESEMPI TAG:
     [FUNCTION:get_sales_overview|period:month]
@@ -1762,6 +1763,86 @@ class AIConfig(models.Model):
     temperature = fields.Float(string='Temperature', default=0.7)
     max_tokens = fields.Integer(string='Max Tokens', default=10000)
 
+    # Pool HTTP keep-alive condiviso dalle chiamate LLM del worker
+    http_pool_size = fields.Integer(
+        string='HTTP Pool Size', default=10,
+        help="Connessioni keep-alive mantenute per host dal client LLM di ogni worker",
+    )
+
+    # Context caching Gemini del system prompt (cachedContents lato server)
+    gemini_context_cache = fields.Boolean(
+        string='Gemini Context Cache', default=False,
+        help="Carica il system prompt una volta come cachedContent e lo riusa nelle chiamate "
+             "successive invece di reinviarlo. In caso di errore si torna alla modalità inline. "
+             "Disattivo di default: lo storage dei cachedContents è a pagamento e non tutti i "
+             "modelli/chiavi lo supportano",
+    )
+    gemini_cache_ttl = fields.Integer(string='Gemini Cache TTL (s)', default=3600)
+
+    # Motore della ricerca prodotti (search_products)
+    product_search_engine = fields.Selection([
+        ('orm', 'ORM multi-pattern (ilike)'),
+        ('trigram', 'Trigram indicizzato (pg_trgm)'),
+        ('memory', 'Indice in memoria (per worker)'),
+    ], string='Motore ricerca prodotti', default='orm', required=True,
+        help="Trigram: una sola query ordinata per similarità sull'indice GIN dei nomi prodotto. "
+             "Se pg_trgm non è disponibile si usa la ricerca ORM. "
+             "Memoria: indice invertito di nomi, codici e barcode tenuto da ogni worker",
+    )
+
+    # Normalizzazione termini prodotto: locale, LLM solo sotto soglia di confidenza
+    normalizer_llm_fallback = fields.Boolean(
+        string='Fallback LLM normalizzazione', default=False,
+        help="Se la normalizzazione locale dei termini prodotto è incerta, chiede all'LLM",
+    )
+    normalizer_confidence_threshold = fields.Float(
+        string='Soglia confidenza normalizzazione', default=0.7,
+        help="Sotto questa confidenza (0-1) la normalizzazione locale ricorre all'LLM",
+    )
+
+    # Modalità di chiamata delle funzioni: tag nel testo o tool calling nativo del provider
+    function_calling = fields.Selection([
+        ('tags', 'Tag [FUNCTION:...] nel testo'),
+        ('native', 'Function calling nativo'),
+    ], string='Chiamata funzioni', default='tags', required=True,
+        help="Nativo: le funzioni vengono inviate come tool/function declarations a Gemini "
+             "o OpenRouter e le chiamate arrivano strutturate. Il parser dei tag resta come fallback",
+    )
+
+    # Funzioni di sola lettura dello stesso turno eseguite in parallelo (cursori separati)
+    function_workers = fields.Integer(
+        string='Thread funzioni di lettura', default=4,
+        help="Thread usati per eseguire in parallelo le funzioni di sola lettura richieste "
+             "nello stesso turno. 1 = esecuzione in sequenza",
+    )
+
+    # Risposta in streaming: anteprima in chat ed esecuzione anticipata delle funzioni
+    streaming = fields.Boolean(
+        string='Streaming risposte', default=False,
+        help="La risposta principale del turno arriva a chunk (Gemini streamGenerateContent, "
+             "OpenRouter SSE): il testo compare in chat mentre viene generato e le funzioni "
+             "di sola lettura partono appena il loro tag è completo",
+    )
+
+    # Esegue i turni di chat in background (ai.chat.job) invece che nella richiesta HTTP
+    async_mode = fields.Boolean(
+        string='Esecuzione asincrona', default=False,
+        help="Il messaggio utente viene salvato subito e la risposta AI viene generata "
+             "da un worker in background, poi inviata in chat via bus",
+    )
+
+    # Storico conversazione nel prompt: budget di token invece di un numero fisso di messaggi
+    context_token_budget = fields.Integer(
+        string='Budget token storico', default=3000,
+        help="Token stimati (tokenizer locale) dedicati ai turni precedenti della conversazione, "
+             "riempiti dal più recente. 0 = ultimi 10 messaggi, senza limite di lunghezza",
+    )
+    context_summary = fields.Boolean(
+        string='Riassunto turni esclusi', default=True,
+        help="I turni che non stanno nel budget vengono riassunti in background dall'LLM "
+             "e il riassunto precede lo storico finché altri turni non escono dal contesto",
+    )
+
     system_prompt = fields.Text(string='System Prompt', default=NEW_SYSTEM_PROMPT)
 
     active = fields.Boolean(string='Active', default=True)
@@ -1775,6 +1856,18 @@ class AIConfig(models.Model):
         config._ensure_updated_system_prompt()
         return config
 
+    @api.model
+    def _is_async_enabled(self):
+        """True se la configurazione attiva richiede l'esecuzione asincrona dei turni"""
+        config = self.sudo().search([('active', '=', True)], limit=1)
+        return bool(config.async_mode)
+
+    @api.model
+    def _is_streaming_enabled(self):
+        """True se la configurazione attiva richiede lo streaming delle risposte"""
+        config = self.sudo().search([('active', '=', True)], limit=1)
+        return bool(config.streaming)
+
     @api.constrains('provider', 'gemini_api_key', 'openrouter_api_key')
     def _check_provider_key(self):
       """Valida che la chiave API del provider selezionato sia compilata.
@@ -1842,5 +1935,5 @@ class AIConfig(models.Model):
                 needs_update = True
             
             if needs_update:
-                record.system_prompt = NEW_SYSTEM_PROMPT
-                record._cr.commit()
\ No newline at end of file
+                # Salvato con la transazione della richiesta (nessun commit intermedio)
+                record.system_prompt = NEW_SYSTEM_PROMPT
\ No newline at end of file
@@ -0,0 +1,419 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import html
+import logging
+import re
+
+import psycopg2
+
+_logger = logging.getLogger(__name__)
+
+# Turni letti al massimo per costruire il contesto LLM
+MAX_CONTEXT_TURNS = 20
+# Lunghezza massima del testo di un turno
+MAX_TURN_CHARS = 6000
+# I turni più vecchi di N ore non entrano nello storico
+HISTORY_MAX_AGE_HOURS = 2
+# Turni e riassunti più vecchi di N giorni vengono eliminati dall'autovacuum
+TURN_RETENTION_DAYS = 7
+# Marker di reset dei canali precedenti a questo modello (letto solo all'inizializzazione)
+LEGACY_RESET_MARKER = '[SYSTEM_RESET]'
+
+# Budget di default del contesto (token stimati), se la configurazione non ne indica uno
+DEFAULT_CONTEXT_TOKENS = 3000
+# Token aggiunti per ogni messaggio (ruolo e separatori nel formato del provider)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Lunghezza massima del riassunto dei turni usciti dal contesto
+MAX_SUMMARY_CHARS = 2000
+
+# Risposte di errore da non riproporre all'LLM (impara a rispondere con errori)
+ERROR_KEYWORDS = (
+    'errore di connessione',
+    '503 server error',
+    '503 service unavailable',
+    'service unavailable',
+    'connection error',
+    'timeout error',
+    'api error',
+)
+
+_BR_RE = re.compile(r'<br\s*/?>', re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+# Parole e singoli simboli: approssimazione locale della tokenizzazione BPE
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def plain_text(body):
+    """Testo semplice di un corpo messaggio HTML (una volta sola, quando il turno viene salvato)."""
+    text = _TAG_RE.sub('', _BR_RE.sub('\n', str(body or '')))
+    return html.unescape(text).strip()
+
+
+def estimate_tokens(text):
+    """
+    Token stimati di un testo, senza il tokenizer del provider.
+
+    Ogni simbolo vale un token, ogni parola un token ogni 4 caratteri
+    (parole corte, numeri d'ordine e codici restano un token): per testo
+    italiano l'errore rispetto ai tokenizer BPE è di pochi punti percentuali.
+    """
+    tokens = 0
+    for match in _TOKEN_RE.finditer(text or ''):
+        tokens += (len(match.group()) + 3) // 4
+    return tokens
+
+
+def _turn_cost(turn):
+    return estimate_tokens(turn['text']) + MESSAGE_OVERHEAD_TOKENS
+
+
+class AIConversation(models.Model):
+    """
+    Stato della conversazione AI di un canale.
+
+    I turni (testo semplice) sono righe `ai.conversation.turn` aggiunte man
+    mano che messaggio utente e risposta del bot vengono pubblicati: solo
+    INSERT, quindi un messaggio inviato mentre un turno è in corso non entra
+    in conflitto con la transazione del turno. Lo storico è una lettura per
+    indice degli ultimi turni, senza rileggere i messaggi del canale né
+    ripulirne l'HTML.
+
+    La riga del canale cambia solo al comando /reset (`reset_turn_id`: i
+    turni fino a questo id non entrano più nello storico). Il contesto per
+    l'LLM (`_context`) riempie un budget di token dal turno più recente; i
+    turni rimasti fuori sono coperti dall'ultimo `ai.conversation.summary`,
+    generato in background da un job `ai.chat.job` e riusato finché altri
+    turni non escono dal contesto.
+    """
+    _name = 'ai.conversation'
+    _description = 'AI Conversation State'
+
+    channel_id = fields.Many2one('discuss.channel', string='Canale', required=True, ondelete='cascade', index=True)
+    reset_turn_id = fields.Integer(string='Reset dopo il turno', default=0)
+    turn_ids = fields.One2many('ai.conversation.turn', 'conversation_id', string='Turni')
+    summary_ids = fields.One2many('ai.conversation.summary', 'conversation_id', string='Riassunti')
+
+    _sql_constraints = [
+        ('channel_uniq', 'unique(channel_id)', "Esiste già uno stato conversazione per questo canale."),
+    ]
+
+    # ------------------------------------------------------------------
+    # Accesso per canale
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _for_channel(self, channel):
+        """
+        Stato del canale, creato al primo utilizzo dagli ultimi messaggi.
+
+        Returns:
+            tuple: (ai.conversation, True se appena creato)
+        """
+        conversation = self.search([('channel_id', '=', channel.id)], limit=1)
+        if conversation:
+            return conversation, False
+        try:
+            with self.env.cr.savepoint():
+                conversation = self.create({'channel_id': channel.id})
+        except psycopg2.IntegrityError:
+            # Creato nel frattempo da un'altra transazione sullo stesso canale
+            return self.search([('channel_id', '=', channel.id)], limit=1), False
+        for date, role, text in self._legacy_turns(channel):
+            conversation._push(role, text, date=date)
+        return conversation, True
+
+    @api.model
+    def _legacy_turns(self, channel):
+        """Turni recenti già presenti nel canale (solo alla creazione dello stato)."""
+        bot_partner_ids = self._bot_partner_ids()
+        cutoff = fields.Datetime.now() - timedelta(hours=HISTORY_MAX_AGE_HOURS)
+        channel_messages = self.env['mail.message'].search([
+            ('model', '=', channel._name),
+            ('res_id', '=', channel.id),
+            ('message_type', 'in', ['comment', 'notification']),
+            ('date', '>=', cutoff),
+        ], order='date desc, id desc', limit=MAX_CONTEXT_TURNS)
+
+        turns = []
+        for msg in channel_messages:  # dal più recente
+            if LEGACY_RESET_MARKER in (msg.body or ''):
+                break
+            if msg.message_type == 'notification':
+                continue
+            role = 'assistant' if msg.author_id.id in bot_partner_ids else 'user'
+            turns.append((msg.date, role, msg.body))
+        turns.reverse()
+        return turns
+
+    @api.model
+    def _bot_partner_ids(self):
+        return {
+            partner.id
+            for partner in (
+                self.env.ref('base.partner_odoobot', raise_if_not_found=False),
+                self.env.ref('base.partner_root', raise_if_not_found=False),
+            )
+            if partner
+        }
+
+    # ------------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _append(self, channel, role, body):
+        """Aggiunge un turno pubblicato nel canale (`role`: 'user' | 'assistant')."""
+        conversation, created = self._for_channel(channel)
+        if created and role == 'user':
+            # Il messaggio utente è già pubblicato: l'inizializzazione l'ha appena letto
+            return
+        conversation._push(role, body)
+
+    def _push(self, role, body, date=None):
+        self.ensure_one()
+        text = plain_text(body)
+        if len(text) < 2:
+            return
+        lowered = text.lower()
+        if any(keyword in lowered for keyword in ERROR_KEYWORDS):
+            _logger.info(f"⚠️ Risposta di errore esclusa dallo storico: {text[:50]}...")
+            return
+        self.env['ai.conversation.turn'].create({
+            'conversation_id': self.id,
+            'role': role,
+            'text': text[:MAX_TURN_CHARS],
+            'date': date or fields.Datetime.now(),
+        })
+
+    @api.model
+    def _reset_channel(self, channel):
+        """Da qui in avanti lo storico riparte vuoto (comando /reset)."""
+        conversation, _created = self._for_channel(channel)
+        last_turn = self.env['ai.conversation.turn'].search(
+            [('conversation_id', '=', conversation.id)], order='id desc', limit=1,
+        )
+        conversation.reset_turn_id = last_turn.id
+
+    # ------------------------------------------------------------------
+    # Lettura
+    # ------------------------------------------------------------------
+
+    def _recent_turns(self, before_id=None, limit=MAX_CONTEXT_TURNS):
+        """
+        Turni dopo l'ultimo /reset e non più vecchi di HISTORY_MAX_AGE_HOURS,
+        dal più recente.
+
+        Returns:
+            list: [{'id', 'role', 'text', 'date'}]
+        """
+        self.ensure_one()
+        cutoff = fields.Datetime.now() - timedelta(hours=HISTORY_MAX_AGE_HOURS)
+        domain = [
+            ('conversation_id', '=', self.id),
+            ('id', '>', self.reset_turn_id),
+            ('date', '>=', cutoff),
+        ]
+        if before_id:
+            domain.append(('id', '<', before_id))
+        return self.env['ai.conversation.turn'].search_read(
+            domain, ['role', 'text', 'date'], order='id desc', limit=limit,
+        )
+
+    def _history(self, max_messages=10):
+        """
+        Ultimi `max_messages` turni dopo il reset e non più vecchi di
+        HISTORY_MAX_AGE_HOURS, dal più vecchio.
+
+        Returns:
+            list: [{'role': 'user'|'assistant', 'content': testo}]
+        """
+        turns = self._recent_turns(limit=max_messages)
+        return [{'role': turn['role'], 'content': turn['text']} for turn in reversed(turns)]
+
+    @api.model
+    def _fill_window(self, turns, token_budget):
+        """
+        Riempie `token_budget` con `turns` (dal più recente).
+
+        Returns:
+            tuple: (messaggi dal più vecchio, id del turno più vecchio incluso)
+        """
+        messages = []
+        used = 0
+        first_kept = turns[0]['id'] + 1 if turns else 0
+        for turn in turns:
+            cost = _turn_cost(turn)
+            if used + cost > token_budget:
+                if not messages and token_budget > MESSAGE_OVERHEAD_TOKENS:
+                    # Il turno più recente da solo supera il budget: entra troncato
+                    ratio = (token_budget - MESSAGE_OVERHEAD_TOKENS) / cost
+                    text = turn['text'][:int(len(turn['text']) * ratio)]
+                    messages.append({'role': turn['role'], 'content': f"{text}…"})
+                    first_kept = turn['id']
+                break
+            messages.append({'role': turn['role'], 'content': turn['text']})
+            used += cost
+            first_kept = turn['id']
+        messages.reverse()
+        return messages, first_kept
+
+    def _plan_context(self, token_budget):
+        """
+        Finestra di contesto nel budget.
+
+        Returns:
+            tuple: (messaggi, id del turno più vecchio incluso,
+                    True se qualche turno resta fuori, riassunto usato o vuoto)
+        """
+        summary = self.env['ai.conversation.summary']
+        turns = self._recent_turns()
+        window, first_kept = self._fill_window(turns, token_budget)
+        if len(window) == len(turns):
+            return window, first_kept, False, summary
+
+        summary = self._current_summary()
+        if summary:
+            summary_tokens = estimate_tokens(summary.text) + MESSAGE_OVERHEAD_TOKENS
+            # Il riassunto non toglie ai turni recenti più di metà del budget
+            if summary_tokens <= token_budget // 2:
+                window, first_kept = self._fill_window(turns, token_budget - summary_tokens)
+                window.insert(0, {'role': 'user', 'content': f"[RIASSUNTO CONVERSAZIONE PRECEDENTE]\n{summary.text}"})
+            else:
+                summary = self.env['ai.conversation.summary']
+        return window, first_kept, True, summary
+
+    def _context(self, token_budget=DEFAULT_CONTEXT_TOKENS, summarize=True):
+        """
+        Turni più recenti che stanno nel budget di token, dal più vecchio.
+
+        Se alcuni turni restano fuori, il riassunto già disponibile li
+        precede (il suo costo viene tolto dal budget) e, se copre meno turni
+        di quelli esclusi, ne viene richiesto uno aggiornato in background:
+        il turno corrente non aspetta l'LLM.
+
+        Returns:
+            list: [{'role': 'user'|'assistant', 'content': testo}]
+        """
+        self.ensure_one()
+        window, first_kept, truncated, summary = self._plan_context(token_budget)
+        if truncated and summarize and (not summary or first_kept > summary.upto_turn_id):
+            self._request_summary()
+        return window
+
+    def _current_summary(self):
+        """Ultimo riassunto valido: successivo all'ultimo /reset e non più vecchio di HISTORY_MAX_AGE_HOURS."""
+        self.ensure_one()
+        cutoff = fields.Datetime.now() - timedelta(hours=HISTORY_MAX_AGE_HOURS)
+        return self.env['ai.conversation.summary'].search([
+            ('conversation_id', '=', self.id),
+            ('upto_turn_id', '>', self.reset_turn_id),
+            ('last_turn_date', '>=', cutoff),
+        ], order='id desc', limit=1)
+
+    # ------------------------------------------------------------------
+    # Riassunto progressivo
+    # ------------------------------------------------------------------
+
+    def _request_summary(self):
+        """Accoda l'aggiornamento del riassunto, un solo job in attesa per canale."""
+        self.ensure_one()
+        pending = self.env['ai.chat.job'].sudo().search_count([
+            ('channel_id', '=', self.channel_id.id),
+            ('kind', '=', 'summary'),
+            ('state', 'in', ('queued', 'running')),
+        ], limit=1)
+        if not pending:
+            self.env['ai.chat.job']._enqueue(self.channel_id, "Riassunto turni usciti dal contesto", kind='summary')
+
+    @api.model
+    def _summarize_channel(self, channel):
+        """Eseguito dal job 'summary': aggiorna il riassunto dei turni esclusi dal contesto."""
+        conversation = self.search([('channel_id', '=', channel.id)], limit=1)
+        if conversation:
+            conversation._summarize()
+
+    def _summarize(self):
+        """
+        Riassunto progressivo: il riassunto precedente più i turni esclusi
+        dalla finestra corrente e non ancora riassunti, in una chiamata LLM
+        breve. Ogni aggiornamento è una nuova riga `ai.conversation.summary`.
+        """
+        self.ensure_one()
+        config = self.env['ai.config'].get_active_config()
+        budget = config.context_token_budget if config.context_token_budget > 0 else DEFAULT_CONTEXT_TOKENS
+        _window, first_kept, truncated, _used = self._plan_context(budget)
+        if not truncated:
+            return False
+
+        previous = self._current_summary()
+        turns = [
+            turn for turn in reversed(self._recent_turns(before_id=first_kept))
+            if not previous or turn['id'] >= previous.upto_turn_id
+        ]
+        if not turns:
+            return False
+
+        lines = []
+        for turn in turns:
+            speaker = 'Utente' if turn['role'] == 'user' else 'Assistente'
+            lines.append(f"{speaker}: {turn['text']}")
+        prompt = (
+            "Aggiorna il riassunto di una conversazione tra un utente e l'assistente vendite/magazzino.\n"
+            "Conserva numeri e nomi di ordini, clienti, prodotti, quantità, date e le richieste ancora aperte; "
+            "ometti saluti e formattazione. Massimo 10 righe.\n\n"
+            f"RIASSUNTO PRECEDENTE:\n{previous.text if previous else '(nessuno)'}\n\n"
+            "NUOVI TURNI:\n" + "\n".join(lines)
+        )
+        summary = self.env['discuss.channel']._get_gemini_response(
+            config, [{'role': 'user', 'content': prompt}], task='summarize_history'
+        )
+        summary = plain_text(summary)
+        if not summary:
+            return False
+
+        self.env['ai.conversation.summary'].create({
+            'conversation_id': self.id,
+            'text': summary[:MAX_SUMMARY_CHARS],
+            'upto_turn_id': first_kept,
+            'last_turn_date': turns[-1]['date'],
+        })
+        _logger.info(f"🧾 Riassunto conversazione aggiornato: canale {self.channel_id.id}, turni fino a {first_kept}")
+        return True
+
+    # ------------------------------------------------------------------
+    # Pulizia
+    # ------------------------------------------------------------------
+
+    @api.autovacuum
+    def _gc_conversation_turns(self):
+        """Elimina turni e riassunti più vecchi di TURN_RETENTION_DAYS giorni."""
+        cutoff = fields.Datetime.now() - timedelta(days=TURN_RETENTION_DAYS)
+        self.env['ai.conversation.turn'].search([('date', '<', cutoff)]).unlink()
+        self.env['ai.conversation.summary'].search([('create_date', '<', cutoff)]).unlink()
+
+
+class AIConversationTurn(models.Model):
+    """Turno di una conversazione AI: righe solo aggiunte, l'id ne dà l'ordine."""
+    _name = 'ai.conversation.turn'
+    _description = 'AI Conversation Turn'
+    _order = 'id'
+
+    conversation_id = fields.Many2one('ai.conversation', string='Conversazione', required=True, ondelete='cascade', index=True)
+    role = fields.Selection([
+        ('user', 'Utente'),
+        ('assistant', 'Assistente'),
+    ], string='Ruolo', required=True)
+    text = fields.Text(string='Testo', required=True)
+    date = fields.Datetime(string='Data', required=True, default=fields.Datetime.now, index=True)
+
+
+class AIConversationSummary(models.Model):
+    """Riassunto dei turni di una conversazione fino a `upto_turn_id` (escluso)."""
+    _name = 'ai.conversation.summary'
+    _description = 'AI Conversation Summary'
+    _order = 'id desc'
+
+    conversation_id = fields.Many2one('ai.conversation', string='Conversazione', required=True, ondelete='cascade', index=True)
+    text = fields.Text(string='Riassunto', required=True)
+    upto_turn_id = fields.Integer(string='Riassunto fino al turno', required=True)
+    last_turn_date = fields.Datetime(string='Data ultimo turno riassunto', required=True)
@@ -0,0 +1,384 @@
+"""
+Registro delle funzioni invocabili dall'AI.
+
+I metodi di `warehouse.operations` esposti al modello sono decorati con
+`@ai_function`, che dichiara nome, descrizione, parametri tipizzati, se la
+funzione è di sola lettura e per quanto il risultato può essere riusato.
+Dal registro derivano:
+
+- `discuss.channel._get_available_functions()` (prompt e tool nativi)
+- il dispatch di `_execute_function`: lookup per nome al posto della
+  catena if/elif
+- la conversione degli argomenti del modello (stringhe nei tag, JSON
+  nelle tool call) nei tipi dichiarati, con un convertitore per
+  parametro preparato una volta alla decorazione
+
+Lo schema mostrato al modello e l'esecuzione non possono quindi divergere.
+
+Le funzioni che scrivono non fanno commit: tutte le chiamate di un turno
+di chat stanno nella transazione della richiesta (o del job asincrono),
+ciascuna nel proprio savepoint (`call_in_savepoint`). Una chiamata che
+fallisce annulla solo le proprie scritture e le successive proseguono.
+"""
+import ast
+import inspect
+import itertools
+import json
+import logging
+import weakref
+from collections import namedtuple
+
+_logger = logging.getLogger(__name__)
+
+# Valori testuali interpretati come "vero" per i parametri booleani
+TRUE_STRINGS = frozenset({'true', '1', 'yes', 'y', 'si', 'sì', 's'})
+
+# Ordine di dichiarazione: è l'ordine delle funzioni nel prompt
+_declaration_counter = itertools.count()
+
+AiParam = namedtuple('AiParam', ['name', 'type', 'description', 'required', 'default', 'hint', 'coerce'])
+
+
+class FunctionArgumentError(ValueError):
+    """Argomento mancante o non convertibile nel tipo dichiarato."""
+
+    def __init__(self, message, hint=None):
+        super().__init__(message)
+        self.hint = hint
+
+    def to_result(self):
+        result = {"error": str(self)}
+        if self.hint:
+            result["ai_instruction"] = self.hint
+        return result
+
+
+class _CallFailed(Exception):
+    """Risultato di errore di una funzione: annulla il savepoint della chiamata."""
+
+    def __init__(self, result):
+        super().__init__(result.get('error'))
+        self.result = result
+
+
+def call_in_savepoint(cr, compute):
+    """
+    Esegue `compute()` in un savepoint del cursore del turno.
+
+    Un'eccezione o un risultato `{"error": ...}` annullano le scritture
+    della sola chiamata; l'eccezione viene rilanciata, il risultato di
+    errore restituito. Il commit resta a chi gestisce la transazione.
+    """
+    try:
+        with cr.savepoint():
+            result = compute()
+            if isinstance(result, dict) and result.get('error'):
+                raise _CallFailed(result)
+    except _CallFailed as failed:
+        _logger.info(f"↩️ Scritture annullate (savepoint): {failed}")
+        return failed.result
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Convertitori
+# ---------------------------------------------------------------------------
+
+def _to_string(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _to_integer(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if value.is_integer():
+            return int(value)
+        raise ValueError(value)
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        number = float(text)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    # Accetta anche la virgola decimale ("12,5")
+    return float(str(value).strip().replace(',', '.'))
+
+
+def _to_boolean(value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_STRINGS
+    return bool(value)
+
+
+def _decode_structure(value):
+    """JSON o, in alternativa, letterale Python (liste con apici singoli)."""
+    text = value.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def _to_array(value):
+    if isinstance(value, str):
+        value = _decode_structure(value)
+    if isinstance(value, tuple):
+        value = list(value)
+    elif isinstance(value, dict):
+        # Una sola riga passata senza lista
+        value = [value]
+    if not isinstance(value, list):
+        raise ValueError(value)
+    return value
+
+
+def _to_object(value):
+    if isinstance(value, str):
+        value = _decode_structure(value)
+    if not isinstance(value, dict):
+        raise ValueError(value)
+    return value
+
+
+COERCERS = {
+    'string': _to_string,
+    'integer': _to_integer,
+    'number': _to_number,
+    'boolean': _to_boolean,
+    'array': _to_array,
+    'object': _to_object,
+}
+
+# Messaggio per un valore non convertibile, per tipo
+TYPE_ERRORS = {
+    'integer': "{name} deve essere un numero",
+    'number': "{name} deve essere un numero",
+    'array': "{name} deve essere una lista",
+    'object': "{name} deve essere un oggetto JSON",
+}
+
+
+# ---------------------------------------------------------------------------
+# Definizione di una funzione
+# ---------------------------------------------------------------------------
+
+class AiFunction:
+    """
+    Funzione esposta al modello.
+
+    Attributes:
+        name: nome usato dal modello (tag o tool call)
+        method: metodo di `warehouse.operations` che la esegue
+        handler: metodo opzionale di `discuss.channel` che gestisce la
+            chiamata (es. gate di conferma), con firma `(function, params)`
+        read_only: nessuna scrittura (eseguibile in anticipo o in parallelo)
+        cache: secondi per cui il risultato può essere riusato (None = mai)
+    """
+
+    __slots__ = ('name', 'method', 'description', 'params', 'arguments', 'read_only', 'cache',
+                 'handler', 'aliases', 'order')
+
+    def __init__(self, name, method, description, params, arguments, read_only, cache, handler, aliases, order):
+        self.name = name
+        self.method = method
+        self.description = description
+        self.params = params
+        self.arguments = arguments
+        self.read_only = read_only
+        self.cache = cache
+        self.handler = handler
+        self.aliases = aliases
+        self.order = order
+
+    def coerce(self, parameters):
+        """
+        Parametri del modello → argomenti tipizzati.
+
+        Gli alias vengono rinominati, i parametri non dichiarati scartati e
+        i valori vuoti trattati come assenti. Un valore non convertibile
+        torna al default del metodo se ne ha uno, altrimenti è un errore.
+
+        Raises:
+            FunctionArgumentError: parametro obbligatorio mancante o non valido
+        """
+        params = {}
+        for key, value in (parameters or {}).items():
+            target = self.aliases.get(key)
+            if target:
+                _logger.warning(f"AI ha usato '{key}' invece di '{target}' in {self.name} - correggo automaticamente")
+                key = target
+            param = self.params.get(key)
+            if param is None:
+                _logger.warning(f"Parametro '{key}' non previsto per {self.name} - ignorato")
+                continue
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            try:
+                params[key] = param.coerce(value)
+            except (TypeError, ValueError, SyntaxError):
+                if param.default is not None:
+                    _logger.warning(f"Valore non valido per {self.name}.{key}: {value!r} - uso il default {param.default!r}")
+                    continue
+                message = TYPE_ERRORS.get(param.type, "{name} non valido").format(name=key)
+                raise FunctionArgumentError(message, param.hint)
+
+        for param in self.params.values():
+            if param.required and param.name not in params:
+                raise FunctionArgumentError(f"Parametro obbligatorio '{param.name}' mancante", param.hint)
+        return params
+
+    def method_arguments(self, params):
+        """Solo i parametri accettati dal metodo (senza quelli consumati dall'handler)."""
+        return {key: value for key, value in params.items() if key in self.arguments}
+
+    def call(self, env, params):
+        """Esegue il metodo di `warehouse.operations` con argomenti già convertiti."""
+        return getattr(env['warehouse.operations'], self.method)(**params)
+
+    def prompt_spec(self):
+        """Voce di `_get_available_functions()`."""
+        return {
+            "description": self.description,
+            "parameters": {
+                param.name: param.description
+                for param in self.params.values() if param.description is not None
+            },
+            "schema": self.json_schema(),
+        }
+
+    def json_schema(self):
+        """
+        Schema JSON dei parametri per i tool nativi.
+
+        Liste e oggetti sono dichiarati come stringhe JSON: gli schemi dei
+        provider richiedono la struttura degli elementi, che qui è descritta
+        solo a parole; `coerce` li decodifica comunque.
+        """
+        properties = {}
+        for param in self.params.values():
+            if param.description is None:
+                continue
+            if param.type in ('array', 'object'):
+                properties[param.name] = {"type": "string", "description": f"{param.description} (JSON)"}
+            else:
+                properties[param.name] = {"type": param.type, "description": param.description}
+        schema = {"type": "object", "properties": properties}
+        required = [param.name for param in self.params.values() if param.required]
+        if required:
+            schema["required"] = required
+        return schema
+
+
+def ai_function(name=None, description='', params=None, read_only=False, cache=None, handler=None, aliases=None):
+    """
+    Espone un metodo di `warehouse.operations` al modello.
+
+    Args:
+        name: nome per il modello (default: nome del metodo)
+        params: {nome: (tipo, descrizione) | (tipo, descrizione, suggerimento)},
+            nell'ordine mostrato al modello. Tipi: string, integer, number,
+            boolean, array, object. Il suggerimento accompagna l'errore se il
+            parametro manca o non è valido. Descrizione None = parametro
+            accettato ma non mostrato al modello. Obbligatori = senza default
+            nella firma del metodo; i parametri assenti dalla firma sono
+            consumati dall'handler.
+        read_only: la funzione non scrive
+        cache: secondi di validità del risultato (solo funzioni di sola lettura)
+        handler: nome del metodo di `discuss.channel` che gestisce la chiamata
+        aliases: {nome errato: nome corretto} dei parametri
+    """
+    if cache and not read_only:
+        raise ValueError("La cache è ammessa solo per funzioni di sola lettura")
+
+    def decorator(method):
+        signature = inspect.signature(method)
+        compiled = {}
+        for param_name, spec in (params or {}).items():
+            param_type, param_description = spec[0], spec[1]
+            hint = spec[2] if len(spec) > 2 else None
+            if param_type not in COERCERS:
+                raise ValueError(f"Tipo '{param_type}' non supportato per {method.__name__}.{param_name}")
+            arg = signature.parameters.get(param_name)
+            required = arg is not None and arg.default is inspect.Parameter.empty
+            default = None if arg is None or required else arg.default
+            compiled[param_name] = AiParam(
+                param_name, param_type, param_description, required, default, hint, COERCERS[param_type],
+            )
+        method._ai_function = AiFunction(
+            name=name or method.__name__,
+            method=method.__name__,
+            description=description,
+            params=compiled,
+            arguments=frozenset(signature.parameters) - {'self'},
+            read_only=read_only,
+            cache=cache,
+            handler=handler,
+            aliases=dict(aliases or {}),
+            order=next(_declaration_counter),
+        )
+        return method
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# Registro
+# ---------------------------------------------------------------------------
+
+class AiFunctionRegistry:
+    """Funzioni esposte dalla classe `warehouse.operations` di un registry Odoo."""
+
+    def __init__(self, functions):
+        functions = sorted(functions, key=lambda function: function.order)
+        self.functions = {function.name: function for function in functions}
+        self.read_only = frozenset(function.name for function in functions if function.read_only)
+        self.available_functions = {function.name: function.prompt_spec() for function in functions}
+
+    def get(self, name):
+        return self.functions.get(name)
+
+    def __contains__(self, name):
+        return name in self.functions
+
+
+# Un registro per classe di modello: la classe cambia a ogni ricarica del registry Odoo
+_registries = weakref.WeakKeyDictionary()
+
+
+def _collect_functions(model_class):
+    """
+    Funzioni dichiarate lungo la MRO: un override senza decoratore di un
+    metodo esposto eredita la dichiarazione della classe base.
+    """
+    found = {}
+    for klass in reversed(model_class.__mro__):
+        for attr, member in vars(klass).items():
+            spec = getattr(member, '_ai_function', None)
+            if isinstance(spec, AiFunction):
+                found[attr] = spec
+    return found.values()
+
+
+def get_function_registry(env):
+    """Registro delle funzioni AI per l'environment."""
+    model_class = type(env['warehouse.operations'])
+    registry = _registries.get(model_class)
+    if registry is None:
+        registry = _registries[model_class] = AiFunctionRegistry(_collect_functions(model_class))
+        _logger.info(f"🧰 Registro funzioni AI: {len(registry.functions)} funzioni ({len(registry.read_only)} di sola lettura)")
+    return registry
@@ -0,0 +1,258 @@
+from odoo import models, fields, api
+from datetime import datetime, timedelta
+import html
+import json
+import logging
+import re
+
+from .ai_functions import call_in_savepoint, get_function_registry
+
+_logger = logging.getLogger(__name__)
+
+# Marker mostrati in chat con il riepilogo da confermare (contesto per l'LLM)
+PENDING_SO_MARKER = "[PENDING_SO]"
+PENDING_CANCEL_MARKER = "[PENDING_CANCEL]"
+MARKER_KINDS = {
+    PENDING_SO_MARKER: 'create_sales_order',
+    PENDING_CANCEL_MARKER: 'cancel_sales_order',
+}
+_MARKER_RE = re.compile(r"\[PENDING_(?:SO|CANCEL)\]")
+
+# Messaggio utente che conferma l'azione in attesa
+CONFIRMATION_RE = re.compile(r'\b(S[IÌI]|CONFERMO|OK\s*VAI|PERFETTO)\b', re.I)
+
+# Validità di un'azione in attesa di conferma (secondi)
+PENDING_ACTION_TTL = 3600
+# Azioni chiuse più vecchie di N giorni vengono eliminate dall'autovacuum
+CLOSED_RETENTION_DAYS = 7
+
+# Chiave in cr.precommit.data dei canali con un'azione registrata nella transazione
+_PRECOMMIT_KEY = 'ai_livebot.pending_action'
+
+_decoder = json.JSONDecoder()
+
+
+class AIPendingAction(models.Model):
+    """
+    Azione proposta dal bot in attesa di conferma dell'utente ("SÌ", "CONFERMO").
+
+    Al massimo una azione 'pending' per canale (indice univoco parziale): la
+    conferma è una lettura per chiave del canale, senza cercare l'ultimo
+    messaggio del bot e senza estrarre JSON dal suo HTML. Una risposta del
+    bot senza nuovo riepilogo chiude l'azione, come prima faceva il marker
+    che spariva dall'ultimo messaggio.
+    """
+    _name = 'ai.pending.action'
+    _description = 'AI Pending Action'
+    _order = 'id desc'
+
+    channel_id = fields.Many2one('discuss.channel', string='Canale', required=True, ondelete='cascade', index=True)
+    kind = fields.Selection([
+        ('create_sales_order', 'Creazione ordine di vendita'),
+        ('cancel_sales_order', 'Cancellazione ordine di vendita'),
+    ], string='Azione', required=True)
+    payload = fields.Json(string='Parametri', required=True)
+    state = fields.Selection([
+        ('pending', 'In attesa'),
+        ('done', 'Eseguita'),
+        ('cancelled', 'Annullata'),
+    ], string='Stato', default='pending', required=True, index=True)
+    expires_at = fields.Datetime(string='Scadenza', required=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ai_pending_action_channel_pending_uniq
+                ON ai_pending_action (channel_id) WHERE state = 'pending'
+        """)
+
+    # ------------------------------------------------------------------
+    # Registrazione
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _prepare_payload(self, kind, payload):
+        """
+        Parametri tipizzati per il metodo di `warehouse.operations`: convertiti
+        dal registro delle funzioni AI e ristretti alla firma del metodo.
+        """
+        function = get_function_registry(self.env).get(kind)
+        return function.method_arguments(function.coerce(payload))
+
+    @api.model
+    def _register(self, channel, kind, payload, ttl=PENDING_ACTION_TTL):
+        """Registra l'azione da confermare per il canale, sostituendo quella in attesa."""
+        payload = self._prepare_payload(kind, payload)
+        self._close_pending(channel)
+        action = self.create({
+            'channel_id': channel.id,
+            'kind': kind,
+            'payload': payload,
+            'expires_at': fields.Datetime.now() + timedelta(seconds=ttl),
+        })
+        self.env.cr.precommit.data.setdefault(_PRECOMMIT_KEY, set()).add(channel.id)
+        _logger.info(f"⏳ Azione in attesa di conferma: {kind} (canale {channel.id}, azione {action.id})")
+        return action
+
+    @api.model
+    def _close_pending(self, channel, state='cancelled'):
+        """Chiude l'azione in attesa del canale. Returns: l'azione chiusa (o vuoto)."""
+        action = self.search([('channel_id', '=', channel.id), ('state', '=', 'pending')], limit=1)
+        if action:
+            action.state = state
+            # Prima di un nuovo INSERT: l'indice univoco ammette una sola azione 'pending'
+            self.flush_model(['state'])
+        return action
+
+    @api.model
+    def _sync_with_reply(self, channel, reply):
+        """
+        Allinea l'azione in attesa alla risposta del bot appena pubblicata.
+
+        Un'azione registrata nel turno dall'handler della funzione resta
+        valida così com'è. Altrimenti un riepilogo con marker scritto
+        dall'LLM viene registrato e una risposta senza marker chiude
+        l'azione precedente.
+        """
+        if not channel or channel._name != 'discuss.channel':
+            return
+        if channel.id in self.env.cr.precommit.data.get(_PRECOMMIT_KEY, ()):
+            return
+        reply = str(reply or '')
+        match = _MARKER_RE.search(reply)
+        if match is None:
+            self._close_pending(channel)
+            return
+
+        kind = MARKER_KINDS[match.group()]
+        text = html.unescape(re.sub(r'<[^>]+>', '', reply[match.end():]))
+        start = text.find('{')
+        try:
+            payload = _decoder.raw_decode(text, start)[0] if start != -1 else None
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            _logger.warning(f"⚠️ Marker {match.group()} senza parametri JSON validi: azione non registrata")
+            self._close_pending(channel)
+            return
+
+        try:
+            self._register(channel, kind, payload)
+        except Exception as e:
+            _logger.warning(f"⚠️ Parametri {match.group()} non validi ({e}): azione non registrata")
+            self._close_pending(channel)
+
+    # ------------------------------------------------------------------
+    # Conferma
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_pending(self, channel, kind=None):
+        """
+        Azione in attesa (non scaduta) del canale proposta all'utente corrente,
+        o recordset vuoto: un altro membro del canale non può far confermare
+        un'azione registrata da lui.
+        """
+        domain = [
+            ('channel_id', '=', channel.id),
+            ('state', '=', 'pending'),
+            ('expires_at', '>', fields.Datetime.now()),
+            ('create_uid', '=', self.env.uid),
+        ]
+        if kind:
+            domain.append(('kind', '=', kind))
+        return self.search(domain, limit=1)
+
+    @api.model
+    def _confirm(self, channel, user_message):
+        """
+        Se il messaggio conferma l'azione in attesa del canale, la esegue.
+
+        Returns:
+            str | None: testo della risposta, None se non c'era nulla da confermare
+        """
+        if not CONFIRMATION_RE.search(user_message or ''):
+            return None
+        action = self._get_pending(channel)
+        if not action:
+            return None
+        # Una seconda conferma concorrente fallisce qui (aggiornamento concorrente) e viene ritentata
+        action.state = 'done'
+        _logger.info(f"✅ Utente ha confermato {action.kind} (azione {action.id}): {action.payload}")
+        return action._execute()
+
+    def _execute(self):
+        self.ensure_one()
+        params = dict(self.payload)
+        warehouse_ops = self.env['warehouse.operations']
+        if self.kind == 'create_sales_order':
+            scheduled = params.get('scheduled_date')
+            if scheduled:
+                try:
+                    fmt = "%Y-%m-%d %H:%M:%S" if ' ' in scheduled else "%Y-%m-%d"
+                    params['scheduled_date'] = datetime.strptime(scheduled, fmt)
+                except ValueError:
+                    _logger.warning(f"Formato scheduled_date non valido: {scheduled}, rimuovo il parametro")
+                    params.pop('scheduled_date', None)
+            result = call_in_savepoint(self.env.cr, lambda: warehouse_ops.create_sales_order(**params))
+            return self._format_created(result)
+        result = call_in_savepoint(self.env.cr, lambda: warehouse_ops.cancel_sales_order(**params))
+        return self._format_cancelled(result, params)
+
+    @api.model
+    def _format_error(self, result):
+        lines = [f"⚠️ Errore: {result.get('error')}"]
+        if result.get('details'):
+            lines.append(result['details'])
+        return "\n\n".join(lines)
+
+    @api.model
+    def _format_created(self, result):
+        if isinstance(result, dict) and result.get('error'):
+            return self._format_error(result)
+        lines = []
+        order_name = result.get('sale_order_name') or result.get('order_name')
+        if order_name:
+            lines.append(f"✅ Ordine creato: {order_name}")
+        order_id = result.get('sale_order_id') or result.get('order_id')
+        if order_id:
+            lines.append(f"ID interno: {order_id}")
+
+        state = result.get('state', 'N/A')
+        state_map = {'draft': 'Bozza', 'sent': 'Inviato', 'sale': 'Confermato', 'done': 'Evaso'}
+        lines.append(f"Stato: {state_map.get(state, state)}")
+
+        pickings = result.get('pickings', [])
+        if pickings:
+            lines.append("\nConsegne generate:")
+            for p in pickings:
+                lines.append(f"  • {p.get('picking_name')} - {p.get('scheduled_date', 'N/A')}")
+        lines.append(f"\nTotale: €{result.get('amount_total', 0):.2f}")
+        return "\n\n".join(lines)
+
+    @api.model
+    def _format_cancelled(self, result, params):
+        if isinstance(result, dict) and result.get('error'):
+            return self._format_error(result)
+        lines = []
+        order_name = result.get('order_name') or params.get('order_name')
+        if order_name:
+            lines.append(f"✅ Ordine cancellato: {order_name}")
+        order_id = result.get('order_id') or params.get('order_id')
+        if order_id:
+            lines.append(f"ID interno: {order_id}")
+        lines.append(f"Stato finale: {result.get('current_state', 'cancel')}")
+        return "\n\n".join(lines)
+
+    # ------------------------------------------------------------------
+    # Pulizia
+    # ------------------------------------------------------------------
+
+    @api.autovacuum
+    def _gc_pending_actions(self):
+        """Chiude le azioni scadute ed elimina quelle chiuse da più di CLOSED_RETENTION_DAYS giorni."""
+        now = fields.Datetime.now()
+        self.search([('state', '=', 'pending'), ('expires_at', '<=', now)]).write({'state': 'cancelled'})
+        self.search([
+            ('state', '!=', 'pending'),
+            ('write_date', '<', now - timedelta(days=CLOSED_RETENTION_DAYS)),
+        ]).unlink()
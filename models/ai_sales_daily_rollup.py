@@ -0,0 +1,206 @@
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Stati degli ordini che entrano nelle statistiche di vendita
+CONFIRMED_STATES = ('sale', 'done')
+# Ultima riconciliazione completata (assente = rollup non ancora costruito)
+RECONCILED_AT_PARAM = 'ai_livebot.sales_rollup_reconciled_at'
+# Chiave in cr.precommit.data dei giorni da ricalcolare nella transazione
+_PRECOMMIT_KEY = 'ai_livebot.sales_rollup_days'
+
+
+class AISalesDailyRollup(models.Model):
+    """
+    Vendite confermate pre-aggregate per giorno.
+
+    Righe 'partner': ordini e importi per (giorno, azienda, cliente, stato).
+    Righe 'product': quantità, ricavi e ordini per (giorno, azienda, prodotto).
+
+    I giorni toccati da modifiche a sale.order / sale.order.line vengono
+    segnati "sporchi" (`ai.sales.daily.rollup.dirty`) al commit della
+    transazione e ricalcolati dal cron di riconciliazione, svegliato subito:
+    le conferme degli ordini non aspettano lock né ricalcoli. Finché un giorno
+    del periodo richiesto è sporco le statistiche usano il percorso ORM.
+    Il cron ricalcola anche i giorni degli ordini modificati dall'ultima
+    esecuzione (e costruisce tutto al primo avvio).
+    """
+    _name = 'ai.sales.daily.rollup'
+    _description = 'AI Sales Daily Rollup'
+    _order = 'date desc, id'
+    _log_access = False
+
+    kind = fields.Selection([
+        ('partner', 'Cliente'),
+        ('product', 'Prodotto'),
+    ], string='Tipo', required=True, index=True)
+    date = fields.Date(string='Giorno', required=True, index=True)
+    company_id = fields.Many2one('res.company', string='Azienda', index=True)
+    partner_id = fields.Many2one('res.partner', string='Cliente', ondelete='cascade', index=True)
+    product_id = fields.Many2one('product.product', string='Prodotto', ondelete='cascade', index=True)
+    state = fields.Char(string='Stato ordine')
+    order_count = fields.Integer(string='Ordini')
+    amount_untaxed = fields.Float(string='Imponibile')
+    amount_total = fields.Float(string='Totale')
+    qty = fields.Float(string='Quantità')
+    revenue = fields.Float(string='Ricavi righe')
+
+    @api.model
+    def _is_ready(self):
+        """True dopo la prima costruzione completa del rollup"""
+        return bool(self.env['ir.config_parameter'].sudo().get_param(RECONCILED_AT_PARAM))
+
+    @api.model
+    def _can_serve(self, start_date=None):
+        """
+        True se le statistiche dell'utente corrente possono essere lette dal rollup.
+
+        Il rollup aggrega tutti gli ordini dell'azienda e non ha le regole di
+        sale.order: lo usa solo chi vede tutti i documenti di vendita
+        (`group_sale_salesman_all_leads`); per gli altri (es. "solo i propri
+        documenti") le funzioni restano sul percorso ORM, filtrato dalle regole.
+        """
+        return (
+            self.env.user.has_group('sales_team.group_sale_salesman_all_leads')
+            and self._is_ready()
+            and not self._has_dirty_days(start_date)
+        )
+
+    @api.model
+    def _has_dirty_days(self, start_date=None):
+        """True se un giorno del periodo (da `start_date`) attende il ricalcolo del cron"""
+        if start_date:
+            start = start_date.date() if hasattr(start_date, 'date') else start_date
+            self.env.cr.execute("SELECT 1 FROM ai_sales_daily_rollup_dirty WHERE date >= %s LIMIT 1", [start])
+        else:
+            self.env.cr.execute("SELECT 1 FROM ai_sales_daily_rollup_dirty LIMIT 1")
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _analytics_domain(self, kind, start_date=None):
+        """Dominio di lettura: tipo di riga, aziende attive dell'utente e periodo"""
+        domain = [('kind', '=', kind), ('company_id', 'in', self.env.companies.ids)]
+        if start_date:
+            domain.append(('date', '>=', start_date.date() if hasattr(start_date, 'date') else start_date))
+        return domain
+
+    @api.model
+    def _mark_dirty(self, days):
+        """Registra i giorni da ricalcolare al commit della transazione corrente."""
+        days = {day for day in days if day}
+        if not days:
+            return
+        precommit = self.env.cr.precommit
+        if _PRECOMMIT_KEY not in precommit.data:
+            precommit.data[_PRECOMMIT_KEY] = set()
+            precommit.add(self.sudo()._flush_dirty_days)
+        precommit.data[_PRECOMMIT_KEY].update(days)
+
+    @api.model
+    def _flush_dirty_days(self):
+        """
+        Al commit: scrive i giorni sporchi (solo INSERT, nessun lock condiviso
+        tra transazioni) e sveglia il cron che li ricalcola.
+        """
+        days = self.env.cr.precommit.data.pop(_PRECOMMIT_KEY, set())
+        if not days or not self._is_ready():
+            return
+        self.env.cr.execute(
+            "INSERT INTO ai_sales_daily_rollup_dirty (date) SELECT unnest(%s::date[])",
+            [sorted(days)],
+        )
+        cron = self.env.ref('ai_livebot.ir_cron_ai_sales_rollup_reconcile', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    @api.model
+    def _recompute_days(self, days=None):
+        """
+        Ricalcola le righe dei giorni indicati (None = tutto) dai dati grezzi,
+        con due INSERT ... SELECT raggruppati.
+        """
+        cr = self.env.cr
+        # Eseguito solo dal cron: il lock copre un'esecuzione manuale concorrente
+        cr.execute("SELECT pg_advisory_xact_lock(hashtext('ai_sales_daily_rollup'))")
+
+        day_filter = "AND so.date_order::date IN %(days)s" if days is not None else ""
+        params = {'states': CONFIRMED_STATES, 'days': tuple(days or ())}
+
+        if days is not None:
+            cr.execute("DELETE FROM ai_sales_daily_rollup WHERE date IN %(days)s", params)
+        else:
+            cr.execute("DELETE FROM ai_sales_daily_rollup")
+
+        cr.execute(f"""
+            INSERT INTO ai_sales_daily_rollup
+                   (kind, date, company_id, partner_id, state, order_count, amount_untaxed, amount_total, qty, revenue)
+            SELECT 'partner', so.date_order::date, so.company_id, so.partner_id, so.state,
+                   count(*), sum(so.amount_untaxed), sum(so.amount_total), 0, 0
+              FROM sale_order so
+             WHERE so.state IN %(states)s
+                   {day_filter}
+          GROUP BY so.date_order::date, so.company_id, so.partner_id, so.state
+        """, params)
+        partner_rows = cr.rowcount
+
+        cr.execute(f"""
+            INSERT INTO ai_sales_daily_rollup
+                   (kind, date, company_id, product_id, order_count, amount_untaxed, amount_total, qty, revenue)
+            SELECT 'product', so.date_order::date, so.company_id, sol.product_id,
+                   count(DISTINCT so.id), 0, 0, sum(sol.product_uom_qty), sum(sol.price_subtotal)
+              FROM sale_order_line sol
+              JOIN sale_order so ON so.id = sol.order_id
+             WHERE so.state IN %(states)s
+               AND sol.display_type IS NULL
+               AND sol.product_id IS NOT NULL
+                   {day_filter}
+          GROUP BY so.date_order::date, so.company_id, sol.product_id
+        """, params)
+        product_rows = cr.rowcount
+
+        self.invalidate_model()
+        _logger.info(
+            f"📈 Rollup vendite ricalcolato ({'tutti i giorni' if days is None else f'{len(days)} giorni'}): "
+            f"{partner_rows} righe cliente, {product_rows} righe prodotto"
+        )
+
+    @api.model
+    def _cron_reconcile(self):
+        """
+        Riallinea il rollup: al primo avvio lo costruisce da zero, poi ricalcola
+        i giorni degli ordini modificati dopo l'ultima riconciliazione (copre
+        modifiche fatte senza passare dagli hook, es. SQL o import).
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        last = ICP.get_param(RECONCILED_AT_PARAM)
+        now = fields.Datetime.now()
+
+        # Giorni segnati dalle transazioni committate finora (quelli di transazioni
+        # ancora aperte restano in tabella per il prossimo giro)
+        self.env.cr.execute("DELETE FROM ai_sales_daily_rollup_dirty RETURNING date")
+        days = {row[0] for row in self.env.cr.fetchall()}
+
+        if not last:
+            self._recompute_days(None)
+        else:
+            self.env.cr.execute("""
+                SELECT DISTINCT date_order::date
+                  FROM sale_order
+                 WHERE write_date >= %s AND date_order IS NOT NULL
+            """, [last])
+            days.update(row[0] for row in self.env.cr.fetchall())
+            if days:
+                self._recompute_days(days)
+
+        ICP.set_param(RECONCILED_AT_PARAM, fields.Datetime.to_string(now))
+        return True
+
+
+class AISalesDailyRollupDirty(models.Model):
+    """Giorni del rollup vendite in attesa di ricalcolo da parte del cron (solo INSERT/DELETE)."""
+    _name = 'ai.sales.daily.rollup.dirty'
+    _description = 'AI Sales Daily Rollup Dirty Day'
+    _log_access = False
+
+    date = fields.Date(string='Giorno', required=True, index=True)
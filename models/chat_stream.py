@@ -0,0 +1,207 @@
+"""
+Pubblicazione in chat di una risposta AI mentre viene generata.
+
+Con `ai.config.streaming` la chiamata LLM principale del turno arriva a
+chunk: il testo fuori dai tag funzione viene mostrato subito nel canale
+come messaggio del bot in costruzione, e ogni tag completo può essere
+eseguito prima della fine della generazione.
+
+L'anteprima vive interamente su un cursore separato (committato subito):
+creazione, aggiornamenti ed eliminazione. La transazione del turno, con lo
+snapshot preso prima della creazione, non la vedrebbe; le sue notifiche bus
+partirebbero solo al commit finale. L'anteprima viene creata direttamente
+come `mail.message` (non con `message_post`, che aggiornerebbe le righe del
+canale bloccate dalla transazione del turno).
+
+La risposta definitiva è sempre pubblicata con `message_post` nella
+transazione del turno (ultimo messaggio/non letti del canale, notifiche ai
+membri, override di `message_post`); l'anteprima viene eliminata al commit
+del turno. Se il turno fallisce, anche solo fino a un savepoint (job
+ritentato, `call_in_savepoint`), l'anteprima viene eliminata subito.
+
+Qualsiasi errore di pubblicazione disattiva lo streaming per il turno:
+la risposta viene comunque pubblicata alla fine nel modo normale.
+"""
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from odoo import api
+from odoo.tools import plaintext2html
+
+_logger = logging.getLogger(__name__)
+
+# Intervallo minimo tra due aggiornamenti dell'anteprima (secondi)
+PREVIEW_INTERVAL = 0.15
+
+_local = threading.local()
+
+
+@contextmanager
+def streaming(stream):
+    """Rende `stream` lo stream del turno corrente (None = nessuno streaming)."""
+    previous = getattr(_local, 'stream', None)
+    _local.stream = stream
+    try:
+        yield stream
+    finally:
+        _local.stream = previous
+
+
+def current_stream():
+    """Stream del turno corrente o None."""
+    return getattr(_local, 'stream', None)
+
+
+def streamed_reply(method):
+    """
+    Decoratore per i metodi di `discuss.channel` che generano e pubblicano
+    la risposta del bot: con lo streaming attivo apre un `ChatStream` sul
+    canale per tutto il turno. L'anteprima viene eliminata al commit del
+    turno (la risposta è pubblicata con `message_post`), subito se il
+    metodo solleva un'eccezione.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if current_stream() is not None or not self.env['ai.config']._is_streaming_enabled():
+            return method(self, *args, **kwargs)
+        stream = ChatStream(self, self.env.ref('base.partner_root').id, on_function=self._prefetch_function)
+        with streaming(stream):
+            try:
+                result = method(self, *args, **kwargs)
+            except Exception:
+                stream.discard()
+                raise
+        stream.discard_on_commit()
+        return result
+    return wrapper
+
+
+class ChatStream:
+    """
+    Sink di una risposta in streaming per un canale.
+
+    Args:
+        channel: record `discuss.channel` del turno
+        author_id: partner autore del messaggio del bot
+        on_function: callable `(nome, parametri)` invocato per ogni chiamata
+            funzione completa arrivata nello stream (esecuzione anticipata)
+    """
+
+    def __init__(self, channel, author_id, on_function=None):
+        self.channel = channel
+        self.env = channel.env
+        self.author_id = author_id
+        self.on_function = on_function
+        self.text = ''
+        self.message_id = None
+        self.disabled = False
+        self._published = 0
+        self._published_at = 0.0
+        self._started_at = time.time()
+
+    # -- callback dello stream ----------------------------------------------
+
+    def push_text(self, delta):
+        """Testo fuori dai tag appena arrivato: aggiorna l'anteprima (con throttling)."""
+        if not delta or self.disabled:
+            return
+        self.text += delta
+        if not self.text.strip():
+            return
+        if self.message_id and time.time() - self._published_at < PREVIEW_INTERVAL:
+            return
+        self._publish()
+
+    def push_function(self, name, params):
+        """Chiamata funzione completa arrivata nello stream."""
+        if self.on_function:
+            try:
+                self.on_function(name, params)
+            except Exception as e:
+                _logger.warning(f"⚠️ Esecuzione anticipata di {name} fallita: {e}")
+
+    def flush(self):
+        """Fine dello stream: pubblica l'ultima parte dell'anteprima."""
+        if self.message_id and len(self.text) > self._published:
+            self._publish()
+
+    # -- pubblicazione -------------------------------------------------------
+
+    @contextmanager
+    def _side_env(self):
+        """Environment su un cursore separato, committato all'uscita."""
+        with self.env.registry.cursor() as cr:
+            yield api.Environment(cr, self.env.uid, self.env.context)
+
+    def _publish(self):
+        body = plaintext2html(self.text.strip())
+        try:
+            with self._side_env() as env:
+                channel = env['discuss.channel'].browse(self.channel.id)
+                if not self.message_id:
+                    message = self._create_placeholder(env, channel, body)
+                    self.message_id = message.id
+                    # Transazione del turno annullata: l'anteprima non deve restare
+                    self.env.cr.postrollback.add(self.discard)
+                    _logger.info(
+                        f"💬 Anteprima risposta AI in chat dopo {(time.time() - self._started_at) * 1000:.0f}ms "
+                        f"(messaggio {message.id})"
+                    )
+                else:
+                    self._send_body(env, channel, body)
+        except Exception as e:
+            _logger.warning(f"⚠️ Streaming in chat disattivato per questo turno: {e}")
+            self.disabled = True
+            return
+        self._published = len(self.text)
+        self._published_at = time.time()
+
+    def _create_placeholder(self, env, channel, body):
+        from odoo.addons.mail.tools.discuss import Store
+
+        message = env['mail.message'].sudo().create({
+            'model': 'discuss.channel',
+            'res_id': channel.id,
+            'body': body,
+            'author_id': self.author_id,
+            'message_type': 'comment',
+            'subtype_id': env.ref('mail.mt_comment').id,
+        })
+        env['bus.bus']._sendone(channel, 'discuss.channel/new_message', {
+            'data': Store(message).get_result(),
+            'id': channel.id,
+        })
+        return message
+
+    def _send_body(self, env, channel, body):
+        env['bus.bus']._sendone(channel, 'mail.record/insert', {
+            'mail.message': [{'id': self.message_id, 'body': body}],
+        })
+
+    # -- chiusura del turno --------------------------------------------------
+
+    def discard_on_commit(self):
+        """
+        Elimina l'anteprima al commit della transazione del turno, insieme
+        alla pubblicazione della risposta definitiva con `message_post`.
+        """
+        if self.message_id:
+            self.env.cr.postcommit.add(self.discard)
+
+    def discard(self):
+        """Elimina l'anteprima (idempotente)."""
+        if not self.message_id:
+            return
+        message_id, self.message_id = self.message_id, None
+        try:
+            with self._side_env() as env:
+                env['mail.message'].sudo().browse(message_id).exists().unlink()
+                env['bus.bus']._sendone(
+                    env['discuss.channel'].browse(self.channel.id),
+                    'mail.message/delete', {'message_ids': [message_id]},
+                )
+        except Exception as e:
+            _logger.warning(f"⚠️ Eliminazione anteprima {message_id} fallita: {e}")
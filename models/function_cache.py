@@ -0,0 +1,200 @@
+"""
+Cache dei risultati delle funzioni AI di sola lettura, per database.
+
+Le stesse domande di lettura (consegne in sospeso, panoramica vendite, top
+clienti, stock di un prodotto) si ripetono a distanza di minuti: il
+risultato già calcolato evita le query ORM.
+
+- chiave: funzione, argomenti già convertiti dal registro `ai_functions`,
+  utente, aziende attive e lingua
+- durata: `cache` della dichiarazione `@ai_function` (secondi), con un
+  limite LRU sul numero di voci per database
+- invalidazione: le scritture su `sale.order` (e righe), `stock.picking`
+  (e movimenti), `stock.quant`, `product.product` e `product.template`
+  fanno avanzare, dopo il commit, una sequenza PostgreSQL; le voci di una
+  generazione precedente vengono scartate da ogni worker alla lettura
+  successiva
+- una transazione che ha già scritto su quei modelli non legge né scrive
+  la cache: vedrebbe dati diversi da quelli committati
+
+Una transazione iniziata prima di un commit altrui può ancora leggere la
+nuova generazione con i dati precedenti: in quel caso il risultato resta
+vecchio al massimo per la durata della voce.
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+# Sequenza della generazione (creata da `warehouse.operations.init()`)
+GENERATION_SEQUENCE = 'ai_livebot_function_cache_seq'
+# Voci massime per database (LRU)
+DEFAULT_MAX_ENTRIES = 512
+
+# Chiave in cr.precommit.data: la transazione ha scritto su un modello osservato
+_PRECOMMIT_KEY = 'ai_livebot.function_cache'
+
+_MISS = object()
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class FunctionResultCache:
+    """Voci `chiave → (scadenza, generazione, risultato)` di un database, in ordine LRU."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync_generation(self, generation):
+        """Scarta tutte le voci se il database ha segnalato nuove scritture."""
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, key, generation):
+        with self._lock:
+            self._sync_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl, generation):
+        with self._lock:
+            self._sync_generation(generation)
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def get_function_cache(dbname):
+    cache = _caches.get(dbname)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(dbname, FunctionResultCache())
+    return cache
+
+
+def get_function_cache_stats(dbname):
+    """Contatori della cache del database nel worker corrente."""
+    cache = _caches.get(dbname)
+    stats = cache.stats() if cache is not None else FunctionResultCache().stats()
+    stats["dbname"] = dbname
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Generazione (condivisa tra i worker)
+# ---------------------------------------------------------------------------
+
+def create_generation_sequence(cr):
+    cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {GENERATION_SEQUENCE}")
+
+
+def _current_generation(cr):
+    """Generazione corrente, None se la sequenza non esiste (modulo non aggiornato)."""
+    cr.execute(
+        "SELECT to_regclass(%s) IS NOT NULL, pg_sequence_last_value(to_regclass(%s))",
+        [GENERATION_SEQUENCE, GENERATION_SEQUENCE],
+    )
+    exists, last_value = cr.fetchone()
+    if not exists:
+        return None
+    return last_value or 0
+
+
+def _bump_generation(cr):
+    # nextval non è transazionale: la nuova generazione è subito visibile agli altri worker
+    cr.execute("SELECT nextval(to_regclass(%s))", [GENERATION_SEQUENCE])
+
+
+def mark_function_cache_dirty(env):
+    """
+    Registra una scrittura su un modello osservato: la cache viene ignorata
+    per il resto della transazione e invalidata in tutti i worker al commit.
+    """
+    cr = env.cr
+    if _PRECOMMIT_KEY in cr.precommit.data:
+        return
+    cr.precommit.data[_PRECOMMIT_KEY] = True
+    # Dopo il commit: prima i worker potrebbero ricalcolare con i dati vecchi
+    cr.postcommit.add(lambda: _bump_generation(cr))
+
+
+def has_pending_writes(env):
+    """True se la transazione ha scritto su un modello osservato (non ancora committato)."""
+    return _PRECOMMIT_KEY in env.cr.precommit.data
+
+
+# ---------------------------------------------------------------------------
+# Lettura attraverso la cache
+# ---------------------------------------------------------------------------
+
+def _make_key(env, function_name, params):
+    return (
+        function_name,
+        json.dumps(params, sort_keys=True, default=str),
+        env.uid,
+        tuple(env.companies.ids),
+        env.context.get('lang'),
+    )
+
+
+def cached_call(env, function, params, compute):
+    """
+    Risultato di `compute()` per `function` (`AiFunction`) con `params`,
+    dalla cache se valido. Gli errori non vengono memorizzati; chi chiama
+    riceve sempre una copia, libera da modificare.
+    """
+    if not function.cache or has_pending_writes(env):
+        return compute()
+    generation = _current_generation(env.cr)
+    if generation is None:
+        return compute()
+
+    cache = get_function_cache(env.cr.dbname)
+    key = _make_key(env, function.name, params)
+    value = cache.get(key, generation)
+    if value is not _MISS:
+        _logger.info(f"🧊 Risultato in cache: {function.name}")
+        return copy.deepcopy(value)
+
+    result = compute()
+    if not (isinstance(result, dict) and result.get('error')):
+        cache.put(key, copy.deepcopy(result), function.cache, generation)
+    return result
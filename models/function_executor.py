@@ -0,0 +1,133 @@
+"""
+Esecuzione delle chiamate funzione di un turno.
+
+Le funzioni di sola lettura consecutive vengono eseguite in parallelo su
+un pool di thread del worker, ognuna con il proprio cursore ed
+environment; quelle che scrivono restano in sequenza, nell'ordine
+richiesto dal modello. I risultati tornano sempre nell'ordine delle
+chiamate.
+
+Un cursore separato non vede le scritture non committate della
+transazione del turno, quindi le letture vanno in parallelo solo se la
+transazione non ha ancora scritto sui modelli letti dalle funzioni
+(`function_cache.has_pending_writes`: ordini, consegne, quant, prodotti),
+né prima del turno (es. un'azione confermata) né con una funzione
+precedente dello stesso turno; altrimenti restano in sequenza sulla
+transazione del turno. Scritture su altri modelli (messaggi, storico
+della conversazione) non sono visibili ai thread ma non cambiano i
+risultati delle funzioni di lettura.
+
+I thread del pool riaprono lo scope del turno (`turn_analyzer`): il
+verdetto viene calcolato una volta nel thread del turno prima di
+distribuire le chiamate, così gli helper (es. normalizzazione dei
+termini di ricerca) non rifanno una chiamata LLM per thread.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo import api
+
+from .function_cache import has_pending_writes
+from .turn_analyzer import adopted_scope, current_scope, get_turn_verdict
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers=DEFAULT_MAX_WORKERS):
+    """Pool di thread del worker corrente (ricreato se cambia la dimensione)."""
+    global _executor, _executor_workers
+    if _executor is not None and _executor_workers == max_workers:
+        return _executor
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai_livebot_fn')
+            _executor_workers = max_workers
+        return _executor
+
+
+def _run_in_own_cursor(registry, uid, context, su, scope, function_name, parameters):
+    """Esegue una funzione di sola lettura con cursore ed environment propri, nello scope del turno."""
+    with registry.cursor() as cr, adopted_scope(scope):
+        threading.current_thread().dbname = cr.dbname
+        env = api.Environment(cr, uid, context, su=su)
+        try:
+            return env['discuss.channel']._execute_function(function_name, parameters)
+        finally:
+            cr.rollback()
+
+
+def execute_calls(channel, function_calls, read_only, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Esegue `function_calls` ([(nome, parametri)]) per il canale.
+
+    Args:
+        channel: record `discuss.channel` (environment della transazione del turno)
+        read_only: insieme dei nomi di funzione di sola lettura
+        max_workers: thread del pool (<= 1 = tutto in sequenza)
+
+    Returns:
+        list: [(nome, parametri, risultato)] nello stesso ordine delle chiamate
+    """
+    env = channel.env
+    parallel = max_workers > 1 and not env.registry.in_test_mode()
+    results = [None] * len(function_calls)
+    wrote = False
+    i = 0
+    while i < len(function_calls):
+        # Gruppo di letture consecutive
+        j = i
+        while j < len(function_calls) and function_calls[j][0] in read_only:
+            j += 1
+
+        # Dopo una scrittura (di una funzione o già nella transazione) i thread vedrebbero dati vecchi
+        if parallel and not wrote and j - i > 1 and not has_pending_writes(env):
+            started = time.time()
+            executor = get_executor(max_workers)
+            scope = current_scope()
+            if scope is not None:
+                # Verdetto calcolato qui, sul cursore del turno: i thread lo leggono soltanto
+                get_turn_verdict()
+            futures = {}
+            for k in range(i, j):
+                function_name, parameters = function_calls[k]
+                # Risultati già calcolati nel turno (es. durante lo streaming): nessun thread
+                cached = channel._prefetched_result(function_name, parameters)
+                if cached is not None:
+                    results[k] = cached
+                    continue
+                _logger.info(f"Eseguo funzione (parallelo): {function_name} con parametri: {parameters}")
+                futures[k] = executor.submit(
+                    _run_in_own_cursor, env.registry, env.uid, dict(env.context), env.su, scope,
+                    function_name, parameters,
+                )
+            for k, future in futures.items():
+                try:
+                    results[k] = future.result()
+                except Exception as e:
+                    _logger.error(f"Errore esecuzione funzione {function_calls[k][0]}: {e}")
+                    results[k] = {"error": str(e)}
+            _logger.info(f"⚡ {j - i} funzioni di lettura eseguite in parallelo in {(time.time() - started) * 1000:.0f}ms")
+            i = j
+            continue
+
+        # In sequenza sulla transazione del turno
+        end = max(j, i + 1)
+        for k in range(i, end):
+            function_name, parameters = function_calls[k]
+            _logger.info(f"Eseguo funzione: {function_name} con parametri: {parameters}")
+            results[k] = channel._execute_function(function_name, parameters)
+            if function_name not in read_only:
+                wrote = True
+        i = end
+
+    return [(name, params, result) for (name, params), result in zip(function_calls, results)]
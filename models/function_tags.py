@@ -0,0 +1,317 @@
+"""
+Parser a passata singola dei tag funzione `[FUNCTION:nome|k:v|...]`.
+
+Sostituisce la scansione di `_parse_ai_function_calls`, che ricostruiva la
+risposta con uno slicing dopo ogni tag, ripartiva dalla posizione del tag
+e accumulava i parametri un carattere alla volta.
+
+- un solo scorrimento del testo: i delimitatori vengono cercati con regex
+  ancorate alla posizione corrente, mai dall'inizio
+- i valori che iniziano con '[' o '{' vengono decodificati come JSON sul
+  posto (`raw_decode`), che restituisce anche la posizione di fine: le
+  parentesi dentro le stringhe JSON non confondono più il conteggio
+- il testo pulito viene costruito una volta sola con un join dei pezzi
+  fuori dai tag
+
+Un tag non chiuso non è un tag: resta nel testo e la ricerca riprende
+subito dopo il suo inizio.
+
+Se un valore JSON malformato o parentesi sbilanciate impediscono di
+chiudere il tag, il tag viene riletto con le regole del parser precedente
+(`_parse_tag_legacy`: chiusura sulla ']' corrispondente contando solo le
+quadre, valori testuali): gli stessi input danno le stesse chiamate.
+"""
+import json
+import re
+from collections import namedtuple
+
+FunctionTag = namedtuple('FunctionTag', ['name', 'params', 'start', 'end'])
+
+_TAG_START_RE = re.compile(r"\[(?:FUNCTION|Function|function):")
+_TAG_PREFIX_LEN = len('[FUNCTION:')
+# Fine del nome funzione
+_NAME_END_RE = re.compile(r"[|\]]")
+# Chiave di un parametro (fino a ':'); '|' o ']' prima di ':' = parte senza chiave
+_KEY_RE = re.compile(r"[^|:\]]*")
+# Delimitatori rilevanti in un valore non JSON
+_PLAIN_DELIM_RE = re.compile(r"[\[\]{}|]")
+_SPACES_RE = re.compile(r"\s*")
+# Quadre per la chiusura del tag con le regole legacy
+_BRACKET_RE = re.compile(r"[\[\]]")
+
+_decoder = json.JSONDecoder()
+
+
+def _scan_plain(text, pos):
+    """
+    Fine di un valore non JSON: primo '|' o ']' fuori da parentesi annidate.
+
+    Returns:
+        int | None: posizione del delimitatore, None se il testo finisce prima
+    """
+    depth = 0
+    length = len(text)
+    while pos < length:
+        match = _PLAIN_DELIM_RE.search(text, pos)
+        if match is None:
+            return None
+        char = match.group()
+        pos = match.end()
+        if char in '[{':
+            depth += 1
+        elif char == '}':
+            depth = max(depth - 1, 0)
+        elif char == ']':
+            if depth == 0:
+                return match.start()
+            depth -= 1
+        elif depth == 0:  # '|'
+            return match.start()
+    return None
+
+
+def _parse_value(text, pos, partial=False):
+    """
+    Valore di un parametro a partire da `pos`.
+
+    Args:
+        partial: testo ancora in arrivo (streaming): un valore JSON non
+            decodificabile potrebbe essere solo incompleto, quindi si attende
+
+    Returns:
+        tuple: (valore, posizione del delimitatore '|' o ']') oppure (None, None)
+    """
+    pos = _SPACES_RE.match(text, pos).end()
+    if text[pos:pos + 1] in ('[', '{'):
+        try:
+            value, end = _decoder.raw_decode(text, pos)
+        except ValueError:
+            pass
+        else:
+            end = _SPACES_RE.match(text, end).end()
+            if text[end:end + 1] in ('|', ']'):
+                return value, end
+        if partial:
+            return None, None
+        # JSON non valido (es. liste in stile Python): valore testuale come nei tag legacy
+
+    end = _scan_plain(text, pos)
+    if end is None:
+        return None, None
+    return text[pos:end].strip(), end
+
+
+def _parse_tag(text, start, partial=False):
+    """
+    Tag che inizia a `start` ('[FUNCTION:').
+
+    Returns:
+        FunctionTag | None: None se il tag non è chiuso
+    """
+    match = _NAME_END_RE.search(text, start + _TAG_PREFIX_LEN)
+    if match is None:
+        return None
+    name = text[start + _TAG_PREFIX_LEN:match.start()].strip()
+    if len(name) >= 2 and name[0] == name[-1] and name[0] in ('"', "'"):
+        name = name[1:-1].strip()
+
+    params = {}
+    pos = match.start()
+    length = len(text)
+    while pos < length:
+        if text[pos] == ']':
+            return FunctionTag(name, params, start, pos + 1)
+        # text[pos] == '|': nuovo parametro
+        key_match = _KEY_RE.match(text, pos + 1)
+        pos = key_match.end()
+        if pos >= length:
+            return None
+        if text[pos] != ':':
+            # Parte senza chiave ("|foo|" o "|foo]"): ignorata
+            continue
+        key = key_match.group().strip()
+        value, pos = _parse_value(text, pos + 1, partial)
+        if pos is None:
+            # In streaming il valore può essere solo incompleto; a testo completo regole legacy
+            return None if partial else _parse_tag_legacy(text, start)
+        if key:
+            params[key] = value
+    return None
+
+
+def _split_legacy_params(params_str):
+    """Parti 'chiave:valore' separate da '|' fuori da quadre e graffe (anche sbilanciate)."""
+    parts = []
+    previous = 0
+    brackets = braces = 0
+    for match in _PLAIN_DELIM_RE.finditer(params_str):
+        char = match.group()
+        if char == '[':
+            brackets += 1
+        elif char == ']':
+            brackets -= 1
+        elif char == '{':
+            braces += 1
+        elif char == '}':
+            braces -= 1
+        elif brackets == 0 and braces == 0:  # '|'
+            parts.append(params_str[previous:match.start()])
+            previous = match.end()
+    if previous < len(params_str):
+        parts.append(params_str[previous:])
+    return parts
+
+
+def _parse_tag_legacy(text, start):
+    """
+    Tag letto con le regole del parser precedente, per i valori che il
+    parser JSON non chiude: fine sulla ']' che bilancia le quadre aperte,
+    valori JSON non validi restituiti come stringa.
+
+    Returns:
+        FunctionTag | None: None se le quadre non si chiudono
+    """
+    match = _NAME_END_RE.search(text, start + _TAG_PREFIX_LEN)
+    if match is None:
+        return None
+    name = text[start + _TAG_PREFIX_LEN:match.start()].strip()
+    if len(name) >= 2 and name[0] == name[-1] and name[0] in ('"', "'"):
+        name = name[1:-1].strip()
+
+    depth = 1
+    tag_end = None
+    for bracket in _BRACKET_RE.finditer(text, match.start() + 1):
+        depth += 1 if bracket.group() == '[' else -1
+        if depth == 0:
+            tag_end = bracket.start()
+            break
+    if tag_end is None:
+        return None
+
+    params_str = text[match.start():tag_end].strip()
+    if params_str.startswith('|'):
+        params_str = params_str[1:]
+    params = {}
+    for part in _split_legacy_params(params_str):
+        if ':' not in part:
+            continue
+        key, value = part.split(':', 1)
+        key, value = key.strip(), value.strip()
+        if value.startswith(('[', '{')):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return FunctionTag(name, params, start, tag_end + 1)
+
+
+def iter_function_tags(text):
+    """Tag funzione completi di `text`, nell'ordine in cui compaiono."""
+    text = text or ''
+    pos = 0
+    while True:
+        match = _TAG_START_RE.search(text, pos)
+        if match is None:
+            return
+        tag = _parse_tag(text, match.start())
+        if tag is None:
+            pos = match.start() + 1
+            continue
+        yield tag
+        pos = tag.end
+
+
+def parse_function_tags(text):
+    """
+    Returns:
+        tuple: ([(nome, parametri)], testo senza tag)
+    """
+    text = text or ''
+    calls = []
+    pieces = []
+    previous = 0
+    for tag in iter_function_tags(text):
+        calls.append((tag.name, tag.params))
+        pieces.append(text[previous:tag.start])
+        previous = tag.end
+    pieces.append(text[previous:])
+    return calls, ''.join(pieces).strip()
+
+
+def strip_function_tags(text):
+    """Testo senza tag funzione."""
+    return parse_function_tags(text)[1]
+
+
+class IncrementalTagDetector:
+    """
+    Rilevatore dei tag su una risposta in streaming.
+
+    `feed` riceve i chunk man mano che arrivano e restituisce il testo
+    sicuramente fuori dai tag (pubblicabile subito) e i tag appena
+    completati (eseguibili subito). Il testo che potrebbe essere l'inizio
+    di un tag resta in attesa fino al chunk che lo chiude o lo esclude.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._emitted = 0   # testo già restituito fino a questa posizione
+        self._scan = 0      # ricerca del prossimo tag da questa posizione
+        self._open_tag = False
+
+    def feed(self, chunk):
+        """
+        Returns:
+            tuple: (testo pubblicabile, [FunctionTag completati])
+        """
+        if not chunk:
+            return '', []
+        self.text += chunk
+        if self._open_tag and ']' not in chunk:
+            # Un tag aperto può chiudersi solo con un ']': niente da riesaminare
+            return '', []
+        return self._advance(final=False)
+
+    def finish(self):
+        """
+        Fine dello stream: i tag in attesa vengono analizzati come testo
+        completo, quelli non chiusi tornano testo normale.
+
+        Returns:
+            tuple: (testo pubblicabile, [FunctionTag completati])
+        """
+        return self._advance(final=True)
+
+    def _advance(self, final):
+        text = self.text
+        pieces = []
+        tags = []
+        self._open_tag = False
+        while True:
+            match = _TAG_START_RE.search(text, self._scan)
+            if match is None:
+                break
+            tag = _parse_tag(text, match.start(), partial=not final)
+            if tag is None:
+                if not final:
+                    # Tag ancora aperto: attendo altri chunk
+                    pieces.append(text[self._emitted:match.start()])
+                    self._emitted = self._scan = match.start()
+                    self._open_tag = True
+                    return ''.join(pieces), tags
+                self._scan = match.start() + 1
+                continue
+            pieces.append(text[self._emitted:tag.start])
+            tags.append(tag)
+            self._emitted = self._scan = tag.end
+
+        end = len(text)
+        if not final:
+            # Un '[' nelle ultime posizioni può essere l'inizio di '[FUNCTION:'
+            hold = text.rfind('[', max(self._emitted, end - _TAG_PREFIX_LEN + 1))
+            if hold != -1 and 'FUNCTION:'.startswith(text[hold + 1:].upper()):
+                end = hold
+        pieces.append(text[self._emitted:end])
+        self._emitted = self._scan = end
+        return ''.join(pieces), tags
@@ -0,0 +1,500 @@
+"""
+Client HTTP condiviso per le chiamate ai provider LLM (Gemini, OpenRouter).
+
+Ogni worker Odoo mantiene UNA sola `requests.Session` con pool di connessioni
+keep-alive: le 3-5 chiamate LLM di un turno di chat riusano la stessa
+connessione TLS invece di rifare handshake TCP+TLS ad ogni richiesta.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+# Dimensione di default del pool (connessioni keep-alive per host)
+DEFAULT_POOL_SIZE = 10
+
+
+class LLMHttpClient:
+    """Sessione HTTP pooled condivisa da tutti i provider LLM del worker."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+
+    def request(self, method, url, **kwargs):
+        """Richiesta sulla sessione condivisa (stessa firma di `requests.request`)."""
+        with self._lock:
+            self._requests += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def stats(self):
+        """
+        Statistiche del pool per verificare il riuso delle connessioni.
+
+        Per ogni host: richieste servite e connessioni aperte; la differenza
+        sono le richieste che hanno riusato una connessione keep-alive.
+        """
+        hosts = []
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened = getattr(pool, 'num_connections', 0)
+            served = getattr(pool, 'num_requests', 0)
+            hosts.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "requests": served,
+                "connections_opened": opened,
+                "connections_reused": max(served - opened, 0),
+            })
+
+        with self._lock:
+            total_requests = self._requests
+            total_errors = self._errors
+
+        opened_total = sum(h["connections_opened"] for h in hosts)
+        return {
+            "pid": self.pid,
+            "pool_size": self.pool_size,
+            "requests": total_requests,
+            "errors": total_errors,
+            "connections_opened": opened_total,
+            "reuse_ratio": round(1 - opened_total / total_requests, 3) if total_requests else 0.0,
+            "hosts": hosts,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client(pool_size=None):
+    """
+    Restituisce il client HTTP del worker corrente, creandolo al primo uso.
+
+    Il client viene ricreato se cambia la dimensione del pool configurata
+    o se il processo è stato forkato (ogni worker prefork ha il suo pool).
+    """
+    global _client
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    client = _client
+    if client is not None and client.pid == os.getpid() and client.pool_size == pool_size:
+        return client
+
+    with _client_lock:
+        client = _client
+        if client is None or client.pid != os.getpid() or client.pool_size != pool_size:
+            if client is not None and client.pid == os.getpid():
+                client.close()
+            _logger.info(f"🔌 Creo pool HTTP LLM (pid={os.getpid()}, pool_size={pool_size})")
+            client = _client = LLMHttpClient(pool_size=pool_size)
+    return client
+
+
+def get_pool_stats():
+    """Statistiche del pool del worker corrente (vuote se nessuna chiamata fatta)."""
+    client = _client
+    if client is None or client.pid != os.getpid():
+        stats = {"pid": os.getpid(), "requests": 0, "hosts": []}
+    else:
+        stats = client.stats()
+    stats["gemini_context_cache"] = _gemini_cache.stats()
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Task profile per le chiamate LLM di servizio
+# ---------------------------------------------------------------------------
+
+# Profilo di una chiamata "di servizio" (classificatori, normalizzatori):
+# system prompt minimale al posto di `config.system_prompt`, pochi token
+# in uscita e temperatura bassa per risposte deterministiche.
+LLMTaskProfile = namedtuple('LLMTaskProfile', ['system_prompt', 'max_tokens', 'temperature'])
+
+LLM_TASK_PROFILES = {
+    'normalize_search_term': LLMTaskProfile(
+        system_prompt="Normalizzi termini di ricerca prodotti in italiano. Rispondi solo con il termine normalizzato.",
+        max_tokens=32,
+        temperature=0.0,
+    ),
+    'classify_order_intent': LLMTaskProfile(
+        system_prompt="Classifichi messaggi di un assistente vendite. Rispondi con una sola parola.",
+        max_tokens=8,
+        temperature=0.0,
+    ),
+    'wants_full_catalog': LLMTaskProfile(
+        system_prompt="Sei un classificatore YES/NO. Rispondi solo YES o NO.",
+        max_tokens=4,
+        temperature=0.0,
+    ),
+    'gate_cancellation': LLMTaskProfile(
+        system_prompt="Sei un classificatore YES/NO per un flusso di conferma. Rispondi solo YES o NO.",
+        max_tokens=4,
+        temperature=0.0,
+    ),
+    'analyze_turn': LLMTaskProfile(
+        system_prompt="Analizzi messaggi di un assistente vendite e magazzino. Rispondi solo con un oggetto JSON su una riga.",
+        max_tokens=256,
+        temperature=0.0,
+    ),
+    'resolve_when': LLMTaskProfile(
+        system_prompt="Normalizzi espressioni temporali italiane. Rispondi solo con una riga JSON.",
+        max_tokens=64,
+        temperature=0.0,
+    ),
+    'summarize_history': LLMTaskProfile(
+        system_prompt="Riassumi conversazioni di un assistente vendite e magazzino. Rispondi solo con il riassunto, in italiano.",
+        max_tokens=400,
+        temperature=0.0,
+    ),
+}
+
+
+def get_task_profile(task):
+    """
+    Risolve il profilo di una chiamata di servizio.
+
+    Accetta il nome di un profilo registrato in `LLM_TASK_PROFILES` o
+    direttamente un `LLMTaskProfile`; None = chiamata conversazionale
+    con il system prompt completo della configurazione.
+    """
+    if task is None or isinstance(task, LLMTaskProfile):
+        return task
+    profile = LLM_TASK_PROFILES.get(task)
+    if profile is None:
+        raise KeyError(f"Task profile LLM sconosciuto: {task}")
+    return profile
+
+
+# ---------------------------------------------------------------------------
+# Gemini context caching
+# ---------------------------------------------------------------------------
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+
+# TTL di default dei cachedContents (secondi)
+DEFAULT_CACHE_TTL = 3600
+# Rinnova il TTL quando mancano meno di N secondi alla scadenza
+CACHE_REFRESH_MARGIN = 300
+# Dopo un errore di creazione non ritentare per N secondi (resta in modalità inline)
+CACHE_FAILURE_COOLDOWN = 600
+
+
+class GeminiContextCache:
+    """
+    Handle `cachedContents` di Gemini per il system prompt, per worker.
+
+    Chiave: (modello, hash del prompt, hash della API key). Il system prompt
+    da ~70KB viene caricato una volta sola lato server e le chiamate
+    successive lo referenziano con `cachedContent` invece di reinviarlo.
+    Qualsiasi errore fa ricadere il chiamante in modalità inline.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._failures = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, system_prompt, api_key, extra=None):
+        prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        key_hash = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+        extra_hash = hashlib.sha256(json.dumps(extra, sort_keys=True).encode('utf-8')).hexdigest()[:16] if extra else ''
+        return (model, prompt_hash, key_hash, extra_hash)
+
+    def get_handle(self, client, base_url, api_key, model, system_prompt, ttl=DEFAULT_CACHE_TTL,
+                   extra_fields=None, timeout=30):
+        """
+        Restituisce il nome del cachedContent (es. 'cachedContents/abc') oppure None.
+
+        Args:
+            extra_fields: campi aggiuntivi da includere nel contenuto cachato
+                (es. `tools`), che Gemini non accetta inline insieme a `cachedContent`
+        """
+        key = self.make_key(model, system_prompt, api_key, extra_fields)
+        now = time.time()
+
+        with self._lock:
+            failed_at = self._failures.get(key)
+            if failed_at and now - failed_at < CACHE_FAILURE_COOLDOWN:
+                return None
+            entry = self._entries.get(key)
+
+        if entry and entry['expire_at'] - now > CACHE_REFRESH_MARGIN:
+            with self._lock:
+                self.hits += 1
+            return entry['name']
+
+        if entry and entry['expire_at'] > now:
+            # In scadenza: prova ad estendere il TTL dello stesso handle
+            if self._refresh(client, base_url, api_key, entry, ttl, timeout):
+                with self._lock:
+                    self.hits += 1
+                return entry['name']
+
+        with self._lock:
+            self.misses += 1
+        return self._create(client, base_url, api_key, key, model, system_prompt, ttl, extra_fields, timeout)
+
+    def invalidate(self, name):
+        """Scarta un handle rifiutato dal server (scaduto o eliminato)."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry['name'] == name:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failed_keys": len(self._failures),
+            }
+
+    def _create(self, client, base_url, api_key, key, model, system_prompt, ttl, extra_fields, timeout):
+        payload = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": system_prompt}]},
+            "ttl": f"{int(ttl)}s",
+            "displayName": f"ai_livebot-{key[1][:12]}",
+        }
+        if extra_fields:
+            payload.update(extra_fields)
+
+        try:
+            response = client.post(
+                f"{base_url}/cachedContents",
+                params={"key": api_key},
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=timeout,
+            )
+            response.raise_for_status()
+            name = response.json().get('name')
+            if not name:
+                raise ValueError("risposta cachedContents senza 'name'")
+        except Exception as e:
+            _logger.warning(f"⚠️ Context cache Gemini non disponibile per {model}: {e} - uso system_instruction inline")
+            with self._lock:
+                self._failures[key] = time.time()
+            return None
+
+        _logger.info(f"🗄️ Creato context cache Gemini {name} ({model}, ttl={ttl}s, {len(system_prompt)} caratteri)")
+        with self._lock:
+            self._entries[key] = {'name': name, 'expire_at': time.time() + ttl}
+            self._failures.pop(key, None)
+        return name
+
+    def _refresh(self, client, base_url, api_key, entry, ttl, timeout):
+        try:
+            response = client.patch(
+                f"{base_url}/{entry['name']}",
+                params={"key": api_key, "updateMask": "ttl"},
+                headers={"Content-Type": "application/json"},
+                json={"ttl": f"{int(ttl)}s"},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            _logger.info(f"Rinnovo TTL context cache {entry['name']} fallito ({e}) - ne creo uno nuovo")
+            self.invalidate(entry['name'])
+            return False
+
+        with self._lock:
+            entry['expire_at'] = time.time() + ttl
+        _logger.debug(f"TTL context cache {entry['name']} rinnovato ({ttl}s)")
+        return True
+
+
+_gemini_cache = GeminiContextCache()
+
+
+def get_gemini_context_cache():
+    """Registro dei context cache Gemini del worker corrente."""
+    return _gemini_cache
+
+
+# ---------------------------------------------------------------------------
+# Function calling nativo (tools)
+# ---------------------------------------------------------------------------
+
+# Aggiunto al system prompt in modalità nativa: il prompt descrive i tag
+# [FUNCTION:...], che restano solo come fallback
+NATIVE_TOOLS_INSTRUCTION = (
+    "\n\nMODALITÀ FUNZIONI: chiama le funzioni tramite function calling nativo "
+    "(tool call strutturate) invece di scrivere tag [FUNCTION:...] nel testo. "
+    "Parametri lista/oggetto: passali come stringa JSON."
+)
+
+
+class LLMReply(str):
+    """
+    Risposta testuale del modello con le eventuali tool call native.
+
+    Il valore stringa è il testo del modello seguito dalle tool call
+    rese come tag [FUNCTION:...], così storico, log e pulizie esistenti
+    continuano a funzionare; `text` è il solo testo e `function_calls`
+    la lista strutturata `[(nome, parametri)]`.
+    """
+
+    def __new__(cls, text='', function_calls=None):
+        function_calls = list(function_calls or [])
+        rendered = ' '.join(render_function_tag(name, params) for name, params in function_calls)
+        value = '\n'.join(part for part in ((text or '').strip(), rendered) if part)
+        reply = super().__new__(cls, value)
+        reply.text = (text or '').strip()
+        reply.function_calls = function_calls
+        return reply
+
+
+def render_function_tag(name, params):
+    """Tag [FUNCTION:nome|k:v|...] equivalente a una tool call (valori non stringa in JSON)."""
+    parts = [f"FUNCTION:{name}"]
+    for key, value in (params or {}).items():
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False)
+        parts.append(f"{key}:{value}")
+    return '[' + '|'.join(parts) + ']'
+
+
+def tool_parameters_schema(parameters):
+    """
+    Schema JSON dei parametri di una funzione di `_get_available_functions()`
+    senza schema tipizzato: tutti stringhe opzionali, gli stessi valori che
+    arrivano dai tag, convertiti da `coerce_tool_args` come fa il parser dei tag.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            name: {"type": "string", "description": str(description)}
+            for name, description in (parameters or {}).items()
+        },
+    }
+
+
+def gemini_tools(functions):
+    """Blocco `tools` di Gemini (functionDeclarations) dalle funzioni disponibili."""
+    declarations = []
+    for name, spec in functions.items():
+        declaration = {"name": name, "description": spec.get('description', '')}
+        if spec.get('parameters'):
+            declaration["parameters"] = spec.get('schema') or tool_parameters_schema(spec['parameters'])
+        declarations.append(declaration)
+    return [{"functionDeclarations": declarations}]
+
+
+def openai_tools(functions):
+    """Lista `tools` in formato OpenAI (OpenRouter) dalle funzioni disponibili."""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": spec.get('description', ''),
+                "parameters": spec.get('schema') or tool_parameters_schema(spec.get('parameters')),
+            },
+        }
+        for name, spec in functions.items()
+    ]
+
+
+def coerce_tool_args(args):
+    """
+    Argomenti di una tool call → parametri per `_execute_function`.
+
+    Accetta dict o stringa JSON (OpenAI); i valori stringa che iniziano con
+    '[' o '{' vengono decodificati come JSON, come nel parser dei tag.
+    """
+    if isinstance(args, str):
+        try:
+            args = json.loads(args) if args.strip() else {}
+        except ValueError:
+            _logger.warning(f"Argomenti tool call non JSON: {args[:200]}")
+            return {}
+    if not isinstance(args, dict):
+        return {}
+
+    params = {}
+    for key, value in args.items():
+        if isinstance(value, str) and value.strip()[:1] in ('[', '{'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                _logger.warning(f"Impossibile parsare JSON per {key}: {value[:200]}")
+        params[key] = value
+    return params
+
+
+# ---------------------------------------------------------------------------
+# Streaming (Server-Sent Events)
+# ---------------------------------------------------------------------------
+
+def iter_sse_json(response):
+    """
+    Eventi JSON di una risposta SSE in streaming (`data: {...}`).
+
+    Usato per Gemini `streamGenerateContent?alt=sse` e per OpenRouter
+    `stream: true`; si ferma a `data: [DONE]`, ignora commenti e keep-alive.
+    """
+    data_lines = []
+    for raw in response.iter_lines(decode_unicode=False):
+        line = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+        if line:
+            if line.startswith('data:'):
+                data_lines.append(line[5:].lstrip())
+            continue
+        # Riga vuota = fine evento
+        if not data_lines:
+            continue
+        data = '\n'.join(data_lines)
+        data_lines = []
+        if data == '[DONE]':
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            _logger.warning(f"Evento SSE non JSON ignorato: {data[:200]}")
+
+    if data_lines and data_lines != ['[DONE]']:
+        try:
+            yield json.loads('\n'.join(data_lines))
+        except ValueError:
+            pass
@@ -4,9 +4,20 @@ import logging
 import time
 import re
 import json
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
+import pytz
+
+from .ai_conversation import estimate_tokens
+from .ai_functions import get_function_registry
+from .chat_stream import ChatStream, current_stream, streaming
+from .function_executor import execute_calls
+from .function_tags import strip_function_tags
+from .turn_analyzer import get_turn_verdict, turn_scoped
+
 _logger = logging.getLogger(__name__)
 
 # Rate limiting globale per evitare troppe chiamate
@@ -87,6 +98,218 @@ def _parse_iso_duration(dur):
     return relativedelta(years=y, months=mo, weeks=w, days=d, hours=h, minutes=mi, seconds=s)
 
 
+# ---------------------------------------------------------------------------
+# Risolutore locale delle espressioni temporali italiane ("domani", "fra 3 giorni",
+# "lunedì prossimo", "il 30", "15 marzo", "30/11"): evita la chiamata LLM per
+# la data di consegna nella grande maggioranza dei casi.
+# ---------------------------------------------------------------------------
+
+_WEEKDAYS_IT = {
+    'lunedi': 0, 'martedi': 1, 'mercoledi': 2, 'giovedi': 3,
+    'venerdi': 4, 'sabato': 5, 'domenica': 6,
+}
+
+_MONTHS_IT = {
+    'gennaio': 1, 'febbraio': 2, 'marzo': 3, 'aprile': 4, 'maggio': 5, 'giugno': 6,
+    'luglio': 7, 'agosto': 8, 'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12,
+}
+
+_NUMBERS_IT = {
+    'un': 1, 'uno': 1, 'una': 1, 'due': 2, 'tre': 3, 'quattro': 4, 'cinque': 5,
+    'sei': 6, 'sette': 7, 'otto': 8, 'nove': 9, 'dieci': 10, 'undici': 11,
+    'dodici': 12, 'quindici': 15, 'venti': 20, 'trenta': 30,
+}
+
+# Unità → designatore ISO 8601 per _parse_iso_duration
+_UNITS_IT = {
+    'giorno': 'D', 'giorni': 'D',
+    'settimana': 'W', 'settimane': 'W',
+    'mese': 'M', 'mesi': 'M',
+    'anno': 'Y', 'anni': 'Y',
+    'ora': 'H', 'ore': 'H',
+}
+
+_NUM = r'(\d{1,3}|' + '|'.join(sorted(_NUMBERS_IT, key=len, reverse=True)) + r')'
+_WEEKDAY = '(' + '|'.join(_WEEKDAYS_IT) + ')'
+_MONTH = '(' + '|'.join(_MONTHS_IT) + ')'
+
+_RE_ISO_DATE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+# gg/mm/aaaa oppure gg-mm-aaaa / gg.mm.aaaa
+_RE_NUMERIC_DATE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{2,4})\b|\b(\d{1,2})[.-](\d{1,2})[.-](\d{4})\b')
+_RE_MONTH_DATE = re.compile(r'\b(\d{1,2})\s+' + _MONTH + r'(?:\s+(\d{4}))?\b')
+_RE_RELATIVE = re.compile(
+    r'\b(?:tra|fra|entro|in|dopo)\s+' + _NUM + r'\s+(' + '|'.join(_UNITS_IT) + r')\b'
+)
+_RE_RELATIVE_ONE = re.compile(r"\b(?:tra|fra|entro|in|dopo)\s+(?:un'|un\s+|una\s+)?(settimana|mese|anno)\b")
+_RE_NEXT_PERIOD = re.compile(r'\b(?:(settimana|mese|anno)\s+prossim[oa]|prossim[oa]\s+(settimana|mese|anno))\b')
+_RE_WEEKDAY = re.compile(r'\b' + _WEEKDAY + r'\b')
+# "questo venerdì": può essere anche oggi
+_RE_THIS_WEEKDAY = re.compile(r'\bquest[oa]\s+' + _WEEKDAY + r'\b')
+# gg/mm senza anno solo dopo un contesto di data ("aggiungi 1/2 bancale" non è una data)
+_RE_DAY_MONTH = re.compile(
+    r'\b(?:il|entro|per|dal|al|del|giorno|data|consegna|' + _WEEKDAY[1:-1] + r')\s+(\d{1,2})/(\d{1,2})\b(?!/)'
+)
+_RE_DAY_OF_MONTH = re.compile(r'\b(?:il|entro il|per il|giorno)\s+(\d{1,2})\b(?!\s*(?:[.,]\d|%|€|pz|pezz|unit|x\b))')
+_RE_END_OF_MONTH = re.compile(r'\bfine\s+(?:del\s+)?mese\b')
+
+# Indizi temporali: se presenti ma non risolti localmente, si ricorre all'LLM
+_TEMPORAL_CUE_RE = re.compile(
+    r'\b(?:oggi|domani|dopodomani|settiman\w*|mes[ei]|ann[oi]|giorn[oi]|or[ae]|prossim\w*|scors\w*|'
+    r'consegn\w*|data|entro|natale|pasqua|ferragosto|'
+    + _WEEKDAY[1:-1] + '|' + _MONTH[1:-1] + r')\b'
+)
+
+_WHEN_CACHE_SIZE = 512
+_when_cache = OrderedDict()
+_when_cache_lock = threading.Lock()
+
+
+def _strip_accents_it(text):
+    """Minuscolo e senza accenti (lunedì → lunedi) per il matching delle regole."""
+    text = (text or '').lower().replace("’", "'")
+    return text.translate(str.maketrans('àáèéìíòóùú', 'aaeeiioouu'))
+
+
+def _safe_date(base, year, month, day):
+    try:
+        return base.replace(year=year, month=month, day=day)
+    except ValueError:
+        return None
+
+
+def _resolve_explicit_date(t, base):
+    """
+    Data esplicita nel testo normalizzato `t` (ISO, "15 marzo", "30/11").
+
+    Returns:
+        tuple: (trovata, datetime o None se giorno/mese inesistente, es. "31 novembre")
+    """
+    m = _RE_ISO_DATE.search(t)
+    if m:
+        return True, _safe_date(base, int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+    m = _RE_MONTH_DATE.search(t)
+    if m:
+        year = int(m.group(3)) if m.group(3) else base.year
+        dt = _safe_date(base, year, _MONTHS_IT[m.group(2)], int(m.group(1)))
+        if dt and not m.group(3) and dt.date() < base.date():
+            dt = _safe_date(base, year + 1, _MONTHS_IT[m.group(2)], int(m.group(1)))
+        return True, dt
+
+    m = _RE_NUMERIC_DATE.search(t) or _RE_DAY_MONTH.search(t)
+    if m:
+        groups = m.groups() + (None,) * (6 - len(m.groups()))
+        day, month, year = groups[0:3] if groups[0] else groups[3:6]
+        day, month = int(day), int(month)
+        explicit_year = bool(year)
+        year = int(year) if year else base.year
+        if year < 100:
+            year += 2000
+        # Mese fuori intervallo: non è una data (es. rapporti, codici)
+        if 1 <= month <= 12:
+            dt = _safe_date(base, year, month, day)
+            if dt and not explicit_year and dt.date() < base.date():
+                dt = _safe_date(base, year + 1, month, day)
+            return True, dt
+
+    return False, None
+
+
+def _resolve_italian_when(text, base):
+    """
+    Risolve localmente l'espressione temporale contenuta in `text`.
+
+    Args:
+        text: testo utente
+        base: datetime di riferimento (NOW nel fuso dell'utente)
+
+    Returns:
+        datetime alle BUSINESS_HOUR oppure None se il testo non contiene
+        un'espressione riconosciuta o indica una data inesistente.
+    """
+    t = _strip_accents_it(text)
+
+    explicit, dt = _resolve_explicit_date(t, base)
+    if explicit:
+        # "il 31 novembre" non deve ripiegare sulla regola "il 31" (→ 31 ottobre)
+        if dt is None:
+            return None
+        return _future_or_none(dt.replace(hour=BUSINESS_HOUR, minute=0, second=0, microsecond=0), base)
+
+    if dt is None:
+        if re.search(r'\bdopodomani\b', t):
+            dt = base + timedelta(days=2)
+        elif re.search(r'\bdomani\b', t):
+            dt = base + timedelta(days=1)
+        elif re.search(r'\boggi\b', t):
+            dt = base
+
+    if dt is None:
+        m = _RE_RELATIVE.search(t)
+        if m:
+            qty = int(m.group(1)) if m.group(1).isdigit() else _NUMBERS_IT[m.group(1)]
+            unit = _UNITS_IT[m.group(2)]
+            if unit == 'H':
+                # Ore: da adesso, senza orario aziendale
+                return (base + timedelta(hours=qty)).replace(second=0, microsecond=0)
+            dt = base + _parse_iso_duration(f"P{qty}{unit}")
+        else:
+            m = _RE_RELATIVE_ONE.search(t) or _RE_NEXT_PERIOD.search(t)
+            if m:
+                unit = _UNITS_IT[next(g for g in m.groups() if g)]
+                dt = base + _parse_iso_duration(f"P1{unit}")
+
+    if dt is None:
+        m = _RE_THIS_WEEKDAY.search(t)
+        if m:
+            # Occorrenza di questa settimana, oggi compreso
+            dt = base + timedelta(days=(_WEEKDAYS_IT[m.group(1)] - base.weekday()) % 7)
+        else:
+            m = _RE_WEEKDAY.search(t)
+            if m:
+                # Prossima occorrenza del giorno (mai oggi)
+                days_ahead = (_WEEKDAYS_IT[m.group(1)] - base.weekday()) % 7 or 7
+                dt = base + timedelta(days=days_ahead)
+
+    if dt is None and _RE_END_OF_MONTH.search(t):
+        dt = base + relativedelta(day=31)
+
+    if dt is None:
+        m = _RE_DAY_OF_MONTH.search(t)
+        if m and 1 <= int(m.group(1)) <= 31:
+            day = int(m.group(1))
+            # Giorno del mese corrente, altrimenti del primo mese successivo che lo contiene
+            for offset in range(0, 13):
+                candidate_month = base + relativedelta(months=offset, day=1)
+                dt = _safe_date(base, candidate_month.year, candidate_month.month, day)
+                if dt and dt.date() >= base.date():
+                    break
+                dt = None
+
+    if dt is None:
+        return None
+    return _future_or_none(dt.replace(hour=BUSINESS_HOUR, minute=0, second=0, microsecond=0), base)
+
+
+def _future_or_none(dt, base):
+    """
+    Data di consegna non nel passato: None per un giorno già trascorso, adesso
+    se è oggi ma l'orario aziendale è già passato.
+    """
+    if dt.date() < base.date():
+        return None
+    if dt < base:
+        return base.replace(second=0, microsecond=0)
+    return dt
+
+
+def _to_utc_naive(dt, tz_name):
+    """Datetime naive UTC (formato dei campi Datetime) da uno aware o naive nel fuso `tz_name`."""
+    if dt.tzinfo is None:
+        dt = pytz.timezone(tz_name).localize(dt)
+    return dt.astimezone(pytz.utc).replace(tzinfo=None)
+
+
 class MailBot(models.AbstractModel):
     _inherit = 'mail.bot'
 
@@ -155,48 +378,84 @@ class MailBot(models.AbstractModel):
         
         return "\n".join(summary_parts)
 
+    def _when_to_datetime(self, user_text):
+        """
+        Normalizza il 'quando' dal testo utente.
+
+        Usa il risolutore locale `_resolve_italian_when`; ricorre all'LLM
+        (`_llm_when_to_datetime`) solo se il testo contiene indizi temporali
+        che le regole non sanno risolvere. Il risultato è memorizzato per
+        (testo, giorno, fuso dell'utente); un fallimento dell'LLM non viene
+        memorizzato, così il turno successivo riprova.
+        Ritorna un datetime naive UTC (come i campi Datetime, mai nel passato)
+        oppure None.
+        """
+        from odoo import fields
+        base = fields.Datetime.context_timestamp(self, fields.Datetime.now())
+        tz = self._when_tz()
+        key = ((user_text or '').strip().lower(), base.date(), tz)
+
+        with _when_cache_lock:
+            if key in _when_cache:
+                _when_cache.move_to_end(key)
+                return _when_cache[key]
+
+        dt = _resolve_italian_when(user_text, base)
+        if dt is not None:
+            _logger.info(f"✅ [WHEN] Risolto localmente: {user_text[:50]} → {dt.strftime('%Y-%m-%d %H:%M:%S')}")
+        elif _resolve_explicit_date(_strip_accents_it(user_text), base)[0]:
+            _logger.warning(f"⚠️ [WHEN] Data inesistente o passata nel testo: {user_text[:50]}")
+        elif _TEMPORAL_CUE_RE.search(_strip_accents_it(user_text)):
+            dt = self._llm_when_to_datetime(user_text)
+            if dt is None:
+                return None
+        if dt is not None:
+            dt = _to_utc_naive(dt, tz)
+
+        with _when_cache_lock:
+            _when_cache[key] = dt
+            while len(_when_cache) > _WHEN_CACHE_SIZE:
+                _when_cache.popitem(last=False)
+        return dt
+
+    def _when_tz(self):
+        """Fuso dell'utente (come `fields.Datetime.context_timestamp`)"""
+        return self.env.context.get('tz') or self.env.user.tz or 'UTC'
+
     def _llm_when_to_datetime(self, user_text):
         """
         Chiede all'AI di normalizzare 'quando' dal testo utente.
-        Ritorna un datetime (timezone-aware Europe/Rome) oppure None.
+        Ritorna un datetime timezone-aware nel fuso dell'utente (mai nel passato) oppure None.
         """
         try:
-            ai_chatbot = self.env['discuss.channel']
-            config = self.env['ai.config'].get_active_config()
-
             # Base time nel fuso dell'utente
             from odoo import fields
             base = fields.Datetime.context_timestamp(self, fields.Datetime.now())
 
-            prompt = (
-                "Sei un normalizzatore di date/tempi IT.\n"
-                f"Oggi (NOW) è: {base.strftime('%Y-%m-%d %H:%M:%S')} Europe/Rome.\n"
-                "Dato questo testo utente, estrai SOLO il 'quando'. "
-                "Rispondi in una sola riga con un JSON come uno dei seguenti:\n"
-                '{ "absolute": "YYYY-MM-DD HH:MM:SS" }\n'
-                '{ "relative": "PnYnMnWnDTnHnMnS" }\n'
-                "{}\n"
-                "Scegli 'absolute' se il testo contiene una data concreta (anche se relativa ma facile da risolvere), "
-                "altrimenti 'relative' con durata ISO 8601 equivalente (es: 5 giorni => P5D; 1 settimana => P1W; 120 ore => PT120H). "
-                "Non scrivere altro fuori dal JSON."
-                "\n\nTESTO UTENTE:\n" + user_text
-            )
-
-            resp = ai_chatbot._get_gemini_response(config, [{'role': 'user', 'content': prompt}])
-            js = _balanced_json_extract(resp or "") or "{}"
-            data = json.loads(js)
+            verdict = get_turn_verdict(user_text)
+            if verdict:
+                data = verdict['when']
+            else:
+                data = self._llm_when_data(user_text, base)
 
             if isinstance(data, dict):
                 if data.get('absolute'):
-                    # Interpreta come Europe/Rome
+                    # Interpreta nel fuso dell'utente
                     dt = datetime.strptime(data['absolute'], "%Y-%m-%d %H:%M:%S")
+                    dt = pytz.timezone(self._when_tz()).localize(dt)
                 elif data.get('relative'):
                     dt = base + _parse_iso_duration(data['relative'])
+                    if 'T' in data['relative']:
+                        # Ore/minuti: da adesso, senza orario aziendale
+                        return dt.replace(second=0, microsecond=0)
                 else:
                     return None
 
                 # Normalizza a orario aziendale standard
-                dt = dt.replace(hour=BUSINESS_HOUR, minute=0, second=0, microsecond=0)
+                dt = _future_or_none(dt.replace(hour=BUSINESS_HOUR, minute=0, second=0, microsecond=0), base)
+                if dt is None:
+                    _logger.warning(f"⚠️ [WHEN] Data nel passato dall'AI per: {user_text[:50]}")
+                    return None
                 _logger.info(f"✅ [WHEN] Normalized: {user_text[:50]} → {dt.strftime('%Y-%m-%d %H:%M:%S')}")
                 return dt
 
@@ -204,11 +463,40 @@ class MailBot(models.AbstractModel):
             _logger.warning(f"LLM when normalize failed: {e}", exc_info=True)
         return None
 
+    def _llm_when_data(self, user_text, base):
+        """Chiamata LLM dedicata per il 'quando' (fuori dallo scope di un turno)."""
+        ai_chatbot = self.env['discuss.channel']
+        config = self.env['ai.config'].get_active_config()
+
+        prompt = (
+            "Sei un normalizzatore di date/tempi IT.\n"
+            f"Oggi (NOW) è: {base.strftime('%Y-%m-%d %H:%M:%S')} {self._when_tz()}.\n"
+            "Dato questo testo utente, estrai SOLO il 'quando'. "
+            "Rispondi in una sola riga con un JSON come uno dei seguenti:\n"
+            '{ "absolute": "YYYY-MM-DD HH:MM:SS" }\n'
+            '{ "relative": "PnYnMnWnDTnHnMnS" }\n'
+            "{}\n"
+            "Scegli 'absolute' se il testo contiene una data concreta (anche se relativa ma facile da risolvere), "
+            "altrimenti 'relative' con durata ISO 8601 equivalente (es: 5 giorni => P5D; 1 settimana => P1W; 120 ore => PT120H). "
+            "Non scrivere altro fuori dal JSON."
+            "\n\nTESTO UTENTE:\n" + user_text
+        )
+
+        resp = ai_chatbot._get_gemini_response(
+            config, [{'role': 'user', 'content': prompt}], task='resolve_when'
+        )
+        js = _balanced_json_extract(resp or "") or "{}"
+        return json.loads(js)
+
     def _wants_full_catalog(self, user_message):
         """
         Usa l'LLM per capire se l'utente sta chiedendo esplicitamente
         il catalogo completo (senza filtri).
         """
+        verdict = get_turn_verdict(user_message)
+        if verdict:
+            return verdict['full_catalog']
+
         try:
             ai_chatbot = self.env['discuss.channel']
             config = self.env['ai.config'].get_active_config()
@@ -223,7 +511,9 @@ class MailBot(models.AbstractModel):
                 "Rispondi YES o NO, nulla altro."
             )
 
-            resp = ai_chatbot._get_gemini_response(config, [{'role': 'user', 'content': prompt}])
+            resp = ai_chatbot._get_gemini_response(
+                config, [{'role': 'user', 'content': prompt}], task='wants_full_catalog'
+            )
             return 'YES' in (resp or '').strip().upper()
         except Exception as e:
             _logger.warning(f"Errore wants_full_catalog: {e}", exc_info=True)
@@ -265,14 +555,7 @@ class MailBot(models.AbstractModel):
         if not author_id:
             author_id = self.env.user.partner_id.id
 
-        bot_partner_ids = {
-            partner.id
-            for partner in (
-                self.env.ref('base.partner_odoobot', raise_if_not_found=False),
-                self.env.ref('base.partner_root', raise_if_not_found=False),
-            )
-            if partner
-        }
+        bot_partner_ids = self._get_bot_partner_ids()
         odoobot_id = next(iter(bot_partner_ids), None)
 
         if author_id and author_id in bot_partner_ids:
@@ -354,13 +637,8 @@ class MailBot(models.AbstractModel):
                     subtype_xmlid='mail.mt_comment',
                 )
                 
-                # Aggiungi marker di reset (usato da _build_conversation_history)
-                record.with_context(ai_livebot_skip_bot_logic=True).message_post(
-                    body="[SYSTEM_RESET]",
-                    author_id=odoobot_id,
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note',
-                )
+                # Puntatore di reset dello stato conversazione (usato da _build_conversation_history)
+                self.env['ai.conversation']._reset_channel(record)
                 _logger.info(f"✅ Conversazione resettata per canale {record.id} da utente {self.env.user.name}")
                 return
             except Exception as e:
@@ -372,18 +650,17 @@ class MailBot(models.AbstractModel):
                 )
                 return
         
+        # Turno utente nello stato conversazione del canale
+        self.env['ai.conversation']._append(record, 'user', body)
+
+        # Modalità asincrona: accoda il turno, la risposta arriva via bus dal worker
+        if config.async_mode:
+            self.env['ai.chat.job']._enqueue(record, body, kind='odoobot')
+            return
+
         # Ottieni la risposta dall'AI invece che da OdooBot
         try:
-            ai_response = self._get_ai_response(body, record)
-            
-            if ai_response:
-                # Invia la risposta AI invece della risposta standard di OdooBot
-                record.with_context(ai_livebot_skip_bot_logic=True).message_post(
-                    body=ai_response,
-                    author_id=odoobot_id,
-                    message_type='comment',
-                    subtype_xmlid='mail.mt_comment',
-                )
+            if self._reply_with_ai(record, body, odoobot_id=odoobot_id):
                 return  # Non eseguire la logica standard
         except Exception as e:
             _logger.error(f"Errore nell'ottenere risposta AI: {e}")
@@ -398,6 +675,61 @@ class MailBot(models.AbstractModel):
         #  fallback alla logica sta
         return super()._apply_logic(record, values, command)
     
+    def _get_bot_partner_ids(self):
+        """Partner usati come autore dei messaggi del bot (OdooBot / root)"""
+        return {
+            partner.id
+            for partner in (
+                self.env.ref('base.partner_odoobot', raise_if_not_found=False),
+                self.env.ref('base.partner_root', raise_if_not_found=False),
+            )
+            if partner
+        }
+
+    def _reply_with_ai(self, record, body, odoobot_id=None):
+        """
+        Genera la risposta AI per il messaggio e la pubblica nel canale come OdooBot.
+        Usato sia dal flusso sincrono di `_apply_logic` sia dai job asincroni.
+
+        Returns:
+            bool: True se è stata pubblicata una risposta
+        """
+        if not odoobot_id:
+            odoobot_id = next(iter(self._get_bot_partner_ids()), None)
+
+        # Streaming: anteprima della risposta in chat mentre l'LLM la genera
+        stream = None
+        if self.env['ai.config']._is_streaming_enabled():
+            stream = ChatStream(record, odoobot_id, on_function=self.env['discuss.channel']._prefetch_function)
+
+        with streaming(stream):
+            try:
+                ai_response = self._get_ai_response(body, record)
+            except Exception:
+                if stream:
+                    stream.discard()
+                raise
+        if not ai_response:
+            if stream:
+                stream.discard()
+            return False
+
+        self.env['ai.pending.action']._sync_with_reply(record, ai_response)
+        self.env['ai.conversation']._append(record, 'assistant', ai_response)
+
+        # Invia la risposta AI invece della risposta standard di OdooBot
+        # (l'anteprima dello streaming sparisce al commit del turno)
+        if stream:
+            stream.discard_on_commit()
+        record.with_context(ai_livebot_skip_bot_logic=True).message_post(
+            body=ai_response,
+            author_id=odoobot_id,
+            message_type='comment',
+            subtype_xmlid='mail.mt_comment',
+        )
+        return True
+
+    @turn_scoped
     def _get_ai_response(self, user_message, channel):
         """Ottiene una risposta dall'AI"""
         try:
@@ -441,24 +773,10 @@ class MailBot(models.AbstractModel):
                 if isinstance(result, dict) and result.get('error'):
                     return format_html_response(f"⚠️ {result.get('error')}")
                 
-                # 🆕 FORZA RELOAD ORDINE DAL DB PRIMA DI FORMATTARE
+                # Ordine letto nella transazione del turno: vede già le scritture delle chiamate precedenti
                 try:
                     order_id = result.get('order_id')
-                    SaleOrder = self.env['sale.order']
-                    order = SaleOrder.browse(order_id)
-                    
-                    if order and order.exists():
-                        # Invalida cache completa
-                        order.invalidate_recordset()
-                        order.order_line.invalidate_recordset()
-                        
-                        # 🔥 COMMIT ESPLICITO per forzare lettura dati freschi dal DB
-                        self.env.cr.commit()
-                        
-                        # Ricarica ordine dal DB
-                        order = SaleOrder.browse(order_id)
-                        
-                        _logger.warning(f"🔄 BYPASS: Ordine ricaricato dal DB - righe attuali: {len(order.order_line)}")
+                    order = self.env['sale.order'].browse(order_id)
                     
                     if order and order.exists():
                         summary = self._build_sales_order_summary(order)
@@ -495,129 +813,37 @@ class MailBot(models.AbstractModel):
                     _logger.error(f"Errore formattando riepilogo bypass: {e}", exc_info=True)
                     return format_html_response(f"⚠️ Errore: {str(e)}")
             
-            # STEP 1: Check for pending sales order confirmation
-            pending_so_json = self._check_pending_sales_order(channel, user_message)
-            if pending_so_json:
-                # User confirmed, execute the create_sales_order
-                _logger.info(f"Utente ha confermato ordine pendente: {pending_so_json}")
-                
-                # Esegui direttamente warehouse_ops bypassando il gate
-                warehouse_ops = self.env['warehouse.operations']
-                
-                # Converti scheduled_date da stringa a datetime se necessario
-                if 'scheduled_date' in pending_so_json and isinstance(pending_so_json['scheduled_date'], str):
-                    try:
-                        from datetime import datetime
-                        scheduled_str = pending_so_json['scheduled_date']
-                        if ' ' in scheduled_str:
-                            pending_so_json['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d %H:%M:%S")
-                        else:
-                            pending_so_json['scheduled_date'] = datetime.strptime(scheduled_str, "%Y-%m-%d")
-                    except Exception as e:
-                        _logger.warning(f"Errore conversione scheduled_date: {e}")
-                        pending_so_json.pop('scheduled_date', None)
-                
-                # ESEGUI LA CREATE BYPASSANDO IL GATE
-                result = warehouse_ops.create_sales_order(**pending_so_json)
-                
-                # Format the response
-                lines = []
-                if isinstance(result, dict) and result.get('error'):
-                    lines.append(f"⚠️ Errore: {result.get('error')}")
-                    if result.get('details'):
-                        lines.append(result.get('details'))
-                else:
-                    order_name = result.get('sale_order_name') or result.get('order_name')
-                    if order_name:
-                        lines.append(f"✅ Ordine creato: {order_name}")
-                    order_id = result.get('sale_order_id') or result.get('order_id')
-                    if order_id:
-                        lines.append(f"ID interno: {order_id}")
-                    
-                    # Stato con mapping
-                    state = result.get('state', 'N/A')
-                    state_map = {'draft': 'Bozza', 'sent': 'Inviato', 'sale': 'Confermato', 'done': 'Evaso'}
-                    state_display = state_map.get(state, state)
-                    lines.append(f"Stato: {state_display}")
-                    
-                    pickings = result.get('pickings', [])
-                    if pickings:
-                        lines.append("\nConsegne generate:")
-                        for p in pickings:
-                            lines.append(f"  • {p.get('picking_name')} - {p.get('scheduled_date', 'N/A')}")
-                    lines.append(f"\nTotale: €{result.get('amount_total', 0):.2f}")
-                
-                return format_html_response("\n\n".join(lines) if lines else "Operazione completata.")
-            
-            # STEP 1.5: Check for pending cancel confirmation
-            pending_cancel_json = self._check_pending_cancel(channel, user_message)
-            if pending_cancel_json:
-                _logger.info(f"Utente ha confermato cancellazione pendente: {pending_cancel_json}")
-                
-                warehouse_ops = self.env['warehouse.operations']
-                result = warehouse_ops.cancel_sales_order(**pending_cancel_json)
-                
-                lines = []
-                if isinstance(result, dict) and result.get('error'):
-                    lines.append(f"⚠️ Errore: {result.get('error')}")
-                    if result.get('details'):
-                        lines.append(result.get('details'))
-                else:
-                    order_name = result.get('order_name') or pending_cancel_json.get('order_name')
-                    order_id = result.get('order_id') or pending_cancel_json.get('order_id')
-                    if order_name:
-                        lines.append(f"✅ Ordine cancellato: {order_name}")
-                    if order_id:
-                        lines.append(f"ID interno: {order_id}")
-                    
-                    current_state = result.get('current_state', 'cancel')
-                    lines.append(f"Stato finale: {current_state}")
-                
-                return format_html_response("\n\n".join(lines) if lines else "Operazione completata.")
+            # STEP 1: Conferma di un'azione in attesa (ordine da creare / da cancellare)
+            PendingAction = self.env['ai.pending.action']
+            confirmation = PendingAction._confirm(channel, user_message)
+            if confirmation is not None:
+                return format_html_response(confirmation)
             
             # STEP 2: Check if user cancelled pending order
-            if self._is_cancellation(user_message) and self._has_pending_marker(channel):
+            if PendingAction._get_pending(channel, 'create_sales_order') and self._is_cancellation(user_message):
+                PendingAction._close_pending(channel)
                 return format_html_response("❌ Operazione annullata: non procedo con la creazione del preventivo.")
             
             # Prepara il contesto delle funzioni disponibili
             functions_context = self._get_functions_context()
             
-            # Recupera lo storico conversazione dal canale (ultimi 10 messaggi)
-            messages = self._build_conversation_history(channel, user_message, functions_context)
+            # Recupera lo storico conversazione dal canale (budget di token della configurazione)
+            messages = self._build_conversation_history(channel, user_message, functions_context, config=config)
             
             _logger.info(f"Costruiti {len(messages)} messaggi di contesto per AI")
             
             # Ottieni risposta dall'AI 
-            ai_chatbot = self.env['discuss.channel']
-            ai_response = ai_chatbot._get_gemini_response(config, messages)
+            # (sul record del canale: gli handler delle funzioni vi registrano le azioni da confermare)
+            ai_chatbot = channel if channel._name == 'discuss.channel' else self.env['discuss.channel']
+            ai_response = ai_chatbot._get_gemini_response(config, messages, stream=current_stream())
             
             # Controlla se l'AI vuole eseguire una o più funzioni
             function_calls, clean_response = ai_chatbot._parse_ai_function_calls(ai_response)
 
-            # Retry parsing se l'AI ha messo i tag in blocchi di codice/backticks
-            if not function_calls and '[FUNCTION:' in (ai_response or ''):
-                try:
-                    cleaned_try = re.sub(r'```.*?```', '', ai_response, flags=re.S)
-                    cleaned_try = cleaned_try.replace('`', '').strip()
-                    if cleaned_try != ai_response:
-                        _logger.info('Retry parsing FUNCTION tags after cleaning AI response (odoobot)')
-                        function_calls, clean_response = ai_chatbot._parse_ai_function_calls(cleaned_try)
-                        if function_calls:
-                            ai_response = cleaned_try
-                except Exception:
-                    pass
-
-            # Fallback: se ancora niente ma c'è un tag [FUNCTION:nome] senza parametri
-            if not function_calls and '[FUNCTION:' in (ai_response or ''):
-                bare = re.findall(r'\[(?:FUNCTION|Function|function):\s*([A-Za-z0-9_]+)\s*\]', ai_response)
-                if bare:
-                    function_calls = [(name.strip(), {}) for name in bare]
-                    clean_response = re.sub(r'\[(?:FUNCTION|Function|function):[^\]]+\]', '', ai_response).strip()
-                    _logger.info(f"✅ Fallback bare FUNCTION (odoobot): created {len(function_calls)} call(s) with empty params.")
-
             # Se ancora nessuna funzione ma la risposta contiene frammenti come "|... ]",
             # chiedi all'AI di restituire SOLO il tag completo e riprova.
-            if not function_calls and (ai_response and '|' in ai_response and ']' in ai_response):
+            # (non con il function calling nativo: le chiamate arrivano già strutturate)
+            if not function_calls and config.function_calling != 'native' and (ai_response and '|' in ai_response and ']' in ai_response):
                 try:
                     follow_up_messages = messages + [
                         {'role': 'assistant', 'content': ai_response},
@@ -639,21 +865,36 @@ class MailBot(models.AbstractModel):
             if function_calls:
                 _logger.info(f"📋 AI ha generato {len(function_calls)} chiamate funzione")
                 
+                read_only = get_function_registry(self.env).read_only
+
                 # Caso speciale: se tutte sono search_products, accumula i risultati
                 if all(fn == 'search_products' for fn, _ in function_calls):
                     _logger.info("🔍 Batch search_products rilevato - ricerca FUZZY multi-pattern")
                     
                     all_search_results = []
                     search_mapping = []
-                    
+
+                    # Termini normalizzati localmente, poi UNA ricerca batch per tutti
+                    search_terms = []
+                    search_options = {}
                     for idx, (fn, params) in enumerate(function_calls):
                         params = self._prepare_search_params(params, user_message)
                         search_term = params.get('search_term', '')
                         _logger.info(f"  🔎 Search #{idx+1}: '{search_term}'")
-                        
-                        # 🆕 RICERCA DIRETTA (senza normalizzazione LLM per risparmiare token!)
-                        # La nuova logica fuzzy in search_products è già abbastanza intelligente
-                        result = ai_chatbot._execute_function(fn, params)
+                        normalized = ai_chatbot._normalize_product_search_term(search_term) or ''
+                        search_terms.append((search_term, normalized))
+                        # Limite e tipo di ciascuna chiamata
+                        search_options[normalized] = {
+                            'limit': params.get('limit'),
+                            'product_type': params.get('product_type'),
+                        }
+
+                    batch_results = self.env['warehouse.operations'].search_products_batch(
+                        [normalized for _term, normalized in search_terms], limit=1, options=search_options
+                    )
+
+                    for search_term, normalized in search_terms:
+                        result = batch_results.get(normalized.strip(), [])
                         
                         if isinstance(result, list) and len(result) > 0:
                             # Prendi il primo match (migliore ranking fuzzy)
@@ -701,6 +942,37 @@ class MailBot(models.AbstractModel):
                         function_name = 'search_products'
                         result = all_search_results
                         parameters = {}
+                elif len(function_calls) > 1 and all(fn in read_only for fn, _ in function_calls):
+                    # Più letture indipendenti: in parallelo, poi UNA risposta composta dall'AI
+                    _logger.info(f"⚡ {len(function_calls)} funzioni di sola lettura - esecuzione in parallelo")
+                    calls = [
+                        (fn, self._prepare_search_params(dict(params), user_message) if fn == 'search_products' else params)
+                        for fn, params in function_calls
+                    ]
+                    executed_calls = execute_calls(
+                        ai_chatbot, calls, read_only, max_workers=config.function_workers,
+                    )
+                    summary_blocks = [
+                        f"Risultato della funzione {fn} con parametri {json.dumps(params)}: {json.dumps(result, indent=2)}"
+                        for fn, params, result in executed_calls
+                    ]
+                    follow_up_messages = messages + [
+                        {'role': 'assistant', 'content': clean_response or "Ho capito, ecco i risultati."},
+                        {'role': 'user', 'content': (
+                            "\n\n".join(summary_blocks)
+                            + "\n\nGenera una risposta chiara e professionale per l'utente utilizzando questi dati."
+                            + "\nNON includere tag [FUNCTION:...] nella risposta."
+                            + "\nRICORDA: Le funzioni sono già state eseguite, tu devi solo comunicare i risultati."
+                        )}
+                    ]
+                    final_response = strip_function_tags(
+                        (ai_chatbot._get_gemini_response(config, follow_up_messages) or "").strip()
+                    )
+                    if not final_response:
+                        final_response = "\n".join(
+                            f"Risultati {fn}:\n{json.dumps(result, indent=2)}" for fn, _params, result in executed_calls
+                        )
+                    return format_html_response(final_response)
                 else:
                     # Caso normale: esegui la prima funzione (comportamento legacy)
                     function_name, parameters = function_calls[0]
@@ -714,10 +986,10 @@ class MailBot(models.AbstractModel):
                     exec_params = self._prepare_search_params(exec_params, user_message)
 
                 if function_name == 'create_sales_order':
-                    dt = self._llm_when_to_datetime(user_message)
+                    dt = self._when_to_datetime(user_message)
                     if dt:
                         exec_params['scheduled_date'] = dt.strftime("%Y-%m-%d %H:%M:%S")
-                        _logger.info(f"[WHEN] scheduled_date from LLM-normalized: {exec_params['scheduled_date']}")
+                        _logger.info(f"[WHEN] scheduled_date normalizzata: {exec_params['scheduled_date']}")
 
                 result = ai_chatbot._execute_function(function_name, exec_params)
                 
@@ -758,19 +1030,22 @@ class MailBot(models.AbstractModel):
                 
                 # ✅ Se create_sales_order richiede conferma, restituisci SOLO il messaggio formattato
                 if function_name == 'create_sales_order' and isinstance(result, dict) and result.get('requires_confirmation'):
-                    dt = self._llm_when_to_datetime(user_message)
+                    dt = self._when_to_datetime(user_message)
                     if dt:
                         sd = dt.strftime("%Y-%m-%d %H:%M:%S")
                         # allinea sia i parametri pendenti che il testo del messaggio
                         if 'pending_params' in result:
                             result['pending_params']['scheduled_date'] = sd
+                            self.env['ai.pending.action']._register(channel, 'create_sales_order', result['pending_params'])
                         if 'summary' in result:
                             result['summary']['scheduled_date'] = sd
-                        # Aggiorna anche il messaggio formattato con regex robusta
+                        # Aggiorna anche il messaggio formattato con regex robusta (orario nel fuso dell'utente)
                         if 'message' in result:
+                            from odoo import fields
+                            shown = fields.Datetime.context_timestamp(self, dt).strftime("%Y-%m-%d %H:%M:%S")
                             result['message'] = re.sub(
                                 r'(Data consegna:\s*)(\d{4}-\d{2}-\d{2}(?: \d{2}:\d{2}:\d{2})?)',
-                                r'\g<1>' + sd,
+                                r'\g<1>' + shown,
                                 result['message']
                             )
                         _logger.info(f"✅ Data riepilogo allineata a: {sd}")
@@ -828,6 +1103,8 @@ class MailBot(models.AbstractModel):
                         for o in orders[:10]:  # Mostra max 10
                             state_txt = states_map.get(o.get('state'), o.get('state'))
                             lines.append(f"• {o.get('name')} - {o.get('partner')} - {_fmt_price(o.get('amount_total', 0))} - {state_txt}")
+                        if result.get('next_cursor'):
+                            lines.append(f"➡️ Altri ordini nel periodo: chiedi di mostrare i successivi (cursor: {result['next_cursor']})")
                     
                     return format_html_response("\n\n".join(lines))
                 
@@ -1078,7 +1355,7 @@ class MailBot(models.AbstractModel):
                     final_response = "\n\n".join(lines) if lines else "Operazione completata."
 
                     # Rimuovi eventuali tag FUNCTION residui, per sicurezza
-                    final_response = re.sub(r'\[FUNCTION:[^\]]+\]', '', final_response).strip()
+                    final_response = strip_function_tags(final_response)
                     
                     # Formatta con HTML
                     return format_html_response(final_response)
@@ -1154,7 +1431,7 @@ class MailBot(models.AbstractModel):
                                     return format_html_response(formatted_response)
                         
                         # Rimuovi i tag dalla risposta finale
-                        final_response = re.sub(r'\[FUNCTION:[^\]]+\]', '', final_response).strip()
+                        final_response = strip_function_tags(final_response)
                 except Exception as e:
                     _logger.warning(f"Errore parsing funzioni aggiuntive: {e}")
                 
@@ -1176,138 +1453,6 @@ class MailBot(models.AbstractModel):
             _logger.error(f"Errore risposta AI: {e}")
             return f"Mi dispiace, si e verificato un errore: {str(e)}"
     
-    def _check_pending_sales_order(self, channel, user_message):
-        """
-        Controlla se c'è un ordine pendente e se l'utente ha confermato.
-        Restituisce il JSON dei parametri se confermato, altrimenti None.
-        """
-        # Check if user confirmed
-        _logger.info(f"🔍 Checking confirmation for message: {user_message}")
-        if not re.search(r'\b(S[IÌI]|CONFERMO|OK\s*VAI|PERFETTO)\b', user_message, re.I):
-            _logger.info("❌ No confirmation keyword found")
-            return None
-        
-        _logger.info("✅ Confirmation keyword detected!")
-        
-        # Look for [PENDING_SO] marker in last bot message
-        try:
-            from odoo.addons.ai_livebot.models.ai_chatbot import PENDING_SO_MARKER
-            
-            bot_partner_ids = {
-                partner.id
-                for partner in (
-                    self.env.ref('base.partner_odoobot', raise_if_not_found=False),
-                    self.env.ref('base.partner_root', raise_if_not_found=False),
-                )
-                if partner
-            }
-            
-            # Get last bot message
-            last_bot_msg = self.env['mail.message'].search([
-                ('model', '=', channel._name),
-                ('res_id', '=', channel.id),
-                ('author_id', 'in', list(bot_partner_ids)),
-                ('message_type', '=', 'comment'),
-            ], order='date desc', limit=1)
-            
-            if last_bot_msg and last_bot_msg.body:
-                body_text = re.sub(r'<[^>]+>', '', last_bot_msg.body or '').strip()
-                _logger.info(f"📄 Last bot message (first 200 chars): {body_text[:200]}")
-                
-                # Look for marker - usa parser a contatore di graffe per JSON annidati
-                text = body_text
-                idx = text.find(PENDING_SO_MARKER)
-                if idx != -1:
-                    jstart = text.find('{', idx)
-                    if jstart != -1:
-                        depth = 0
-                        end = None
-                        for k, ch in enumerate(text[jstart:], start=jstart):
-                            if ch == '{':
-                                depth += 1
-                            elif ch == '}':
-                                depth -= 1
-                                if depth == 0:
-                                    end = k + 1
-                                    break
-                        if end:
-                            json_str = text[jstart:end]
-                            _logger.info(f"✅ Found marker with JSON: {json_str}")
-                            parsed = json.loads(json_str)
-                            _logger.info(f"✅ Parsed params: {parsed}")
-                            return parsed
-                _logger.warning(f"❌ Marker {PENDING_SO_MARKER} not found or JSON not balanced")
-            else:
-                _logger.warning("❌ No last bot message found")
-        except Exception as e:
-            _logger.error(f"❌ Errore checking pending SO: {e}", exc_info=True)
-        
-        return None
-    
-    def _check_pending_cancel(self, channel, user_message):
-        """
-        Controlla se c'è una cancellazione pendente e se l'utente ha confermato.
-        Restituisce il JSON dei parametri se confermato, altrimenti None.
-        """
-        _logger.info(f"🔍 Checking cancel confirmation for message: {user_message}")
-        if not re.search(r'\b(S[IÌI]|CONFERMO|OK\s*VAI|PERFETTO)\b', user_message, re.I):
-            _logger.info("❌ No confirmation keyword found")
-            return None
-        
-        _logger.info("✅ Confirmation keyword detected!")
-        
-        try:
-            from odoo.addons.ai_livebot.models.ai_chatbot import PENDING_CANCEL_MARKER
-            
-            bot_partner_ids = {
-                partner.id
-                for partner in (
-                    self.env.ref('base.partner_odoobot', raise_if_not_found=False),
-                    self.env.ref('base.partner_root', raise_if_not_found=False),
-                )
-                if partner
-            }
-            
-            last_bot_msg = self.env['mail.message'].search([
-                ('model', '=', channel._name),
-                ('res_id', '=', channel.id),
-                ('author_id', 'in', list(bot_partner_ids)),
-                ('message_type', '=', 'comment'),
-            ], order='date desc', limit=1)
-            
-            if last_bot_msg and last_bot_msg.body:
-                body_text = re.sub(r'<[^>]+>', '', last_bot_msg.body or '').strip()
-                _logger.info(f"📄 Last bot message (first 200 chars): {body_text[:200]}")
-                
-                text = body_text
-                idx = text.find(PENDING_CANCEL_MARKER)
-                if idx != -1:
-                    jstart = text.find('{', idx)
-                    if jstart != -1:
-                        depth = 0
-                        end = None
-                        for k, ch in enumerate(text[jstart:], start=jstart):
-                            if ch == '{':
-                                depth += 1
-                            elif ch == '}':
-                                depth -= 1
-                                if depth == 0:
-                                    end = k + 1
-                                    break
-                        if end:
-                            json_str = text[jstart:end]
-                            _logger.info(f"✅ Found PENDING_CANCEL marker with JSON: {json_str}")
-                            parsed = json.loads(json_str)
-                            _logger.info(f"✅ Parsed cancel params: {parsed}")
-                            return parsed
-                _logger.warning(f"❌ Marker {PENDING_CANCEL_MARKER} not found or JSON not balanced")
-            else:
-                _logger.warning("❌ No last bot message found")
-        except Exception as e:
-            _logger.error(f"❌ Errore checking pending cancel: {e}", exc_info=True)
-        
-        return None
-    
     def _is_cancellation(self, user_message):
         """
         Determina se l'utente vuole ANNULLARE l'OPERAZIONE PENDENTE (gate di conferma),
@@ -1352,7 +1497,15 @@ class MailBot(models.AbstractModel):
                 _logger.info(f"🔍 Pre-filter: messaggio parla di documenti business → NON cancello gate: '{user_message[:50]}'")
                 return False
         
-        # STEP 2: Usa LLM per classificare se vuole annullare IL GATE (operazione pendente)
+        # STEP 2: Verdetto dell'analisi turno, altrimenti LLM dedicato per il GATE (operazione pendente)
+        verdict = get_turn_verdict(user_message)
+        if verdict:
+            _logger.info(
+                f"🧭 Analisi turno gate-cancel: '{user_message[:50]}' → "
+                f"{'CANCEL_GATE' if verdict['cancel_gate'] else 'KEEP_GATE'}"
+            )
+            return verdict['cancel_gate']
+
         try:
             ai_chatbot = self.env['discuss.channel']
             config = self.env['ai.config'].get_active_config()
@@ -1381,7 +1534,9 @@ class MailBot(models.AbstractModel):
                 "RISPONDI SOLO: YES o NO"
             )
             
-            response = ai_chatbot._get_gemini_response(config, [{'role': 'user', 'content': prompt}])
+            response = ai_chatbot._get_gemini_response(
+                config, [{'role': 'user', 'content': prompt}], task='gate_cancellation'
+            )
             response_clean = (response or '').strip().upper()
             
             is_cancel = 'YES' in response_clean
@@ -1397,36 +1552,6 @@ class MailBot(models.AbstractModel):
             # Fallback sicuro: NON annullare in caso di errore
             return False
     
-    def _has_pending_marker(self, channel):
-        """Check if there's a pending marker in recent messages"""
-        try:
-            from odoo.addons.ai_livebot.models.ai_chatbot import PENDING_SO_MARKER
-            
-            bot_partner_ids = {
-                partner.id
-                for partner in (
-                    self.env.ref('base.partner_odoobot', raise_if_not_found=False),
-                    self.env.ref('base.partner_root', raise_if_not_found=False),
-                )
-                if partner
-            }
-            
-            recent_msg = self.env['mail.message'].search([
-                ('model', '=', channel._name),
-                ('res_id', '=', channel.id),
-                ('author_id', 'in', list(bot_partner_ids)),
-                ('message_type', '=', 'comment'),
-            ], order='date desc', limit=3)
-            
-            for msg in recent_msg:
-                body_text = re.sub(r'<[^>]+>', '', msg.body or '').strip()
-                if PENDING_SO_MARKER in body_text:
-                    return True
-        except Exception:
-            pass
-        
-        return False
-    
     def _get_functions_context(self):
         """Costruisce il contesto delle funzioni disponibili"""
         ai_chatbot = self.env['discuss.channel']
@@ -1439,16 +1564,21 @@ class MailBot(models.AbstractModel):
         context += "\nPer usare una funzione, rispondi con: [FUNCTION:nome_funzione|param1:value1|param2:value2]"
         return context
     
-    def _build_conversation_history(self, channel, current_message, functions_context, max_messages=10):
+    def _build_conversation_history(self, channel, current_message, functions_context, max_messages=10, config=None):
         """
-        Costruisce lo storico della conversazione dal canale.
-        Recupera gli ultimi N messaggi e li formatta per Gemini API.
+        Costruisce lo storico della conversazione dallo stato del canale
+        (`ai.conversation`), in testo semplice, dopo l'ultimo /reset.
+        
+        Con `config.context_token_budget` i turni entrano dal più recente
+        finché stanno nel budget e quelli esclusi sono coperti dal riassunto
+        progressivo; senza budget restano gli ultimi `max_messages` turni.
         
         Args:
-            channel: Il record discuss.channel o mail.channel
+            channel: Il record discuss.channel
             current_message: Il messaggio corrente dell'utente
             functions_context: Contesto delle funzioni disponibili
-            max_messages: Numero massimo di messaggi da includere nello storico
+            max_messages: Numero massimo di messaggi se il budget token è disattivato
+            config: ai.config attiva (budget token e riassunto)
             
         Returns:
             Lista di dict con formato {'role': 'user'|'assistant', 'content': 'testo'}
@@ -1456,84 +1586,12 @@ class MailBot(models.AbstractModel):
         messages = []
         
         try:
-            # Ottieni partner_id di OdooBot
-            bot_partner_ids = {
-                partner.id
-                for partner in (
-                    self.env.ref('base.partner_odoobot', raise_if_not_found=False),
-                    self.env.ref('base.partner_root', raise_if_not_found=False),
-                )
-                if partner
-            }
-            
-            # Ignora messaggi più vecchi di X ore (default: 2 ore)
-            from datetime import datetime, timedelta
-            cutoff_time = datetime.now() - timedelta(hours=2)
-            
-            # Recupera messaggi dal canale (ordinati per data, più recenti prima)
-            # Usa il modello mail.message per ottenere i messaggi
-            channel_messages = self.env['mail.message'].search([
-                ('model', '=', channel._name),
-                ('res_id', '=', channel.id),
-                ('message_type', 'in', ['comment', 'notification']),
-                ('date', '>=', cutoff_time),  # Solo messaggi recenti
-            ], order='date desc', limit=max_messages)
-            
-            # Inverti l'ordine per avere i messaggi dal più vecchio al più recente
-            channel_messages = channel_messages.sorted(key=lambda m: m.date)
-            
-            # Cerca marker di reset [SYSTEM_RESET] - ignora tutto prima di esso
-            reset_index = -1
-            for idx, msg in enumerate(channel_messages):
-                if '[SYSTEM_RESET]' in (msg.body or ''):
-                    reset_index = idx
-                    _logger.info(f"Trovato marker reset all'indice {idx} - ignoro messaggi precedenti")
-                    break
-            
-            # Se trovato reset, prendi solo messaggi DOPO di esso
-            if reset_index >= 0:
-                channel_messages = channel_messages[reset_index + 1:]
-            
-            # Costruisci lo storico
-            for msg in channel_messages:
-                # Estrai il testo pulito (rimuovi HTML)
-                body_text = re.sub(r'<[^>]+>', '', msg.body or '').strip()
-                
-                # Salta messaggi di sistema (marker reset, notifiche)
-                if '[SYSTEM_RESET]' in body_text or msg.message_type == 'notification':
-                    continue
-                
-                # 🆕 FILTRA MESSAGGI DI ERRORE - Non includere nello storico per evitare che l'AI impari a rispondere con errori
-                if any(keyword in body_text.lower() for keyword in [
-                    'errore di connessione',
-                    '503 server error',
-                    '503 service unavailable',
-                    'service unavailable',
-                    'connection error',
-                    'timeout error',
-                    'api error',
-                ]):
-                    _logger.info(f"⚠️ Filtrato messaggio di errore dallo storico: {body_text[:50]}...")
-                    continue
-                
-                if not body_text or len(body_text) < 2:
-                    continue
-                
-                # Determina il ruolo
-                if msg.author_id.id in bot_partner_ids:
-                    role = 'assistant'
-                else:
-                    role = 'user'
-                
-                messages.append({
-                    'role': role,
-                    'content': body_text
-                })
-            
-            # Limita a max_messages (rimuovi i più vecchi se necessario)
-            if len(messages) > max_messages:
-                messages = messages[-max_messages:]
-            
+            conversation, _created = self.env['ai.conversation']._for_channel(channel)
+            if config and config.context_token_budget > 0:
+                messages = conversation._context(config.context_token_budget, summarize=config.context_summary)
+            else:
+                messages = conversation._history(max_messages)
+            _logger.info(f"🧮 Storico: {len(messages)} messaggi, ~{sum(estimate_tokens(m['content']) for m in messages)} token")
         except Exception as e:
             _logger.warning(f"Errore recupero storico conversazione: {e}")
             # Fallback: usa solo il messaggio corrente
@@ -0,0 +1,298 @@
+"""
+Indice in memoria dei nomi prodotto, per worker.
+
+Alternativa a pg_trgm per `search_products`: indice invertito su nomi
+(tutte le traduzioni), codici interni e barcode di `product.product`.
+
+- posting list dei token e trigrammi dei token in `array('i')` compatti
+- aggiornamento incrementale dopo il commit (hook create/write/unlink)
+- invalidazione tra worker tramite una sequenza PostgreSQL dedicata: ogni
+  commit che modifica prodotti la fa avanzare e gli altri worker
+  ricostruiscono l'indice alla richiesta successiva (nessuna segnalazione
+  del registry, che svuoterebbe tutte le ormcache)
+- ranking: numero di parole trovate (come la ricerca ORM), poi qualità
+  del match (esatto > prefisso > distanza di edit)
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from array import array
+
+_logger = logging.getLogger(__name__)
+
+# Le parole di ricerca più corte di così vengono ignorate (come nella ricerca ORM)
+MIN_WORD_LENGTH = 3
+
+# Qualità del match di una parola
+MATCH_EXACT = 1.0
+MATCH_PREFIX = 0.8
+MATCH_EDIT = {1: 0.6, 2: 0.4}
+
+# Ricostruzione completa quando i documenti eliminati superano questa quota
+COMPACT_RATIO = 0.3
+
+_TOKEN_RE = re.compile(r"[0-9a-zàèéìòóù]+")
+
+# Sequenza della generazione dell'indice (creata da `product.product.init()`)
+GENERATION_SEQUENCE = 'ai_livebot_product_index_seq'
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a, b, max_distance):
+    """Distanza di Levenshtein, interrotta appena supera `max_distance`."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, start=1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            current.append(value)
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def max_edits(word):
+    return 1 if len(word) <= 5 else 2
+
+
+class ProductNameIndex:
+    """Indice invertito dei prodotti attivi di un database."""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.built_at = time.time()
+        # Documenti (una posizione per variante)
+        self.product_ids = array('i')
+        self.alive = bytearray()
+        self.labels = []
+        self.types = []
+        self.position = {}
+        self.dead = 0
+        # Vocabolario: token → posizioni dei documenti
+        self.postings = {}
+        self.vocabulary = []
+        # Trigramma → indici dei token (per la ricerca con errori di battitura)
+        self.gram_tokens = {}
+        self.token_ids = {}
+        self.tokens = []
+
+    # -- costruzione ---------------------------------------------------------
+
+    def add(self, product_id, names, default_code, barcode, product_type):
+        """Aggiunge (o sostituisce) un prodotto."""
+        self.remove(product_id)
+        pos = len(self.product_ids)
+        self.product_ids.append(product_id)
+        self.alive.append(1)
+        self.labels.append(tuple(' '.join(tokenize(name)) for name in names))
+        self.types.append(product_type)
+        self.position[product_id] = pos
+
+        tokens = set()
+        for text in list(names) + [default_code, barcode]:
+            tokens.update(tokenize(text))
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = array('i')
+                self._add_token(token)
+            posting.append(pos)
+
+    def remove(self, product_id):
+        pos = self.position.pop(product_id, None)
+        if pos is not None:
+            self.alive[pos] = 0
+            self.dead += 1
+
+    def needs_compaction(self):
+        return self.dead > COMPACT_RATIO * max(len(self.product_ids), 1)
+
+    def _add_token(self, token):
+        token_id = len(self.tokens)
+        self.token_ids[token] = token_id
+        self.tokens.append(token)
+        bisect.insort(self.vocabulary, token)
+        for gram in trigrams(token):
+            self.gram_tokens.setdefault(gram, array('i')).append(token_id)
+
+    # -- ricerca -------------------------------------------------------------
+
+    def _word_matches(self, word):
+        """Token del vocabolario che corrispondono a `word` con la relativa qualità."""
+        matches = {}
+        if word in self.postings:
+            matches[word] = MATCH_EXACT
+
+        i = bisect.bisect_left(self.vocabulary, word)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+            matches.setdefault(self.vocabulary[i], MATCH_PREFIX)
+            i += 1
+
+        if not matches:
+            # Candidati con trigrammi in comune, poi distanza di edit limitata
+            limit = max_edits(word)
+            counts = {}
+            for gram in trigrams(word):
+                for token_id in self.gram_tokens.get(gram, ()):
+                    counts[token_id] = counts.get(token_id, 0) + 1
+            for token_id, shared in counts.items():
+                if shared < 2:
+                    continue
+                token = self.tokens[token_id]
+                distance = bounded_edit_distance(word, token, limit)
+                if distance <= limit:
+                    matches[token] = max(matches.get(token, 0), MATCH_EDIT[distance])
+        return matches
+
+    def search(self, query, limit, type_values=None):
+        """
+        Returns:
+            list: [(product_id, score)] ordinati per rilevanza
+        """
+        words = [w for w in tokenize(query) if len(w) >= MIN_WORD_LENGTH]
+        if not words:
+            return []
+
+        query_label = ' '.join(tokenize(query))
+        scores = {}
+        for word in words:
+            best = {}
+            for token, quality in self._word_matches(word).items():
+                for pos in self.postings[token]:
+                    if quality > best.get(pos, 0):
+                        best[pos] = quality
+            for pos, quality in best.items():
+                matched, total = scores.get(pos, (0, 0.0))
+                scores[pos] = (matched + 1, total + quality)
+
+        ranked = []
+        for pos, (matched, total) in scores.items():
+            if not self.alive[pos]:
+                continue
+            if type_values and self.types[pos] not in type_values:
+                continue
+            labels = self.labels[pos]
+            exact = query_label in labels
+            shortest = min((len(label) for label in labels), default=0)
+            ranked.append(((exact, matched, total, -shortest), pos))
+        ranked.sort(key=lambda item: (item[0], -item[1]), reverse=True)
+
+        results = []
+        for (exact, matched, total, _length), pos in ranked[:limit]:
+            score = 1.0 if exact else round(total / len(words), 3)
+            results.append((self.product_ids[pos], score))
+        return results
+
+
+def _fetch_rows(cr, product_ids=None):
+    """Righe indicizzabili: prodotti e template attivi (eventualmente solo `product_ids`)."""
+    where = "AND pp.id IN %(ids)s" if product_ids is not None else ""
+    cr.execute(f"""
+        SELECT pp.id,
+               ARRAY(SELECT value FROM jsonb_each_text(pt.name)),
+               pp.default_code, pp.barcode, pt.type
+          FROM product_product pp
+          JOIN product_template pt ON pt.id = pp.product_tmpl_id
+         WHERE pp.active AND pt.active
+               {where}
+    """, {'ids': tuple(product_ids or ()) or (0,)})
+    return cr.fetchall()
+
+
+def build_index(cr, generation):
+    started = time.time()
+    index = ProductNameIndex(generation)
+    for product_id, names, default_code, barcode, product_type in _fetch_rows(cr):
+        index.add(product_id, names or [], default_code, barcode, product_type)
+    _logger.info(
+        f"🗂️ Indice prodotti in memoria costruito: {len(index.position)} prodotti, "
+        f"{len(index.postings)} token in {(time.time() - started) * 1000:.1f}ms"
+    )
+    return index
+
+
+def create_generation_sequence(cr):
+    cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {GENERATION_SEQUENCE}")
+
+
+def current_generation(cr):
+    """Generazione corrente, None se la sequenza non esiste (modulo non aggiornato)."""
+    cr.execute(
+        "SELECT to_regclass(%s) IS NOT NULL, pg_sequence_last_value(to_regclass(%s))",
+        [GENERATION_SEQUENCE, GENERATION_SEQUENCE],
+    )
+    exists, last_value = cr.fetchone()
+    if not exists:
+        return None
+    return last_value or 0
+
+
+def bump_generation(cr):
+    """Nuova generazione (nextval non è transazionale: subito visibile agli altri worker)."""
+    cr.execute("SELECT nextval(to_regclass(%s))", [GENERATION_SEQUENCE])
+    return cr.fetchone()[0]
+
+
+def has_local_index(dbname):
+    return dbname in _indexes
+
+
+def get_product_index(env):
+    """
+    Indice del database corrente, ricostruito se la generazione è cambiata
+    per le scritture di un altro worker.
+    """
+    dbname = env.cr.dbname
+    generation = current_generation(env.cr)
+    index = _indexes.get(dbname)
+    if index is not None and index.generation == generation:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(dbname)
+        if index is None or index.generation != generation:
+            index = _indexes[dbname] = build_index(env.cr, generation)
+    return index
+
+
+def apply_changes(env, rows, removed_ids, generation):
+    """
+    Aggiorna l'indice locale dopo il commit (senza ricostruirlo) e lo porta
+    a `generation`, la generazione appena creata dal commit. Se nel frattempo
+    altri worker hanno fatto avanzare la sequenza l'indice non conosce le
+    loro modifiche: viene scartato e ricostruito alla richiesta successiva.
+    """
+    dbname = env.cr.dbname
+    with _indexes_lock:
+        index = _indexes.get(dbname)
+        if index is None:
+            return
+        if index.generation is None or generation != index.generation + 1:
+            del _indexes[dbname]
+            return
+        for product_id in removed_ids:
+            index.remove(product_id)
+        for product_id, names, default_code, barcode, product_type in rows:
+            index.add(product_id, names or [], default_code, barcode, product_type)
+        if index.needs_compaction():
+            del _indexes[dbname]
+            return
+        index.generation = generation
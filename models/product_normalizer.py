@@ -0,0 +1,202 @@
+"""
+Normalizzatore locale dei termini di ricerca prodotto (italiano).
+
+Sostituisce la chiamata LLM di `_normalize_product_search_term`:
+minuscolo, rimozione di articoli/preposizioni/parole di servizio,
+singolare tramite regole sui suffissi + dizionario eccezioni, guidato da
+un lessico costruito dai nomi prodotto presenti a database.
+
+Ogni termine restituisce anche una confidenza (0-1): il chiamante può
+ricorrere all'LLM solo sotto una soglia configurata.
+"""
+import logging
+import re
+import threading
+import time
+
+from .product_index import current_generation
+
+_logger = logging.getLogger(__name__)
+
+# Articoli, preposizioni (semplici e articolate) e parole di servizio da scartare
+STOPWORDS = frozenset("""
+il lo la i gli le l un uno una
+di a da in con su per tra fra
+del dello della dei degli delle dell
+al allo alla ai agli alle all
+dal dallo dalla dai dagli dalle dall
+nel nello nella nei negli nelle nell
+sul sullo sulla sui sugli sulle sull
+e ed o od che
+pz pezzi pezzo unita qta quantita
+mostra mostrami cerca cercami trova trovami dammi vorrei voglio serve servono
+avete abbiamo hai ci sono quanti quante quanto quanta
+""".split())
+
+# Plurali irregolari / invarianti (forma → singolare)
+EXCEPTIONS = {
+    'uomini': 'uomo', 'mani': 'mano', 'dei': 'dio', 'buoi': 'bue', 'beni': 'bene',
+    'uova': 'uovo', 'paia': 'paio', 'braccia': 'braccio', 'dita': 'dito',
+    'lenzuola': 'lenzuolo', 'ginocchia': 'ginocchio', 'labbra': 'labbro',
+    'ali': 'ala', 'armi': 'arma', 'mobili': 'mobile',
+    'armadi': 'armadio', 'stadi': 'stadio', 'studi': 'studio', 'negozi': 'negozio',
+    'servizi': 'servizio', 'uffici': 'ufficio', 'esercizi': 'esercizio',
+    'bici': 'bici', 'foto': 'foto', 'auto': 'auto', 'moto': 'moto', 'radio': 'radio',
+    'serie': 'serie', 'specie': 'specie', 'analisi': 'analisi', 'crisi': 'crisi',
+    'tesi': 'tesi', 'sintesi': 'sintesi', 'euro': 'euro', 'kit': 'kit', 'mouse': 'mouse',
+}
+
+# Suffissi di forme già singolari terminanti in -e (non vanno trasformate in -a)
+_SINGULAR_E_SUFFIXES = ('ante', 'ente', 'ore', 'one', 'ale', 'ile', 'ese', 'ice', 'ure', 'ione')
+
+# Regole plurale → singolare in ordine di priorità: (suffisso, sostituzioni candidate)
+# La prima sostituzione è il default quando il lessico non decide.
+_SUFFIX_RULES = (
+    ('cie', ('cia',)),
+    ('gie', ('gia',)),
+    ('che', ('ca',)),
+    ('ghe', ('ga',)),
+    ('chi', ('co', 'ca')),
+    ('ghi', ('go', 'ga')),
+    ('ici', ('ico', 'ice')),
+    ('ori', ('ore', 'oro')),
+    ('oni', ('one', 'ono')),
+    ('ali', ('ale', 'alo')),
+    ('ili', ('ile', 'ilo')),
+    ('anti', ('ante', 'anto')),
+    ('enti', ('ente', 'ento')),
+    ('ieri', ('iere', 'iero')),
+    ('ii', ('io',)),
+    ('ie', ('ia',)),
+    ('i', ('o', 'e', 'io', 'a')),
+    ('e', ('a',)),
+)
+
+# Confidenze per fonte della decisione
+CONF_LEXICON = 1.0
+CONF_EXCEPTION = 1.0
+CONF_INVARIANT = 0.95
+CONF_RULE = 0.75
+CONF_RULE_AMBIGUOUS = 0.5
+# Solo -e/-i generici senza riscontro nel lessico (verde → verda?): sotto la soglia di default
+CONF_RULE_GUESS = 0.6
+
+# Suffissi che identificano la forma singolare con buona affidabilità
+_RELIABLE_SUFFIXES = ('cie', 'gie', 'che', 'ghe', 'ii', 'ie', 'ici', 'ori', 'oni', 'ali', 'ili', 'anti', 'enti')
+
+# Il lessico viene ricostruito quando cambiano i prodotti (generazione dell'indice
+# prodotti) e comunque al più ogni N secondi (modifiche fatte senza passare dall'ORM)
+LEXICON_TTL = 300
+
+_TOKEN_RE = re.compile(r"[a-z0-9àèéìòóù]+")
+
+_lexicons = {}
+_lexicon_lock = threading.Lock()
+
+
+def _tokens(text):
+    text = (text or '').lower().replace("'", ' ').replace("’", ' ')
+    return _TOKEN_RE.findall(text)
+
+
+def singularize(word, lexicon=frozenset()):
+    """
+    Singolare di una parola italiana.
+
+    Returns:
+        tuple: (singolare, confidenza)
+    """
+    if word in EXCEPTIONS:
+        return EXCEPTIONS[word], CONF_EXCEPTION
+    if word in lexicon:
+        return word, CONF_LEXICON
+    # Numeri, sigle, parole straniere (finale consonante) e parole accentate sono invarianti
+    if len(word) <= 3 or word.isdigit() or word[-1] not in 'aeio':
+        return word, CONF_INVARIANT
+    if word.endswith(('o', 'a')):
+        return word, CONF_INVARIANT
+    if word.endswith('e') and word.endswith(_SINGULAR_E_SUFFIXES):
+        return word, CONF_RULE
+
+    for suffix, replacements in _SUFFIX_RULES:
+        if not word.endswith(suffix):
+            continue
+        stem = word[:-len(suffix)]
+        candidates = [stem + r for r in replacements]
+        for candidate in candidates:
+            if candidate in lexicon:
+                return candidate, CONF_LEXICON
+        if suffix in ('e', 'i'):
+            confidence = CONF_RULE_GUESS if len(candidates) == 1 else CONF_RULE_AMBIGUOUS
+        elif len(candidates) == 1 or suffix in _RELIABLE_SUFFIXES:
+            confidence = CONF_RULE
+        else:
+            confidence = CONF_RULE_AMBIGUOUS
+        return candidates[0], confidence
+
+    return word, CONF_RULE_AMBIGUOUS
+
+
+def normalize_term(term, lexicon=frozenset()):
+    """
+    Normalizza un termine di ricerca prodotto.
+
+    Esempi:
+        'i Cestini Rossi'     → ('cestino rosso', ...)
+        '5 armadi metallici'  → ('armadio metallico', ...)
+
+    Returns:
+        tuple: (termine normalizzato, confidenza minima tra le parole)
+    """
+    words = []
+    confidence = 1.0
+    for token in _tokens(term):
+        if token in STOPWORDS or token.isdigit():
+            continue
+        singular, conf = singularize(token, lexicon)
+        words.append(singular)
+        confidence = min(confidence, conf)
+
+    if not words:
+        return (term or '').strip().lower(), 0.0
+    return ' '.join(words), confidence
+
+
+def get_lexicon(env):
+    """
+    Lessico (set di parole) dei nomi prodotto del database corrente.
+
+    Costruito alla prima richiesta e tenuto in memoria per worker; ricostruito
+    quando avanza la generazione dell'indice prodotti (creazione, rinomina,
+    archiviazione o eliminazione di prodotti e template, in qualsiasi worker)
+    o dopo LEXICON_TTL secondi.
+    """
+    dbname = env.cr.dbname
+    generation = current_generation(env.cr)
+
+    def fresh(entry):
+        return entry and entry['generation'] == generation and time.time() - entry['built_at'] < LEXICON_TTL
+
+    entry = _lexicons.get(dbname)
+    if fresh(entry):
+        return entry['words']
+
+    with _lexicon_lock:
+        entry = _lexicons.get(dbname)
+        if fresh(entry):
+            return entry['words']
+
+        started = time.time()
+        words = set()
+        # I nomi sono jsonb tradotti: prendo tutte le lingue
+        env.cr.execute("""
+            SELECT DISTINCT value
+              FROM product_template pt, jsonb_each_text(pt.name)
+             WHERE pt.active
+        """)
+        for (name,) in env.cr.fetchall():
+            words.update(t for t in _tokens(name) if t not in STOPWORDS)
+        words = frozenset(words)
+        _lexicons[dbname] = {'words': words, 'built_at': time.time(), 'generation': generation}
+        _logger.info(f"📚 Lessico prodotti costruito: {len(words)} parole in {(time.time() - started) * 1000:.1f}ms")
+        return words
@@ -0,0 +1,78 @@
+from odoo import models, api
+import logging
+
+from .function_cache import mark_function_cache_dirty
+from .product_index import _fetch_rows, apply_changes, bump_generation, create_generation_sequence, has_local_index
+
+_logger = logging.getLogger(__name__)
+
+# Campi che entrano nell'indice prodotti in memoria
+INDEXED_PRODUCT_FIELDS = {'active', 'default_code', 'barcode', 'name', 'product_tmpl_id'}
+
+# Chiave in cr.precommit.data degli id prodotto modificati nella transazione
+_PRECOMMIT_KEY = 'ai_livebot.product_index'
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    def init(self):
+        super().init()
+        create_generation_sequence(self.env.cr)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        products._ai_index_touch()
+        mark_function_cache_dirty(self.env)
+        return products
+
+    def write(self, vals):
+        res = super().write(vals)
+        if INDEXED_PRODUCT_FIELDS.intersection(vals):
+            self._ai_index_touch()
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        touched = self.browse(self.ids)
+        res = super().unlink()
+        touched._ai_index_touch()
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def _ai_index_touch(self):
+        """
+        Registra i prodotti modificati: al commit la generazione dell'indice
+        avanza (gli altri worker lo ricostruiscono) e l'indice locale, se
+        esiste, viene aggiornato in modo incrementale.
+        """
+        if not self.ids:
+            return
+        precommit = self.env.cr.precommit
+        if _PRECOMMIT_KEY not in precommit.data:
+            precommit.data[_PRECOMMIT_KEY] = set()
+            precommit.add(self._ai_index_precommit)
+        precommit.data[_PRECOMMIT_KEY].update(self.ids)
+
+    @api.model
+    def _ai_index_precommit(self):
+        product_ids = self.env.cr.precommit.data.pop(_PRECOMMIT_KEY, set())
+        if not product_ids:
+            return
+        env = self.env
+        cr = env.cr
+        # Righe aggiornate lette solo se questo worker ha un indice da aggiornare
+        rows = removed_ids = None
+        if has_local_index(cr.dbname):
+            rows = _fetch_rows(cr, product_ids)
+            removed_ids = product_ids - {row[0] for row in rows}
+
+        def update_index():
+            # Dopo il commit: prima gli altri worker ricostruirebbero con i dati vecchi
+            generation = bump_generation(cr)
+            if rows is not None:
+                apply_changes(env, rows, removed_ids, generation)
+
+        cr.postcommit.add(update_index)
+        _logger.info(f"🗂️ Indice prodotti: {len(product_ids)} prodotti modificati")
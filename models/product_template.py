@@ -0,0 +1,76 @@
+from odoo import models, api
+import logging
+import time
+
+from .function_cache import mark_function_cache_dirty
+
+_logger = logging.getLogger(__name__)
+
+# Indice GIN trigram sui nomi prodotto (tutte le traduzioni del campo jsonb)
+TRIGRAM_INDEX_NAME = 'product_template_name_ai_trgm_idx'
+TRIGRAM_NAME_EXPRESSION = "(jsonb_path_query_array(pt.name, '$.*')::text)"
+
+# Disponibilità di pg_trgm per database: {dbname: (disponibile, verificata_il)}
+# Riverificata dopo TRIGRAM_PROBE_TTL secondi: un CREATE EXTENSION / DROP fatto
+# da un altro worker o a mano viene visto senza riavviare
+_trigram_available = {}
+TRIGRAM_PROBE_TTL = 300
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def init(self):
+        """
+        Installa pg_trgm (se l'utente DB ne ha i permessi) e crea l'indice GIN
+        trigram usato dalla ricerca prodotti in modalità 'trigram'.
+        """
+        super().init()
+        cr = self.env.cr
+        try:
+            with cr.savepoint():
+                cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception as e:
+            _logger.warning(f"⚠️ Estensione pg_trgm non installabile ({e}) - ricerca trigram disabilitata")
+            return
+
+        cr.execute(f"""
+            CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME}
+                ON product_template
+             USING gin ((jsonb_path_query_array(name, '$.*')::text) gin_trgm_ops)
+        """)
+        _trigram_available.pop(cr.dbname, None)
+        _logger.info(f"🔎 Indice trigram {TRIGRAM_INDEX_NAME} pronto")
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'name', 'active', 'type'}.intersection(vals):
+            self.with_context(active_test=False).product_variant_ids._ai_index_touch()
+        # Nome, prezzo di listino, tipo, attivo: cambiano i risultati delle funzioni di lettura
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        variants = self.with_context(active_test=False).product_variant_ids
+        res = super().unlink()
+        variants._ai_index_touch()
+        mark_function_cache_dirty(self.env)
+        return res
+
+    @api.model
+    def _has_trigram_index(self):
+        """True se pg_trgm e l'indice trigram sui nomi sono presenti nel database"""
+        dbname = self.env.cr.dbname
+        entry = _trigram_available.get(dbname)
+        if entry is None or time.time() - entry[1] >= TRIGRAM_PROBE_TTL:
+            self.env.cr.execute("""
+                SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')
+                   AND EXISTS(SELECT 1 FROM pg_indexes WHERE indexname = %s)
+            """, [TRIGRAM_INDEX_NAME])
+            entry = _trigram_available[dbname] = (bool(self.env.cr.fetchone()[0]), time.time())
+        return entry[0]
+
+    @api.model
+    def _trigram_name_expression(self):
+        """Espressione SQL indicizzata (alias `pt` per product_template)"""
+        return TRIGRAM_NAME_EXPRESSION
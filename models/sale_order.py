@@ -0,0 +1,75 @@
+from odoo import models, api
+import logging
+
+from .ai_sales_daily_rollup import CONFIRMED_STATES
+from .function_cache import mark_function_cache_dirty
+
+_logger = logging.getLogger(__name__)
+
+# Campi dell'ordine che cambiano le righe del rollup vendite
+ROLLUP_ORDER_FIELDS = {'state', 'date_order', 'partner_id', 'company_id', 'order_line', 'amount_total', 'amount_untaxed'}
+# Campi della riga ordine che cambiano le righe del rollup vendite
+ROLLUP_LINE_FIELDS = {'product_id', 'product_uom_qty', 'price_unit', 'discount', 'tax_id', 'display_type', 'order_id'}
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        orders._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return orders
+
+    def write(self, vals):
+        relevant = ROLLUP_ORDER_FIELDS.intersection(vals)
+        if relevant:
+            # Giorno/stato prima della modifica (es. ordine annullato o spostato di data)
+            self._ai_rollup_touch()
+        res = super().write(vals)
+        if relevant:
+            self._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        self._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return super().unlink()
+
+    def _ai_rollup_touch(self):
+        """Segna da ricalcolare i giorni degli ordini confermati (solo quelli contano nel rollup)."""
+        days = {
+            order.date_order.date()
+            for order in self
+            if order.date_order and order.state in CONFIRMED_STATES
+        }
+        if days:
+            self.env['ai.sales.daily.rollup']._mark_dirty(days)
+
+
+class SaleOrderLine(models.Model):
+    _inherit = 'sale.order.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.order_id._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return lines
+
+    def write(self, vals):
+        relevant = ROLLUP_LINE_FIELDS.intersection(vals)
+        if relevant and 'order_id' in vals:
+            self.order_id._ai_rollup_touch()
+        res = super().write(vals)
+        if relevant:
+            self.order_id._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        self.order_id._ai_rollup_touch()
+        mark_function_cache_dirty(self.env)
+        return super().unlink()
@@ -0,0 +1,41 @@
+from odoo import models, api
+
+from .function_cache import mark_function_cache_dirty
+
+
+class StockPicking(models.Model):
+    _inherit = 'stock.picking'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        pickings = super().create(vals_list)
+        mark_function_cache_dirty(self.env)
+        return pickings
+
+    def write(self, vals):
+        res = super().write(vals)
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        mark_function_cache_dirty(self.env)
+        return super().unlink()
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super().create(vals_list)
+        mark_function_cache_dirty(self.env)
+        return moves
+
+    def write(self, vals):
+        res = super().write(vals)
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        mark_function_cache_dirty(self.env)
+        return super().unlink()
@@ -0,0 +1,22 @@
+from odoo import models, api
+
+from .function_cache import mark_function_cache_dirty
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        mark_function_cache_dirty(self.env)
+        return quants
+
+    def write(self, vals):
+        res = super().write(vals)
+        mark_function_cache_dirty(self.env)
+        return res
+
+    def unlink(self):
+        mark_function_cache_dirty(self.env)
+        return super().unlink()
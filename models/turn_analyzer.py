@@ -0,0 +1,192 @@
+"""
+Analisi del turno utente in UNA sola chiamata LLM.
+
+Prima del routing, un turno poteva richiedere fino a cinque classificatori
+LLM in serie (`_is_cancellation`, `_wants_full_catalog`,
+`_normalize_product_search_term`, `_llm_when_to_datetime`,
+`_classify_order_intent`). Ora il primo helper che ne ha bisogno calcola
+un unico verdetto JSON per il messaggio del turno e gli altri lo leggono
+dallo scope del turno (thread-local).
+
+Fuori da uno scope, o se l'analisi fallisce, gli helper tornano alla
+loro chiamata LLM dedicata.
+"""
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Verdetto non ancora calcolato (distinto da None = analisi fallita)
+_PENDING = object()
+
+VALID_INTENTS = ('create', 'confirm', 'other')
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _same_text(a, b):
+    return (a or '').strip().casefold() == (b or '').strip().casefold()
+
+
+@contextmanager
+def turn_scope(user_message, analyze):
+    """
+    Apre lo scope del turno per `user_message`.
+
+    Args:
+        analyze: callable senza argomenti che restituisce il verdetto (dict)
+            o None; viene invocato al massimo una volta, solo se un helper
+            chiede il verdetto.
+    """
+    stack = _stack()
+    # Scope annidato sullo stesso messaggio (es. _reply_with_ai → _get_ai_response): riuso
+    if stack and _same_text(stack[-1]['message'], user_message):
+        yield stack[-1]
+        return
+
+    scope = {'message': user_message, 'analyze': analyze, 'verdict': _PENDING, 'memo': {}}
+    stack.append(scope)
+    try:
+        yield scope
+    finally:
+        stack.pop()
+
+
+def get_turn_verdict(text=None):
+    """
+    Verdetto del turno corrente, calcolato alla prima richiesta.
+
+    Args:
+        text: se indicato, il verdetto viene restituito solo se `text` è il
+            messaggio del turno (gli helper chiamati su altri testi non
+            devono usare il verdetto)
+
+    Returns:
+        dict | None
+    """
+    stack = _stack()
+    if not stack:
+        return None
+    scope = stack[-1]
+    if text is not None and not _same_text(text, scope['message']):
+        return None
+
+    if scope['verdict'] is _PENDING:
+        try:
+            scope['verdict'] = coerce_verdict(scope['analyze']())
+        except Exception as e:
+            _logger.warning(f"⚠️ Analisi turno fallita: {e} - uso i classificatori dedicati")
+            scope['verdict'] = None
+    return scope['verdict']
+
+
+def turn_memo():
+    """
+    Dizionario di appoggio del turno corrente (None fuori da uno scope),
+    es. risultati di funzioni eseguite in anticipo durante lo streaming.
+    """
+    stack = _stack()
+    return stack[-1]['memo'] if stack else None
+
+
+def current_scope():
+    """Scope del turno corrente (None fuori da uno scope)."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def adopted_scope(scope):
+    """
+    Riapre `scope` (ottenuto con `current_scope` nel thread del turno) in un
+    altro thread, es. i thread del pool di `function_executor`.
+
+    Il verdetto va calcolato prima nel thread del turno: qui `analyze` non
+    viene mai invocato (userebbe il cursore del turno da un altro thread),
+    un verdetto mancante vale come analisi fallita. Il memo resta del
+    thread del turno.
+    """
+    if scope is None:
+        yield None
+        return
+
+    verdict = scope['verdict']
+    thread_scope = {
+        'message': scope['message'],
+        'analyze': lambda: None,
+        'verdict': None if verdict is _PENDING else verdict,
+        'memo': {},
+    }
+    stack = _stack()
+    stack.append(thread_scope)
+    try:
+        yield thread_scope
+    finally:
+        stack.pop()
+
+
+def lookup_search_term(verdict, term):
+    """Termine normalizzato dal verdetto per `term` (None se non presente)."""
+    if not verdict:
+        return None
+    return verdict['search_terms'].get((term or '').strip().casefold())
+
+
+def coerce_verdict(data):
+    """Valida e normalizza il JSON restituito dall'LLM (None se non utilizzabile)."""
+    if not isinstance(data, dict):
+        return None
+
+    intent = str(data.get('intent') or 'other').strip().lower()
+    if intent not in VALID_INTENTS:
+        intent = 'other'
+
+    search_terms = {}
+    for item in data.get('search_terms') or []:
+        if not isinstance(item, dict):
+            continue
+        raw = str(item.get('raw') or '').strip().casefold()
+        normalized = str(item.get('normalized') or '').strip().strip('"\'').lower()
+        if raw and normalized:
+            search_terms[raw] = normalized
+
+    when = data.get('when')
+    if not isinstance(when, dict):
+        when = {}
+    when = {k: v for k, v in when.items() if k in ('absolute', 'relative') and isinstance(v, str) and v}
+
+    return {
+        'intent': intent,
+        'cancel_gate': data.get('cancel_gate') is True,
+        'full_catalog': data.get('full_catalog') is True,
+        'search_terms': search_terms,
+        'when': when,
+    }
+
+
+def turn_scoped(method):
+    """
+    Decoratore per i punti di ingresso di un turno `(self, user_message, [channel])`.
+
+    Il canale è il primo argomento posizionale dopo il messaggio, se presente,
+    altrimenti `self` (metodi di `discuss.channel`).
+    """
+    @functools.wraps(method)
+    def wrapper(self, user_message, *args, **kwargs):
+        channel = kwargs.get('channel') or (args[0] if args else self)
+
+        def analyze():
+            return channel._analyze_turn(user_message)
+
+        with turn_scope(user_message, analyze):
+            return method(self, user_message, *args, **kwargs)
+    return wrapper
@@ -1,13 +1,46 @@
-from odoo import models, api
+from odoo import models, fields, api
+from odoo.fields import Command
+from odoo.osv import expression
+from odoo.tools import escape_psql
 import json
 import logging
 
+from .ai_functions import ai_function, call_in_savepoint
+from .function_cache import create_generation_sequence
+from .product_index import get_product_index
+
 _logger = logging.getLogger(__name__)
 
+# Soglia minima di word_similarity (0-1) per la ricerca prodotti trigram
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+
+# Chiavi restituite di default nei risultati prodotto
+PRODUCT_RESULT_FIELDS = ('id', 'name', 'detailed_type', 'qty_available', 'list_price')
+# Chiave risultato → campo product.product letto (None = id / calcolato a parte)
+PRODUCT_READ_FIELDS = {
+    'id': None,
+    'name': 'name',
+    'detailed_type': 'type',
+    'qty_available': None,
+    'list_price': 'lst_price',
+}
+
 class WarehouseOperations(models.AbstractModel):
     _name = 'warehouse.operations'
     _description = 'Warehouse Operations for AI'
+
+    def init(self):
+        super().init()
+        # Generazione della cache risultati delle funzioni AI (vedi function_cache)
+        create_generation_sequence(self.env.cr)
     
+    @ai_function(
+        description="Ottiene informazioni sullo stock di un prodotto specifico",
+        params={
+            'product_name': ('string', "Nome del prodotto da cercare"),
+        },
+        read_only=True, cache=30,
+    )
     @api.model
     def get_stock_info(self, product_name=None, product_id=None):
         """Ottiene informazioni sullo stock di un prodotto"""
@@ -32,11 +65,24 @@ class WarehouseOperations(models.AbstractModel):
             "outgoing_qty": product.outgoing_qty,
         }
     
+    @ai_function(
+        description="Cerca prodotti nel catalogo. Supporta filtro per tipo: beni fisici, servizi, combo",
+        params={
+            'search_term': ('string', "Termine di ricerca (opzionale)"),
+            'limit': ('integer', "Numero massimo risultati (default 50)"),
+            'product_type': ('string', "Filtra per tipo (opzionale): 'product' (beni fisici/goods), 'service' (servizio), 'combo' (prodotto combo), None (tutti i tipi)"),
+        },
+        read_only=True, cache=60, handler='_ai_search_products',
+    )
     @api.model
     def search_products(self, search_term=None, limit=50, product_type=None):
         """
         Cerca prodotti nel catalogo con ricerca FUZZY multi-pattern intelligente.
         
+        Con motore 'trigram' (ai.config) usa una sola query pg_trgm ordinata per
+        similarità, con motore 'memory' l'indice prodotti del worker; altrimenti,
+        o se pg_trgm non è disponibile:
+
         STRATEGIA DI RICERCA (in ordine):
         1. Match esatto (case-insensitive)
         2. Match tutte le parole chiave (AND con ilike)
@@ -54,31 +100,8 @@ class WarehouseOperations(models.AbstractModel):
         Product = self.env['product.product']
 
         # Costruisci dominio base per tipo prodotto
-        base_domain = []
-        
-        if product_type:
-            pt = (product_type or '').strip().lower()
-            type_map = {
-                'service': 'service',
-                'servizio': 'service',
-                'product': 'product',
-                'prodotto': 'product',
-                'goods': 'product',
-                'storable': 'product',
-                'stoccabile': 'product',
-                'consu': 'product',        
-                'consumable': 'product',
-                'consumabile': 'product',
-                'combo': 'combo',
-            }
-            dt = type_map.get(pt)
-            if dt:
-                if dt == 'product':
-                    base_domain.append(('product_tmpl_id.type', 'in', ['product', 'consu']))
-                else:
-                    base_domain.append(('product_tmpl_id.type', '=', dt))
-            else:
-                _logger.warning("Tipo prodotto non valido: %s", product_type)
+        type_values = self._product_type_values(product_type)
+        base_domain = [('product_tmpl_id.type', 'in', type_values)] if type_values else []
 
         # Se non c'è termine di ricerca, ritorna tutti con filtro tipo
         if not search_term:
@@ -86,8 +109,18 @@ class WarehouseOperations(models.AbstractModel):
             _logger.info("Prodotti trovati: %d (nessun filtro nome)", len(products))
             return self._format_product_results(products)
         
-        # RICERCA MULTI-PATTERN
         search_term_clean = search_term.strip()
+
+        # MOTORE TRIGRAM / MEMORIA: ricerca indicizzata ordinata per rilevanza
+        engine = self._get_product_search_engine()
+        if engine == 'trigram':
+            ranked = self._search_products_trigram(search_term_clean, limit, type_values)
+            if ranked is not None:
+                return ranked
+        elif engine == 'memory':
+            return self._search_products_memory(search_term_clean, limit, type_values)
+
+        # RICERCA MULTI-PATTERN
         
         # PATTERN 1: Match esatto (case-insensitive)
         domain_exact = base_domain + [('name', '=ilike', search_term_clean)]
@@ -139,7 +172,7 @@ class WarehouseOperations(models.AbstractModel):
                 
                 # Ordina per score decrescente
                 scored_products.sort(key=lambda x: x[0], reverse=True)
-                best_products = [p for _, p in scored_products[:limit]]
+                best_products = Product.browse([p.id for _, p in scored_products[:limit]])
                 
                 _logger.info("✅ Match PARZIALE parole: %s → %d prodotti (top score: %d)", 
                             words, len(best_products), scored_products[0][0] if scored_products else 0)
@@ -152,16 +185,320 @@ class WarehouseOperations(models.AbstractModel):
         _logger.info("⚠️ Fallback ilike: '%s' → %d prodotti", search_term_clean, len(products))
         return self._format_product_results(products)
     
-    def _format_product_results(self, products):
-        """Helper per formattare risultati prodotti"""
-        return [{
-            "id": p.id,
-            "name": p.name,
-            "detailed_type": p.product_tmpl_id.type,
-            "qty_available": p.qty_available,
-            "list_price": (getattr(p, 'lst_price', False) or p.product_tmpl_id.list_price),
-        } for p in products]
+    @api.model
+    def search_products_batch(self, terms, limit=5, product_type=None, fields=None, options=None):
+        """
+        Cerca più termini in UN solo passaggio (es. righe di un ordine multi-prodotto).
+
+        A seconda del motore: una query pg_trgm LATERAL per tutti i termini, una
+        scansione dell'indice in memoria, oppure le query ORM per tutti i termini
+        con ranking per termine in Python. I termini con opzioni diverse
+        (`options`) vengono cercati in gruppi separati. La formattazione avviene
+        una volta sola sull'unione dei prodotti trovati.
+
+        Args:
+            terms (list): termini di ricerca
+            limit (int): massimo risultati per termine
+            product_type (str): filtra per tipo prodotto (opzionale)
+            fields (list): chiavi da restituire (default PRODUCT_RESULT_FIELDS, "id" sempre incluso)
+            options (dict): {termine: {'limit': int, 'product_type': str}} per i
+                termini con limite o tipo diversi da quelli comuni
+
+        Returns:
+            Dict[str, List[dict]]: risultati per termine, stesso formato di search_products
+            (con "score"), ordinati per rilevanza
+        """
+        terms = [t.strip() for t in dict.fromkeys(terms or []) if t and t.strip()]
+        if not terms:
+            return {}
+
+        options = {(term or '').strip(): opts for term, opts in (options or {}).items() if opts}
+        groups = {}
+        for term in terms:
+            opts = options.get(term) or {}
+            try:
+                term_limit = int(opts.get('limit') or limit)
+            except (TypeError, ValueError):
+                term_limit = limit
+            term_type = opts.get('product_type') or product_type
+            groups.setdefault((term_limit, term_type), []).append(term)
+
+        engine = self._get_product_search_engine()
+        ranked = {}
+        for (term_limit, term_type), group in groups.items():
+            ranked.update(self._rank_products(engine, group, term_limit, self._product_type_values(term_type)))
+
+        # Formattazione unica sull'unione dei prodotti, poi raggruppamento per termine
+        all_ranked = {pid: score for pairs in ranked.values() for pid, score in pairs}
+        if fields and 'id' not in fields:
+            fields = ['id'] + list(fields)
+        formatted = {r['id']: r for r in self._format_ranked_products(list(all_ranked.items()), fields=fields)}
+        results = {}
+        for term in terms:
+            results[term] = [
+                dict(formatted[pid], score=round(score, 3))
+                for pid, score in ranked.get(term, [])
+                if pid in formatted
+            ]
+        _logger.info("✅ Ricerca batch (%s): %d termini → %s", engine, len(terms),
+                     {t: len(r) for t, r in results.items()})
+        return results
+
+    @api.model
+    def _rank_products(self, engine, terms, limit, type_values=None):
+        """Ranking {termine: [(product_id, score)]} con il motore configurato."""
+        ranked = None
+        if engine == 'trigram':
+            ranked = self._rank_products_trigram(terms, limit, type_values)
+            missing = [term for term in terms if not (ranked or {}).get(term)]
+            if ranked is not None and missing:
+                # Nessun match trigram (es. termine troppo corto per la soglia): ricerca ORM
+                ranked.update(self._rank_products_orm(missing, limit, type_values))
+        elif engine == 'memory':
+            index = get_product_index(self.env)
+            ranked = {term: index.search(term, limit, type_values) for term in terms}
+        if ranked is None:
+            ranked = self._rank_products_orm(terms, limit, type_values)
+        return ranked
+
+    @api.model
+    def _product_type_values(self, product_type):
+        """Valori di product.template.type per il filtro product_type dell'AI (None = nessun filtro)"""
+        if not product_type:
+            return None
+        pt = (product_type or '').strip().lower()
+        type_map = {
+            'service': 'service',
+            'servizio': 'service',
+            'product': 'product',
+            'prodotto': 'product',
+            'goods': 'product',
+            'storable': 'product',
+            'stoccabile': 'product',
+            'consu': 'product',        
+            'consumable': 'product',
+            'consumabile': 'product',
+            'combo': 'combo',
+        }
+        dt = type_map.get(pt)
+        if not dt:
+            _logger.warning("Tipo prodotto non valido: %s", product_type)
+            return None
+        return ['product', 'consu'] if dt == 'product' else [dt]
+
+    @api.model
+    def _rank_products_trigram(self, terms, limit, type_values=None):
+        """
+        Top-N per termine con una sola query pg_trgm (LATERAL sull'indice GIN).
+
+        Returns:
+            Dict[str, List[tuple]] | None: {termine: [(product_id, score)]},
+            None se pg_trgm non è disponibile
+        """
+        if not self.env['product.template']._has_trigram_index():
+            return None
+
+        name_expr = self.env['product.template']._trigram_name_expression()
+        type_clause = "AND pt.type IN %(types)s" if type_values else ""
+        # Soglia locale alla transazione: l'operatore <% resta indicizzato
+        self.env.cr.execute(
+            "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+            [str(TRIGRAM_SIMILARITY_THRESHOLD)],
+        )
+        self.env.cr.execute(f"""
+            SELECT q.ord, r.id, r.score
+              FROM unnest(%(terms)s::text[], %(patterns)s::text[]) WITH ORDINALITY AS q(term, pattern, ord)
+        CROSS JOIN LATERAL (
+                SELECT pp.id, word_similarity(q.term, {name_expr}) AS score
+                  FROM product_product pp
+                  JOIN product_template pt ON pt.id = pp.product_tmpl_id
+                 WHERE pp.active AND pt.active
+                   AND (q.term <%% {name_expr} OR {name_expr} ILIKE q.pattern)
+                   {type_clause}
+              ORDER BY score DESC, pt.name->>'en_US', pp.id
+                 LIMIT %(limit)s
+            ) r
+          ORDER BY q.ord, r.score DESC
+        """, {
+            'terms': list(terms),
+            # % e _ nel termine sono caratteri letterali, non jolly
+            'patterns': [f"%{escape_psql(term)}%" for term in terms],
+            'types': tuple(type_values or ()),
+            'limit': limit,
+        })
+        ranked = {term: [] for term in terms}
+        for ord_, product_id, score in self.env.cr.fetchall():
+            ranked[terms[ord_ - 1]].append((product_id, score))
+        return ranked
 
+    @api.model
+    def _rank_products_orm(self, terms, limit, type_values=None):
+        """
+        Ranking per termine con le query ORM di tutti i termini: match esatti,
+        match per prefisso e OR di tutte le parole, poi per ogni termine
+        esatto > prefisso > parole trovate > nome più corto.
+
+        Esatti e prefissi sono cercati a parte: il limite sui candidati per
+        parola non può escluderli, qualunque sia la dimensione del catalogo.
+
+        Returns:
+            Dict[str, List[tuple]]: {termine: [(product_id, score)]}
+        """
+        Product = self.env['product.product']
+        words_by_term = {
+            term: [w.lower() for w in term.split() if len(w) > 2] or [term.lower()]
+            for term in terms
+        }
+        all_words = sorted({w for words in words_by_term.values() for w in words})
+        type_domain = [('product_tmpl_id.type', 'in', type_values)] if type_values else []
+        pool_size = max(200, limit * len(terms) * 10)
+
+        exact = Product.search(type_domain + expression.OR(
+            [[('name', '=ilike', escape_psql(term))] for term in terms]
+        ), limit=pool_size)
+        prefix = Product.search(type_domain + expression.OR(
+            [[('name', '=ilike', escape_psql(term) + '%')] for term in terms]
+        ), limit=pool_size)
+        by_word = Product.search(type_domain + expression.OR(
+            [[('name', 'ilike', escape_psql(w))] for w in all_words]
+        ), limit=pool_size)
+        names = [(p.id, (p.name or '').lower()) for p in exact | prefix | by_word]
+
+        ranked = {}
+        for term, words in words_by_term.items():
+            term_lower = term.lower()
+            scored = []
+            for product_id, name in names:
+                matched = sum(1 for w in words if w in name)
+                if not matched:
+                    continue
+                exact_match = name == term_lower
+                key = (exact_match, name.startswith(term_lower), matched, -len(name))
+                scored.append((key, product_id, 1.0 if exact_match else matched / len(words)))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            ranked[term] = [(product_id, score) for _key, product_id, score in scored[:limit]]
+        return ranked
+
+    @api.model
+    def _get_product_search_engine(self):
+        """Motore di ricerca prodotti configurato ('orm' se nessuna configurazione attiva)"""
+        config = self.env['ai.config'].sudo().search([('active', '=', True)], limit=1)
+        return config.product_search_engine or 'orm'
+
+    @api.model
+    def _search_products_trigram(self, search_term, limit, type_values=None):
+        """
+        Ricerca fuzzy con pg_trgm: UNA query che usa l'indice GIN trigram sui nomi
+        (tutte le traduzioni) e restituisce i top-N ordinati per word_similarity.
+
+        Returns:
+            List[dict] | None: risultati con "score", None se pg_trgm non è disponibile
+            o non trova nulla (il chiamante usa la ricerca ORM multi-pattern)
+        """
+        ranked = self._rank_products_trigram([search_term], limit, type_values)
+        if ranked is None:
+            return None
+        if not ranked[search_term]:
+            _logger.info("ℹ️ Nessun match TRIGRAM per '%s' - uso la ricerca ORM", search_term)
+            return None
+
+        results = self._format_ranked_products(ranked[search_term])
+        _logger.info("✅ Match TRIGRAM: '%s' → %d prodotti (top score: %s)",
+                     search_term, len(results), results[0]['score'] if results else 0)
+        return results
+
+    @api.model
+    def _search_products_memory(self, search_term, limit, type_values=None):
+        """
+        Ricerca sull'indice prodotti in memoria del worker (nomi, codici, barcode):
+        parole trovate, poi qualità del match (esatto, prefisso, distanza di edit).
+        """
+        index = get_product_index(self.env)
+        results = self._format_ranked_products(index.search(search_term, limit, type_values))
+        _logger.info("✅ Match INDICE: '%s' → %d prodotti (top score: %s)",
+                     search_term, len(results), results[0]['score'] if results else 0)
+        return results
+
+    @api.model
+    def _format_ranked_products(self, ranked, fields=None):
+        """
+        Formatta [(product_id, score)] mantenendo l'ordine di rilevanza.
+        Le regole di accesso (multi-company) sono applicate dall'ORM sugli id trovati.
+        """
+        scores = dict(ranked)
+        position = {pid: i for i, (pid, _score) in enumerate(ranked)}
+        allowed = self.env['product.product'].search([('id', 'in', list(scores))])
+        products = allowed.sorted(key=lambda p: position[p.id])
+
+        results = self._format_product_results(products, fields=fields)
+        for result in results:
+            result['score'] = round(scores[result['id']], 3)
+        return results
+
+    @api.model
+    def _format_product_results(self, products, fields=None):
+        """
+        Helper per formattare risultati prodotti in blocco.
+
+        Una sola read per i campi semplici e UNA query raggruppata sui quant per
+        le quantità (invece del compute di qty_available record per record):
+        il numero di query non dipende dal numero di risultati.
+
+        Args:
+            fields: chiavi da restituire (default PRODUCT_RESULT_FIELDS); se
+                qty_available non è richiesto la query sui quant non viene fatta
+        """
+        fields = [f for f in (fields or PRODUCT_RESULT_FIELDS) if f in PRODUCT_RESULT_FIELDS]
+        if not products:
+            return []
+
+        read_fields = [PRODUCT_READ_FIELDS[f] for f in fields if PRODUCT_READ_FIELDS.get(f)]
+        rows = products.read(read_fields) if read_fields else [{'id': pid} for pid in products.ids]
+        quantities = self._get_products_qty_available(products) if 'qty_available' in fields else {}
+        # Prezzo di variante assente: prezzo di listino del template (come prima della lettura in blocco)
+        template_prices = {}
+        if 'list_price' in fields:
+            missing = products.browse([row['id'] for row in rows if not row['lst_price']])
+            template_prices = {p.id: p.product_tmpl_id.list_price for p in missing}
+
+        results = []
+        for row in rows:
+            result = {}
+            for field in fields:
+                if field == 'qty_available':
+                    result[field] = quantities.get(row['id'], 0.0)
+                elif field == 'list_price':
+                    result[field] = row['lst_price'] or template_prices.get(row['id'], row['lst_price'])
+                else:
+                    result[field] = row[PRODUCT_READ_FIELDS[field] or 'id']
+            results.append(result)
+        return results
+
+    @api.model
+    def _get_products_qty_available(self, products):
+        """
+        Quantità disponibili (come qty_available) per tutti i prodotti con UNA
+        query raggruppata su stock.quant, nelle ubicazioni del contesto corrente.
+
+        Returns:
+            Dict[int, float]: {product_id: quantità}
+        """
+        domain_quant_loc, _domain_move_in, _domain_move_out = products._get_domain_locations()
+        groups = self.env['stock.quant']._read_group(
+            [('product_id', 'in', products.ids)] + domain_quant_loc,
+            ['product_id'],
+            ['quantity:sum'],
+        )
+        return {product.id: quantity for product, quantity in groups}
+
+    @ai_function(
+        description="Ottiene ordini in sospeso. Può filtrare per tipo: ricezioni (incoming) o consegne (outgoing)",
+        params={
+            'order_type': ('string', "Opzionale: 'incoming' per ricezioni, 'outgoing' per consegne. Se omesso mostra tutti"),
+            'limit': ('integer', "Numero massimo risultati (default 10)"),
+        },
+        read_only=True, cache=30,
+    )
     @api.model
     def get_pending_orders(self, order_type=None, limit=10):
         """
@@ -188,6 +525,14 @@ class WarehouseOperations(models.AbstractModel):
 
         return [fmt(p) for p in pickings]
     
+    @ai_function(
+        description="Ottiene dettagli completi di un Delivery/Transfer, inclusi TUTTI i movimenti con move_id. USA QUESTA funzione PRIMA di update_delivery per sapere quali prodotti ci sono e i loro move_id",
+        params={
+            'picking_name': ('string', "Nome del delivery (es. 'WH/OUT/00013') OPPURE"),
+            'picking_id': ('integer', "ID numerico del picking"),
+        },
+        read_only=True, cache=30,
+    )
     @api.model
     def get_delivery_details(self, picking_name=None, picking_id=None):
         """
@@ -251,6 +596,13 @@ class WarehouseOperations(models.AbstractModel):
             "moves_count": len(moves)
         }
     
+    @ai_function(
+        description="Valida ed evade un ordine di consegna (spedizione fisica). Scarica lo stock dal magazzino",
+        params={
+            'picking_id': ('integer', "ID numerico del picking (es. 35) OPPURE"),
+            'picking_name': ('string', "Nome del delivery (es. 'WH/OUT/00035')"),
+        },
+    )
     @api.model
     def validate_delivery(self, picking_id=None, picking_name=None):
         """
@@ -327,6 +679,14 @@ class WarehouseOperations(models.AbstractModel):
         except Exception as e:
             return {"error": f"Errore durante l'evasione: {str(e)}"}
     
+    @ai_function(
+        description="Applica la scelta utente dopo tentativo di validazione quando quantità non completamente prenotate. Usa wizard nativi Odoo per gestire backorder o trasferimento immediato",
+        params={
+            'picking_id': ('integer', "ID numerico del picking (es. 35) OPPURE"),
+            'picking_name': ('string', "Nome del delivery (es. 'WH/OUT/00035')"),
+            'decision': ('string', "Scelta utente: 'backorder' (crea backorder) | 'no_backorder' (scarta residuo) | 'immediate' (trasferimento immediato)"),
+        },
+    )
     @api.model
     def process_delivery_decision(self, picking_name=None, picking_id=None, decision=None):
         """
@@ -541,6 +901,19 @@ class WarehouseOperations(models.AbstractModel):
             _logger.exception(f"Errore in process_delivery_decision per {picking.name}")
             return {"error": f"Errore durante l'elaborazione della decisione: {str(e)}"}
     
+    @ai_function(
+        description="FLUSSO STANDARD per 'ordini da evadere': crea un Sales Order e lo conferma. La conferma genera automaticamente i Delivery secondo le regole di magazzino (1/2/3 step). Assicura tracciabilità commerciale completa (preventivo→ordine→consegna→fattura) con prezzi, sconti e tasse corretti",
+        params={
+            'partner_name': ('string', "Nome del cliente",
+                             "USA: partner_name (NON customer, NON cliente)"),
+            'order_lines': ('array', "Lista righe: [{'product_id': 1, 'quantity': 5, 'price_unit': 100.0}]. price_unit è opzionale (usa listino se omesso)",
+                            "USA: order_lines:[{\"product_id\":ID,\"quantity\":QTY}] (NON products, NON items). Devi chiamare search_products PRIMA per ottenere il product_id."),
+            'confirm': ('boolean', "Opzionale (default True): se True conferma l'ordine e genera i picking automaticamente"),
+            'scheduled_date': ('string', "Opzionale: Data pianificata consegna (formato ISO: '2025-10-21' o '2025-10-21 14:00:00'). Se specificata, imposta la data del delivery"),
+        },
+        handler='_ai_request_sales_order_confirmation',
+        aliases={'customer': 'partner_name', 'cliente': 'partner_name'},
+    )
     @api.model
     def create_sales_order(self, partner_name, order_lines, confirm=True, scheduled_date=None):
         """
@@ -560,7 +933,6 @@ class WarehouseOperations(models.AbstractModel):
         Partner = self.env['res.partner']
         Product = self.env['product.product']
         SaleOrder = self.env['sale.order']
-        SaleOrderLine = self.env['sale.order.line']
 
         # Trova il cliente
         partner = Partner.search([('name', 'ilike', partner_name)], limit=1)
@@ -606,9 +978,11 @@ class WarehouseOperations(models.AbstractModel):
                 if int(l['product_id']) not in [ll.product_id.id for ll in matched_order.order_line]:
                     updates.append({'product_id': int(l['product_id']), 'quantity': l['quantity']})
 
-            # Chiama update_sales_order internamente
+            # Chiama update_sales_order internamente (savepoint: un errore non lascia scritture parziali)
             try:
-                res = self.update_sales_order(order_id=matched_order.id, order_lines_updates=updates, scheduled_date=sd)
+                res = call_in_savepoint(self.env.cr, lambda: self.update_sales_order(
+                    order_id=matched_order.id, order_lines_updates=updates, scheduled_date=sd,
+                ))
                 # Ritorna risultato dell'update con avviso di dedup
                 if isinstance(res, dict) and res.get('success'):
                     res['note'] = res.get('note', '') + ' | Usato ordine in bozza esistente (dedup).'
@@ -628,37 +1002,37 @@ class WarehouseOperations(models.AbstractModel):
         if sd:
             order_vals['commitment_date'] = sd
 
-        sale_order = SaleOrder.create(order_vals)
-
+        # Righe create insieme all'ordine: un solo ricalcolo di imposte e totali
+        products = Product.browse([int(line['product_id']) for line in order_lines])
+        existing_ids = set(products.exists().ids)
+        line_commands = []
         created_lines = []
-        for line in order_lines:
-            product = Product.browse(int(line['product_id']))
-            if not product.exists():
+        for line, product in zip(order_lines, products):
+            if product.id not in existing_ids:
                 continue
             price_unit = line.get('price_unit', product.list_price)
-            order_line = SaleOrderLine.create({
-                'order_id': sale_order.id,
+            line_commands.append(Command.create({
                 'product_id': product.id,
                 'product_uom_qty': line['quantity'],
                 'product_uom': product.uom_id.id,
                 'price_unit': price_unit,
                 'name': product.name,
-            })
+            }))
             created_lines.append({
                 'product': product.name,
                 'quantity': line['quantity'],
                 'price_unit': price_unit,
-                'subtotal': order_line.price_subtotal
             })
+        order_vals['order_line'] = line_commands
 
-        # Forza flush e invalidazione cache per avere dati freschi
-        self.env.flush_all()
-        sale_order.invalidate_recordset()
-        sale_order.order_line.invalidate_recordset()
-        self.env.cr.commit()
-        
-        # Ricarica ordine
-        sale_order = SaleOrder.browse(sale_order.id)
+        sale_order = SaleOrder.create(order_vals)
+
+        # Subtotali letti una volta sola, a righe create (stesso ordine dei comandi)
+        for line_info, order_line in zip(created_lines, sale_order.order_line.sorted('id')):
+            line_info['subtotal'] = order_line.price_subtotal
+
+        # Nessun commit: l'ordine resta nella transazione del turno (savepoint della chiamata)
+        self.env['sale.order.line'].flush_model()
 
         result = {
             "success": True,
@@ -672,6 +1046,15 @@ class WarehouseOperations(models.AbstractModel):
         }
         return result
     
+    @ai_function(
+        description="SOLO per casi ECCEZIONALI (omaggi, sostituzioni, campionature): crea un Transfer diretto senza Sales Order. ATTENZIONE: salta prezzi, condizioni commerciali e collegamento fatturazione. Per ordini commerciali normali usa create_sales_order",
+        params={
+            'partner_name': ('string', "Nome del destinatario"),
+            'product_items': ('array', "Lista prodotti: [{'product_id': 1, 'quantity': 5}]",
+                              "Usa 'product_items' invece di 'products': product_items:[{\"product_id\":ID,\"quantity\":QTY}]"),
+        },
+        aliases={'customer': 'partner_name'},
+    )
     @api.model
     def create_delivery_order(self, partner_name, product_items):
         """
@@ -734,6 +1117,14 @@ class WarehouseOperations(models.AbstractModel):
             "warning": "Questo è un movimento inventory-driven: nessuna tracciabilità commerciale (preventivo/fattura)"
         }
     
+    @ai_function(
+        description="Cerca clienti/partner per nome/email/telefono",
+        params={
+            'search_term': ('string', "Testo da cercare (es. 'Marco')"),
+            'limit': ('integer', "Numero massimo risultati (default 5)"),
+        },
+        read_only=True, cache=300,
+    )
     @api.model
     def search_partners(self, search_term=None, limit=5, is_customer=True):
         """
@@ -767,6 +1158,22 @@ class WarehouseOperations(models.AbstractModel):
             'phone': p.phone or ''
         } for p in partners]
 
+    @ai_function(
+        description="Crea un nuovo cliente (res.partner) se non esiste. Usa questo quando l'utente chiede di creare un ordine per un cliente non presente.",
+        params={
+            'name': ('string', "Nome completo del cliente (obbligatorio)"),
+            'email': ('string', "Email (opzionale)"),
+            'phone': ('string', "Telefono (opzionale)"),
+            'mobile': ('string', "Cellulare (opzionale)"),
+            'street': ('string', "Indirizzo (opzionale)"),
+            'city': ('string', "Città (opzionale)"),
+            'zip': ('string', "CAP (opzionale)"),
+            'country_code': ('string', "Codice nazione ISO-2 es. IT (opzionale)"),
+            'vat': ('string', "Partita IVA (opzionale)"),
+            'company_name': ('string', "Azienda collegata (opzionale)"),
+            'is_company': ('boolean', "True se il partner è un'azienda (default False)"),
+        },
+    )
     @api.model
     def create_partner(self, name, email=None, phone=None, mobile=None, street=None,
                        city=None, zip=None, country_code=None, vat=None,
@@ -854,6 +1261,15 @@ class WarehouseOperations(models.AbstractModel):
             "existing": False,
         }
     
+    @ai_function(
+        description="Aggiorna un Sales Order esistente (SOLO in stato draft/sent): modifica quantità, aggiungi/rimuovi righe, cambia data consegna. NON funziona su ordini già confermati. SUPPORTA product_name per ricerca automatica prodotto!",
+        params={
+            'order_name': ('string', "Nome ordine (es. 'SO042') OPPURE"),
+            'order_id': ('integer', "ID numerico dell'ordine"),
+            'order_lines_updates': ('array', "Lista modifiche: [{'line_id': 123, 'quantity': 10}, {'product_id': 25, 'quantity': 5}, {'product_name': 'sedia ufficio', 'quantity': 3}, {'line_id': 124, 'delete': True}]"),
+            'scheduled_date': ('string', "Data consegna pianificata (formato ISO: '2025-10-21' o '2025-10-21 14:00:00') - OPZIONALE"),
+        },
+    )
     @api.model
     def update_sales_order(self, order_name=None, order_id=None, order_lines_updates=None, scheduled_date=None):
         """
@@ -874,7 +1290,6 @@ class WarehouseOperations(models.AbstractModel):
             Dict con info aggiornamento
         """
         SaleOrder = self.env['sale.order']
-        SaleOrderLine = self.env['sale.order.line']
         Product = self.env['product.product']
         
         # Trova l'ordine
@@ -915,30 +1330,54 @@ class WarehouseOperations(models.AbstractModel):
                 except ValueError as e:
                     return {"error": f"Formato data non valido: {scheduled_date}. Usa 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS'"}
             
-            # Aggiorna commitment_date sull'ordine (data promessa al cliente)
-            order.write({'commitment_date': scheduled_date})
-            
-            # Aggiorna anche scheduled_date sui picking collegati (se l'ordine è confermato)
-            for picking in order.picking_ids:
-                picking.write({'scheduled_date': scheduled_date})
-        
+
         updated_lines = []
         added_lines = []
         deleted_lines = []
+
+        # Risolvi in un solo passaggio i product_name delle nuove righe
+        resolved_products = self._resolve_product_names([
+            update['product_name'] for update in order_lines_updates
+            if update.get('product_name') and not update.get('line_id') and not update.get('product_id')
+        ])
+
+        # Modifiche raccolte come comandi e applicate con un solo write sull'ordine
+        order_lines = {line.id: line for line in order.order_line}
+        line_commands = []
+        deleted_ids = set()
+        new_quantities = {}
+
+        def delete_line(line):
+            deleted_ids.add(line.id)
+            deleted_lines.append(line.product_id.name)
+            line_commands.append(Command.unlink(line.id))
+
+        def add_line(product, quantity, price_unit):
+            line_commands.append(Command.create({
+                'product_id': product.id,
+                'product_uom_qty': quantity,
+                'product_uom': product.uom_id.id,
+                'price_unit': price_unit,
+                'name': product.name,
+            }))
+            added_lines.append({
+                'product': product.name,
+                'quantity': quantity,
+                'price_unit': price_unit
+            })
         
         for update in order_lines_updates:
             # Caso 1: Elimina riga esistente
             if update.get('delete') and update.get('line_id'):
-                line = SaleOrderLine.browse(update['line_id'])
-                if line.exists() and line.order_id.id == order.id:
-                    deleted_lines.append(line.product_id.name)
-                    line.unlink()
+                line = order_lines.get(update['line_id'])
+                if line and line.id not in deleted_ids:
+                    delete_line(line)
                 continue
             
             # Caso 2: Modifica quantità riga esistente
             if update.get('line_id') and 'quantity' in update:
-                line = SaleOrderLine.browse(update['line_id'])
-                if line.exists() and line.order_id.id == order.id:
+                line = order_lines.get(update['line_id'])
+                if line and line.id not in deleted_ids:
                     try:
                         new_qty = float(update['quantity'])
                     except (TypeError, ValueError):
@@ -946,11 +1385,11 @@ class WarehouseOperations(models.AbstractModel):
                         continue
 
                     if new_qty <= 0:
-                        deleted_lines.append(line.product_id.name)
-                        line.unlink()
+                        delete_line(line)
                     else:
-                        old_qty = line.product_uom_qty
-                        line.write({'product_uom_qty': new_qty})
+                        old_qty = new_quantities.get(line.id, line.product_uom_qty)
+                        new_quantities[line.id] = new_qty
+                        line_commands.append(Command.update(line.id, {'product_uom_qty': new_qty}))
                         updated_lines.append({
                             'product': line.product_id.name,
                             'old_quantity': old_qty,
@@ -960,85 +1399,53 @@ class WarehouseOperations(models.AbstractModel):
             
             # Caso 3: Aggiungi nuova riga con product_id
             elif update.get('product_id'):
-                qty = float(update.get('quantity', 0) or 0)
+                try:
+                    qty = float(update.get('quantity', 0) or 0)
+                except (TypeError, ValueError):
+                    qty = 0
                 if qty <= 0:
-                    _logger.warning("⚠️ Quantità non positiva per product_id %s: %s", update['product_id'], update.get('quantity'))
+                    _logger.warning("⚠️ Quantità non valida per product_id %s: %s", update['product_id'], update.get('quantity'))
                     continue
                 product = Product.browse(update['product_id'])
                 if not product.exists():
                     continue
                 
-                price_unit = update.get('price_unit', product.list_price)
-                
-                new_line = SaleOrderLine.create({
-                    'order_id': order.id,
-                    'product_id': product.id,
-                    'product_uom_qty': update['quantity'],
-                    'product_uom': product.uom_id.id,
-                    'price_unit': price_unit,
-                    'name': product.name,
-                })
-                added_lines.append({
-                    'product': product.name,
-                    'quantity': update['quantity'],
-                    'price_unit': price_unit
-                })
+                add_line(product, qty, update.get('price_unit', product.list_price))
             
             # 🆕 Caso 4: Aggiungi nuova riga con product_name (cerca automaticamente)
             elif update.get('product_name'):
                 search_term = update['product_name']
-                
-                # Cerca prodotto per nome (case-insensitive, fuzzy match)
-                product = Product.search([
-                    ('name', 'ilike', search_term)
-                ], limit=1)
-                
-                if not product:
-                    # Fallback: prova normalizzazione con AI (se disponibile)
-                    try:
-                        channel = self.env['discuss.channel']
-                        if hasattr(channel, '_normalize_product_search_term'):
-                            normalized = channel._normalize_product_search_term(search_term)
-                            product = Product.search([
-                                ('name', 'ilike', normalized)
-                            ], limit=1)
-                    except:
-                        pass
+                product = resolved_products.get(search_term, Product)
                 
                 if not product:
                     _logger.warning(f"⚠️ Prodotto '{search_term}' non trovato - skip riga")
                     continue
-                
-                price_unit = update.get('price_unit', product.list_price)
-                
-                new_line = SaleOrderLine.create({
-                    'order_id': order.id,
-                    'product_id': product.id,
-                    'product_uom_qty': update['quantity'],
-                    'product_uom': product.uom_id.id,
-                    'price_unit': price_unit,
-                    'name': product.name,
-                })
-                added_lines.append({
-                    'product': product.name,
-                    'quantity': update['quantity'],
-                    'price_unit': price_unit
-                })
-                _logger.info(f"✅ Aggiunta riga: {product.name} x {update['quantity']} (cercato come '{search_term}')")
-        
-        # FORZA il ricalcolo del totale ordine prima di ritornare
-        self.env.flush_all()
 
-        # Invalida TUTTA la cache dell'ordine e delle righe
-        order.invalidate_recordset()  # Invalida tutto l'ordine
-        order.order_line.invalidate_recordset()  # Invalida tutte le righe
-
-        # COMMIT ESPLICITO per rendere le modifiche visibili
-        self.env.cr.commit()
-        _logger.info(f"💾 Commit eseguito dopo aggiornamento ordine {order.name}")
+                try:
+                    qty = float(update.get('quantity', 0) or 0)
+                except (TypeError, ValueError):
+                    qty = 0
+                if qty <= 0:
+                    _logger.warning("⚠️ Quantità non valida per '%s': %s", search_term, update.get('quantity'))
+                    continue
+                
+                add_line(product, qty, update.get('price_unit', product.list_price))
+                _logger.info(f"✅ Aggiunta riga: {product.name} x {qty} (cercato come '{search_term}')")
 
-        # Ricarica l'ordine dal database
-        order = self.env['sale.order'].browse(order.id)
+        # Data promessa al cliente e righe in un solo write sull'ordine
+        order_vals = {}
+        if line_commands:
+            order_vals['order_line'] = line_commands
+        if scheduled_date:
+            order_vals['commitment_date'] = scheduled_date
+        if order_vals:
+            order.write(order_vals)
+        if scheduled_date and order.picking_ids:
+            # Anche le consegne collegate (ordine già confermato in passato), in un solo write
+            order.picking_ids.write({'scheduled_date': scheduled_date})
+        
+        # Righe scritte nella transazione del turno; il totale è ricalcolato dall'ORM alla lettura
+        self.env['sale.order.line'].flush_model()
         order_total = order.amount_total
         
         #Costruisci messaggio formattato con newline
@@ -1083,6 +1490,38 @@ class WarehouseOperations(models.AbstractModel):
         
         return result
     
+    @api.model
+    def _resolve_product_names(self, product_names):
+        """
+        Miglior prodotto per ciascun nome, con UNA ricerca batch su nome originale
+        e nome normalizzato (il primo ha la precedenza).
+
+        Returns:
+            Dict[str, product.product]: recordset vuoto se non trovato
+        """
+        Product = self.env['product.product']
+        if not product_names:
+            return {}
+
+        channel = self.env['discuss.channel']
+        normalized = {name: channel._normalize_product_search_term(name) or name for name in product_names}
+        found = self.search_products_batch(
+            list(product_names) + list(normalized.values()), limit=1, fields=['id', 'name']
+        )
+
+        resolved = {}
+        for name in product_names:
+            hits = found.get(name.strip()) or found.get((normalized[name] or '').strip()) or []
+            resolved[name] = Product.browse(hits[0]['id']) if hits else Product
+        return resolved
+
+    @ai_function(
+        description="Conferma un Sales Order passandolo da draft/sent a sale. Genera automaticamente i Delivery Order. Usa questa funzione quando l'utente vuole confermare, validare o far passare un ordine a 'sale order'",
+        params={
+            'order_name': ('string', "Nome ordine (es. 'S00042') OPPURE"),
+            'order_id': ('integer', "ID numerico dell'ordine"),
+        },
+    )
     @api.model
     def confirm_sales_order(self, order_name=None, order_id=None):
         """
@@ -1155,6 +1594,15 @@ class WarehouseOperations(models.AbstractModel):
                 "order_id": order.id
             }
     
+    @ai_function(
+        description="Cancella un Sales Order (stato -> cancel). Cancella automaticamente i Delivery NON ancora evasi. NON può cancellare ordini con delivery già validati. Usa quando l'utente vuole annullare, cancellare o eliminare un ordine",
+        params={
+            'order_name': ('string', "Nome ordine (es. 'S00042') OPPURE"),
+            'order_id': ('integer', "ID numerico dell'ordine"),
+            'confirm': ('boolean', None),
+        },
+        handler='_ai_request_cancel_confirmation',
+    )
     @api.model
     def cancel_sales_order(self, order_name=None, order_id=None):
         """
@@ -1395,15 +1843,8 @@ class WarehouseOperations(models.AbstractModel):
                 
                 order.write({'commitment_date': scheduled_date})
             
-            # 5. aggiornamento cache e commit
-            self.env.flush_all()
-            order.invalidate_recordset()
-            order.order_line.invalidate_recordset()
-            self.env.cr.commit()
-            _logger.info(f"💾 Commit eseguito dopo modifica ordine confermato {order.name}")
-            
-            # 6. Ricarica ordine dal database
-            order = self.env['sale.order'].browse(order.id)
+            # 5. Righe scritte nella transazione del turno (nessun commit intermedio)
+            self.env['sale.order.line'].flush_model()
 
             # riconferma automatica dell'ordine e generazione nuovi picking disattivata
             # order.action_confirm()
@@ -1476,6 +1917,14 @@ class WarehouseOperations(models.AbstractModel):
                 "note": "L'ordine potrebbe essere in uno stato intermedio. Verifica manualmente."
             }
     
+    @ai_function(
+        description="Modifica quantità su Delivery/Transfer NON ancora validato (state != done). Per modificare delivery già evasi è impossibile",
+        params={
+            'picking_name': ('string', "Nome delivery (es. 'WH/OUT/00025') OPPURE"),
+            'picking_id': ('integer', "ID numerico del picking"),
+            'move_updates': ('array', "Lista modifiche: [{'move_id': 123, 'quantity': 10}, {'product_id': 25, 'quantity': 5}, {'move_id': 124, 'delete': True}]"),
+        },
+    )
     @api.model
     def update_delivery(self, picking_name=None, picking_id=None, move_updates=None):
         """
@@ -1596,15 +2045,8 @@ class WarehouseOperations(models.AbstractModel):
                         "quantity": move_update['quantity']
                     })
             
-            # Forza flush e invalidazione cache
-            self.env.flush_all()
-            picking.invalidate_recordset()
-            picking.move_ids.invalidate_recordset()
-            self.env.cr.commit()
-            _logger.info(f"💾 Commit eseguito dopo aggiornamento delivery {picking.name}")
-            
-            # Ricarica picking
-            picking = StockPicking.browse(picking.id)
+            # Movimenti scritti nella transazione del turno (nessun commit intermedio)
+            self.env['stock.move'].flush_model()
             
             # Ritorna risultato
             return {
@@ -1619,18 +2061,35 @@ class WarehouseOperations(models.AbstractModel):
         except Exception as e:
             return {"error": f"Errore durante aggiornamento delivery: {str(e)}"}
     
+    @ai_function(
+        'get_sales_overview',
+        description="Ottiene panoramica ordini di vendita con statistiche e lista ordini. Ideale per vedere situazione vendite nel periodo",
+        params={
+            'period': ('string', "Periodo: 'day', 'week', 'month' (default), 'year', 'all'"),
+            'state': ('string', "Filtra per stato ('draft', 'sent', 'sale', 'done', 'cancel'). Se omesso mostra tutti"),
+            'limit': ('integer', "Massimo ordini nella lista (default 10); le statistiche coprono sempre tutto il periodo"),
+            'cursor': ('string', "Opzionale: 'next_cursor' del risultato precedente per la pagina successiva di ordini"),
+        },
+        read_only=True, cache=60,
+    )
     @api.model
-    def get_orders_summary(self, period='month', state=None, limit=10):
+    def get_orders_summary(self, period='month', state=None, limit=10, cursor=None):
         """
         Ottiene una panoramica degli ordini di vendita (numero, fatturato, ecc.), filtrati per periodo e stato.
         
+        Le statistiche sono calcolate dal database sull'intero periodo (rollup
+        giornaliero o aggregati su sale.order); la lista ordini è una pagina
+        separata con paginazione keyset su (date_order, id), quindi il costo
+        non cresce con il numero di ordini mostrati o con la pagina richiesta.
+        
         Args:
-            period (str): 'day', 'week', 'month', 'year', 'all' (default 'month')
+            period (str): 'day', 'week', 'month', 'quarter', 'year', 'all' (default 'month')
             state (str): stato degli ordini ('draft', 'sent', 'sale', 'done', 'cancel')
-            limit (int): numero massimo di ordini da includere nella lista dettagliata (default 10)
+            limit (int): numero massimo di ordini nella pagina (default 10)
+            cursor (str): `next_cursor` della pagina precedente (None = prima pagina)
         
         Returns:
-            Dict con statistiche e lista ordini
+            Dict con statistiche, pagina ordini e `next_cursor` (None se non ci sono altri ordini)
         """
         SaleOrder = self.env['sale.order']
         
@@ -1638,42 +2097,67 @@ class WarehouseOperations(models.AbstractModel):
         domain = [('state', 'in', ['sale', 'done'])]
         
         # Filtro temporale
-        if period != 'all':
-            from datetime import datetime, timedelta
-            today = datetime.now()
-            
-            if period == 'day':
-                start_date = today.replace(hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'week':
-                start_date = today - timedelta(days=today.weekday())
-            elif period == 'month':
-                start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'year':
-                start_date = today.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            else:
-                start_date = None
-            
-            if start_date:
-                domain.append(('date_order', '>=', start_date))
+        start_date = self._period_start(period)
+        if start_date:
+            domain.append(('date_order', '>=', start_date))
         
         # Filtra per stato
         if state:
             domain.append(('state', '=', state))
         
-        # Cerca ordini
-        orders = SaleOrder.search(domain, limit=limit, order='date_order DESC')
-        
-        # Statistiche
-        total_revenue = sum(o.amount_total for o in orders)
-        avg_order_value = total_revenue / len(orders) if orders else 0.0
+        # Statistiche dell'intero periodo (indipendenti dalla pagina)
+        Rollup = self.env['ai.sales.daily.rollup']
+        if Rollup._can_serve(start_date):
+            rollup_domain = Rollup._analytics_domain('partner', start_date)
+            if state:
+                rollup_domain.append(('state', '=', state))
+            state_groups = Rollup._read_group(
+                rollup_domain, groupby=['state'], aggregates=['order_count:sum', 'amount_total:sum'],
+            )
+        else:
+            state_groups = SaleOrder._read_group(
+                domain, groupby=['state'], aggregates=['__count', 'amount_total:sum'],
+            )
         
-        # Raggruppa per stato
         orders_by_state = {}
-        for order in orders:
-            state_key = order.state
-            orders_by_state[state_key] = orders_by_state.get(state_key, 0) + 1
+        total_orders = 0
+        total_revenue = 0.0
+        for state_key, count, amount in state_groups:
+            orders_by_state[state_key] = count
+            total_orders += count
+            total_revenue += amount
+        avg_order_value = total_revenue / total_orders if total_orders else 0.0
+        
+        # Pagina ordini: keyset sull'ultimo (date_order, id) della pagina precedente
+        try:
+            limit = max(int(limit or 10), 1)
+        except (TypeError, ValueError):
+            limit = 10
+        page_domain = list(domain)
+        if cursor:
+            try:
+                cursor_date, cursor_id = str(cursor).rsplit(',', 1)
+                cursor_date = fields.Datetime.to_datetime(cursor_date)
+                cursor_id = int(cursor_id)
+            except (TypeError, ValueError):
+                return {"error": f"Cursore non valido: '{cursor}'"}
+            page_domain += [
+                '|',
+                ('date_order', '<', cursor_date),
+                '&', ('date_order', '=', cursor_date), ('id', '<', cursor_id),
+            ]
+        
+        # Un ordine in più solo per sapere se esiste una pagina successiva
+        orders = SaleOrder.search(page_domain, limit=limit + 1, order='date_order DESC, id DESC')
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        next_cursor = None
+        if has_more:
+            last = orders[-1]
+            next_cursor = f"{fields.Datetime.to_string(last.date_order)},{last.id}"
         
         # Prepara lista ordini
+        state_labels = dict(SaleOrder._fields['state'].selection)
         orders_data = []
         for order in orders:
             orders_data.append({
@@ -1682,7 +2166,7 @@ class WarehouseOperations(models.AbstractModel):
                 "partner": order.partner_id.name,
                 "date_order": order.date_order.strftime("%Y-%m-%d") if order.date_order else None,
                 "state": order.state,
-                "state_display": dict(order._fields['state'].selection).get(order.state),
+                "state_display": state_labels.get(order.state),
                 "amount_untaxed": order.amount_untaxed,
                 "amount_tax": order.amount_tax,
                 "amount_total": order.amount_total,
@@ -1693,13 +2177,23 @@ class WarehouseOperations(models.AbstractModel):
         
         return {
             "period": period,
-            "total_orders": len(orders),
+            "total_orders": total_orders,
             "total_revenue": total_revenue,
             "avg_order_value": avg_order_value,
             "orders_by_state": orders_by_state,
-            "orders": orders_data
+            "orders": orders_data,
+            "next_cursor": next_cursor,
         }
     
+    @ai_function(
+        description="Ottiene dettagli completi di un ordine di vendita specifico: righe prodotto, delivery collegati, fatture",
+        params={
+            'order_name': ('string', "Nome ordine (es. 'S00034') OPPURE"),
+            'order_id': ('integer', "ID numerico ordine"),
+            'internal': ('boolean', "Opzionale: True per un passaggio interno di un flusso multi-step (risultato non mostrato all'utente)"),
+        },
+        read_only=True, cache=30, handler='_ai_get_sales_order_details',
+    )
     @api.model
     def get_sales_order_details(self, order_name=None, order_id=None, internal=False):
         """
@@ -1856,6 +2350,41 @@ class WarehouseOperations(models.AbstractModel):
             "note": order.note or "",
         }
     
+    @api.model
+    def _period_start(self, period):
+        """
+        Inizio del periodo per le statistiche di vendita.
+
+        Args:
+            period: 'day', 'week', 'month', 'quarter', 'year' ('all' o altro = nessun limite)
+
+        Returns:
+            datetime | None
+        """
+        from datetime import datetime, timedelta
+        today = datetime.now()
+        midnight = today.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if period == 'day':
+            return midnight
+        if period == 'week':
+            return midnight - timedelta(days=today.weekday())
+        if period == 'month':
+            return midnight.replace(day=1)
+        if period == 'quarter':
+            return midnight.replace(month=((today.month - 1) // 3) * 3 + 1, day=1)
+        if period == 'year':
+            return midnight.replace(month=1, day=1)
+        return None
+
+    @ai_function(
+        description="Classifica top clienti per fatturato nel periodo con statistiche vendite",
+        params={
+            'period': ('string', "Periodo: 'month' (default), 'quarter', 'year', 'all'"),
+            'limit': ('integer', "Numero clienti da mostrare (default 10)"),
+        },
+        read_only=True, cache=300,
+    )
     @api.model
     def get_top_customers(self, period='month', limit=10):
         """
@@ -1880,60 +2409,61 @@ class WarehouseOperations(models.AbstractModel):
             }
         """
         SaleOrder = self.env['sale.order']
-        
-        # Costruisci dominio temporale
-        domain = [('state', 'in', ['sale', 'done'])]  # Solo ordini confermati
-        
-        if period != 'all':
-            from datetime import datetime, timedelta
-            today = datetime.now()
-            
-            if period == 'month':
-                start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'quarter':
-                quarter_month = ((today.month - 1) // 3) * 3 + 1
-                start_date = today.replace(month=quarter_month, day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'year':
-                start_date = today.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            else:
-                start_date = None
-            
+        Rollup = self.env['ai.sales.daily.rollup']
+        start_date = self._period_start(period)
+        
+        if Rollup._can_serve(start_date):
+            # Rollup giornaliero: poche righe per giorno invece di tutti gli ordini
+            domain = Rollup._analytics_domain('partner', start_date)
+            groups = Rollup._read_group(
+                domain,
+                groupby=['partner_id'],
+                aggregates=['order_count:sum', 'amount_total:sum'],
+                order='amount_total:sum DESC',
+                limit=limit,
+            )
+            [(total_customers,)] = Rollup._read_group(domain, aggregates=['partner_id:count_distinct'])
+        else:
+            # Costruisci dominio temporale
+            domain = [('state', 'in', ['sale', 'done'])]  # Solo ordini confermati
             if start_date:
                 domain.append(('date_order', '>=', start_date))
-        
-        # Raggruppa per partner
-        orders = SaleOrder.search(domain)
-        
-        partner_stats = {}
-        for order in orders:
-            partner_id = order.partner_id.id
-            if partner_id not in partner_stats:
-                partner_stats[partner_id] = {
-                    "partner_id": partner_id,
-                    "partner": order.partner_id.name,
-                    "partner_email": order.partner_id.email or "",
-                    "total_orders": 0,
-                    "total_revenue": 0.0,
-                }
             
-            partner_stats[partner_id]["total_orders"] += 1
-            partner_stats[partner_id]["total_revenue"] += order.amount_total
+            # Raggruppa per partner nel DB: ordinamento e limite applicati da PostgreSQL
+            groups = SaleOrder._read_group(
+                domain,
+                groupby=['partner_id'],
+                aggregates=['__count', 'amount_total:sum'],
+                order='amount_total:sum DESC',
+                limit=limit,
+            )
+            [(total_customers,)] = SaleOrder._read_group(domain, aggregates=['partner_id:count_distinct'])
         
-        # Calcola media e ordina
         top_customers = []
-        for stats in partner_stats.values():
-            stats["avg_order_value"] = stats["total_revenue"] / stats["total_orders"] if stats["total_orders"] > 0 else 0.0
-            top_customers.append(stats)
-        
-        # Ordina per fatturato decrescente
-        top_customers.sort(key=lambda x: x["total_revenue"], reverse=True)
+        for partner, total_orders, total_revenue in groups:
+            top_customers.append({
+                "partner_id": partner.id,
+                "partner": partner.name,
+                "partner_email": partner.email or "",
+                "total_orders": total_orders,
+                "total_revenue": total_revenue,
+                "avg_order_value": total_revenue / total_orders if total_orders > 0 else 0.0,
+            })
         
         return {
             "period": period,
-            "total_customers": len(top_customers),
-            "top_customers": top_customers[:limit]
+            "total_customers": total_customers,
+            "top_customers": top_customers
         }
     
+    @ai_function(
+        description="Statistiche prodotti più venduti nel periodo con quantità e fatturato",
+        params={
+            'period': ('string', "Periodo: 'month' (default), 'quarter', 'year', 'all'"),
+            'limit': ('integer', "Numero prodotti da mostrare (default 20)"),
+        },
+        read_only=True, cache=300,
+    )
     @api.model
     def get_products_sales_stats(self, period='month', limit=20):
         """
@@ -1959,61 +2489,51 @@ class WarehouseOperations(models.AbstractModel):
             }
         """
         SaleOrderLine = self.env['sale.order.line']
-        
-        # Costruisci dominio temporale
-        domain = [('order_id.state', 'in', ['sale', 'done'])]
-        
-        if period != 'all':
-            from datetime import datetime, timedelta
-            today = datetime.now()
-            
-            if period == 'month':
-                start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'quarter':
-                quarter_month = ((today.month - 1) // 3) * 3 + 1
-                start_date = today.replace(month=quarter_month, day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif period == 'year':
-                start_date = today.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            else:
-                start_date = None
-            
+        Rollup = self.env['ai.sales.daily.rollup']
+        start_date = self._period_start(period)
+        
+        if Rollup._can_serve(start_date):
+            # Rollup giornaliero per prodotto. Nota: orders_count somma gli ordini
+            # distinti di ogni giorno (un ordine ha un solo giorno, quindi coincide)
+            domain = Rollup._analytics_domain('product', start_date)
+            groups = Rollup._read_group(
+                domain,
+                groupby=['product_id'],
+                aggregates=['qty:sum', 'revenue:sum', 'order_count:sum'],
+                order='qty:sum DESC',
+                limit=limit,
+            )
+            [(total_products,)] = Rollup._read_group(domain, aggregates=['product_id:count_distinct'])
+        else:
+            # Costruisci dominio temporale (solo righe prodotto, niente sezioni/note)
+            domain = [('order_id.state', 'in', ['sale', 'done']), ('display_type', '=', False)]
             if start_date:
                 domain.append(('order_id.date_order', '>=', start_date))
-        
-        # Raggruppa per prodotto
-        lines = SaleOrderLine.search(domain)
-        
-        product_stats = {}
-        for line in lines:
-            product_id = line.product_id.id
-            if product_id not in product_stats:
-                product_stats[product_id] = {
-                    "product_id": product_id,
-                    "product": line.product_id.name,
-                    "product_code": line.product_id.default_code or "",
-                    "total_qty_sold": 0.0,
-                    "total_revenue": 0.0,
-                    "orders_count": 0,
-                    "order_ids": set(),
-                }
             
-            product_stats[product_id]["total_qty_sold"] += line.product_uom_qty
-            product_stats[product_id]["total_revenue"] += line.price_subtotal
-            product_stats[product_id]["order_ids"].add(line.order_id.id)
+            # Raggruppa per prodotto nel DB: ordini distinti con count_distinct, top-N con ORDER BY/LIMIT
+            groups = SaleOrderLine._read_group(
+                domain,
+                groupby=['product_id'],
+                aggregates=['product_uom_qty:sum', 'price_subtotal:sum', 'order_id:count_distinct'],
+                order='product_uom_qty:sum DESC',
+                limit=limit,
+            )
+            [(total_products,)] = SaleOrderLine._read_group(domain, aggregates=['product_id:count_distinct'])
         
-        # Calcola media e ordina
         top_products = []
-        for stats in product_stats.values():
-            stats["orders_count"] = len(stats["order_ids"])
-            stats["avg_price"] = stats["total_revenue"] / stats["total_qty_sold"] if stats["total_qty_sold"] > 0 else 0.0
-            del stats["order_ids"]  
-            top_products.append(stats)
-        
-        # Ordina per quantità venduta decrescente
-        top_products.sort(key=lambda x: x["total_qty_sold"], reverse=True)
+        for product, total_qty_sold, total_revenue, orders_count in groups:
+            top_products.append({
+                "product_id": product.id,
+                "product": product.name,
+                "product_code": product.default_code or "",
+                "total_qty_sold": total_qty_sold,
+                "total_revenue": total_revenue,
+                "orders_count": orders_count,
+                "avg_price": total_revenue / total_qty_sold if total_qty_sold > 0 else 0.0,
+            })
         
         return {
             "period": period,
-            "total_products": len(top_products),
-            "top_products": top_products[:limit]
+            "total_products": total_products,
+            "top_products": top_products
         }
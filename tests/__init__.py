@@ -0,0 +1,6 @@
+from . import test_function_cache
+from . import test_function_executor
+from . import test_function_tags
+from . import test_gemini_context_cache
+from . import test_product_normalizer
+from . import test_when_resolver
@@ -0,0 +1,97 @@
+"""
+Parser dei tag funzione precedente a `models/function_tags.py`
+(`discuss.channel._parse_ai_function_calls`, senza logging): riferimento
+per i test di parità e per il microbenchmark.
+"""
+import json
+import re
+
+_TAG_RE = re.compile(r"\[(?:FUNCTION|Function|function):")
+
+
+def legacy_parse_function_tags(ai_response):
+    function_calls = []
+    clean_response = ai_response
+
+    idx = 0
+    while idx < len(clean_response or ""):
+        m = _TAG_RE.search(clean_response, idx)
+        start = -1 if not m else m.start()
+        if start == -1:
+            break
+
+        name_end = clean_response.find('|', start)
+        if name_end == -1:
+            name_end = clean_response.find(']', start)
+        if name_end == -1:
+            idx = (start + 10)
+            continue
+
+        function_name = clean_response[start+10:name_end].strip()
+        if (function_name.startswith('"') and function_name.endswith('"')) or \
+           (function_name.startswith("'") and function_name.endswith("'")):
+            function_name = function_name[1:-1].strip()
+
+        bracket_count = 1
+        pos = name_end
+        tag_end = -1
+        while pos < len(clean_response) and bracket_count > 0:
+            pos += 1
+            if pos >= len(clean_response):
+                break
+            if clean_response[pos] == '[':
+                bracket_count += 1
+            elif clean_response[pos] == ']':
+                bracket_count -= 1
+                if bracket_count == 0:
+                    tag_end = pos
+                    break
+        if tag_end == -1:
+            idx = start + 10
+            continue
+
+        params_str = clean_response[name_end:tag_end].strip()
+        if params_str.startswith('|'):
+            params_str = params_str[1:]
+
+        parameters = {}
+        if params_str:
+            parts = []
+            current = ""
+            bracket_level = 0
+            brace_level = 0
+            for char in params_str:
+                if char == '[':
+                    bracket_level += 1
+                elif char == ']':
+                    bracket_level -= 1
+                elif char == '{':
+                    brace_level += 1
+                elif char == '}':
+                    brace_level -= 1
+                elif char == '|' and bracket_level == 0 and brace_level == 0:
+                    parts.append(current)
+                    current = ""
+                    continue
+                current += char
+            if current:
+                parts.append(current)
+
+            for part in parts:
+                if ':' not in part:
+                    continue
+                key, value = part.split(':', 1)
+                key = key.strip()
+                value = value.strip()
+                if value.startswith('[') or value.startswith('{'):
+                    try:
+                        value = json.loads(value)
+                    except Exception:
+                        pass
+                parameters[key] = value
+
+        function_calls.append((function_name, parameters))
+        clean_response = clean_response[:start] + clean_response[tag_end+1:]
+        idx = start
+
+    return function_calls, clean_response.strip()
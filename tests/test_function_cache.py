@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.ai_livebot.models.function_cache import _PRECOMMIT_KEY, cached_call
+
+
+@tagged('post_install', '-at_install')
+class TestFunctionCacheInvalidation(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.template = cls.env['product.template'].create({'name': 'Cestino test cache AI', 'list_price': 10.0})
+
+    def setUp(self):
+        super().setUp()
+        # La creazione del prodotto nel setup ha già segnato la transazione
+        self.env.cr.precommit.data.pop(_PRECOMMIT_KEY, None)
+        self.function = SimpleNamespace(name=f'test_cache_{self.id()}', cache=300)
+        self.computed = []
+
+    def _call(self):
+        def compute():
+            self.computed.append(self.template.list_price)
+            return {'list_price': self.template.list_price}
+        return cached_call(self.env, self.function, {'product_id': self.template.id}, compute)
+
+    def test_template_price_edit_recomputes(self):
+        self.assertEqual(self._call(), {'list_price': 10.0})
+        self.assertEqual(self._call(), {'list_price': 10.0})
+        self.assertEqual(len(self.computed), 1, "la seconda chiamata deve arrivare dalla cache")
+
+        self.template.write({'list_price': 25.0})
+        self.assertEqual(self._call(), {'list_price': 25.0})
+        self.assertEqual(len(self.computed), 2)
+
+    def test_template_unlink_marks_cache_dirty(self):
+        template = self.env['product.template'].create({'name': 'Da eliminare test cache AI'})
+        self.env.cr.precommit.data.pop(_PRECOMMIT_KEY, None)
+        self._call()
+        template.unlink()
+        self._call()
+        self.assertEqual(len(self.computed), 2)
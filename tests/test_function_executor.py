@@ -0,0 +1,58 @@
+from concurrent.futures import Future
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.ai_livebot.models import function_executor
+from odoo.addons.ai_livebot.models.function_cache import _PRECOMMIT_KEY
+
+READ_ONLY = {'get_stock_info', 'get_pending_orders'}
+CALLS = [('get_stock_info', {'product_id': 1}), ('get_pending_orders', {'limit': 5})]
+
+
+class _RecordingExecutor:
+    """Pool finto: registra le chiamate inviate e le esegue subito."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, registry, uid, context, su, scope, function_name, parameters):
+        self.submitted.append(function_name)
+        future = Future()
+        future.set_result({'ran': function_name, 'where': 'thread'})
+        return future
+
+
+@tagged('post_install', '-at_install')
+class TestFunctionExecutor(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.channel = self.env['discuss.channel'].create({'name': 'Test esecutore funzioni AI'})
+        self.env.cr.precommit.data.pop(_PRECOMMIT_KEY, None)
+        self.executor = _RecordingExecutor()
+        Channel = type(self.channel)
+        for patcher in (
+            patch.object(function_executor, 'get_executor', return_value=self.executor),
+            patch.object(type(self.env.registry), 'in_test_mode', return_value=False),
+            patch.object(Channel, '_execute_function', lambda rec, name, params: {'ran': name, 'where': 'turn'}),
+            patch.object(Channel, '_prefetched_result', lambda rec, name, params: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _execute(self):
+        return function_executor.execute_calls(self.channel, CALLS, READ_ONLY, max_workers=4)
+
+    def test_reads_run_in_parallel_without_prior_writes(self):
+        results = self._execute()
+        self.assertEqual(self.executor.submitted, ['get_stock_info', 'get_pending_orders'])
+        self.assertEqual([r['where'] for _n, _p, r in results], ['thread', 'thread'])
+
+    def test_reads_stay_on_turn_cursor_after_prior_write(self):
+        # Scrittura non committata su un modello letto dalle funzioni: i thread non la vedrebbero
+        self.env['product.template'].create({'name': 'Prodotto test esecutore AI'})
+        results = self._execute()
+        self.assertEqual(self.executor.submitted, [])
+        self.assertEqual([(n, r['where']) for n, _p, r in results],
+                         [('get_stock_info', 'turn'), ('get_pending_orders', 'turn')])
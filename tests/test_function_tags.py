@@ -0,0 +1,115 @@
+import logging
+import time
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.ai_livebot.models.function_tags import (
+    IncrementalTagDetector,
+    parse_function_tags,
+    strip_function_tags,
+)
+from .legacy_function_tags import legacy_parse_function_tags
+
+_logger = logging.getLogger(__name__)
+
+# Input su cui il parser a passata singola deve dare lo stesso risultato del precedente
+PARITY_INPUTS = [
+    'Nessun tag qui.',
+    'Cerco. [FUNCTION:search_products|search_term:cestino|limit:5] Attendi.',
+    '[FUNCTION:"get_stock_info"|product_id:12]',
+    '[FUNCTION:create_sales_order|partner_name:Rossi|order_lines:[{"product_id":3,"quantity":2}]|confirm:true] fatto',
+    "[FUNCTION:create_sales_order|partner_name:Rossi|order_lines:[{'product_id': 3, 'quantity': 2}]]",
+    '[FUNCTION:a|x:1] testo [function:b|y:[1,2,3]] fine',
+    'Riga uno\n[FUNCTION:get_pending_orders|limit:10]\nRiga due',
+    '[FUNCTION:x|a:1|senza chiave|b:2]',
+    'Tag aperto [FUNCTION:x|a:1 e basta',
+    # JSON malformato o sbilanciato: il tag resta una chiamata con valore testuale
+    '[FUNCTION:create|order_lines:[{"a":1]] tail',
+    '[FUNCTION:x|a:{bad] tail',
+    '[FUNCTION:x|a:{bad|b:1] tail',
+    '[FUNCTION:x|a:foo{|b:2] tail',
+    '[FUNCTION:x|a:[1,2|b:3] tail',
+    '[FUNCTION:x|a:[{"p":1},{"p":2]|b:3] tail [FUNCTION:y|c:4]',
+]
+
+
+def _benchmark_response(tags):
+    tag = (
+        'Preparo l\'ordine. [FUNCTION:create_sales_order|partner_name:Mario Rossi|'
+        'order_lines:[{"product_id":12,"quantity":3,"price_unit":9.5},{"product_id":7,"quantity":1}]|'
+        'confirm:true] Ti aggiorno appena pronto.\n'
+    )
+    return tag * tags
+
+
+@tagged('post_install', '-at_install')
+class TestFunctionTags(BaseCase):
+
+    def test_parity_with_legacy_parser(self):
+        for text in PARITY_INPUTS:
+            with self.subTest(text=text):
+                self.assertEqual(parse_function_tags(text), legacy_parse_function_tags(text))
+
+    def test_malformed_json_is_a_string_value(self):
+        calls, clean = parse_function_tags('[FUNCTION:create|order_lines:[{"a":1]] tail')
+        self.assertEqual(calls, [('create', {'order_lines': '[{"a":1]'})])
+        self.assertEqual(clean, 'tail')
+        self.assertEqual(strip_function_tags('[FUNCTION:x|a:{bad] tail'), 'tail')
+
+    def test_json_brackets_inside_strings(self):
+        calls, clean = parse_function_tags('[FUNCTION:x|note:["a]b"]|n:1] ok')
+        self.assertEqual(calls, [('x', {'note': ['a]b'], 'n': '1'})])
+        self.assertEqual(clean, 'ok')
+
+    def test_bare_tag(self):
+        self.assertEqual(
+            parse_function_tags('[FUNCTION:get_sales_overview] poi altro | testo'),
+            ([('get_sales_overview', {})], 'poi altro | testo'),
+        )
+
+    def test_incremental_detector_matches_full_parse(self):
+        text = PARITY_INPUTS[3] + ' ' + PARITY_INPUTS[9]
+        detector = IncrementalTagDetector()
+        published, tags = [], []
+        for i in range(0, len(text), 7):
+            chunk_text, chunk_tags = detector.feed(text[i:i + 7])
+            published.append(chunk_text)
+            tags.extend(chunk_tags)
+        chunk_text, chunk_tags = detector.finish()
+        published.append(chunk_text)
+        tags.extend(chunk_tags)
+
+        calls, clean = parse_function_tags(text)
+        self.assertEqual([(tag.name, tag.params) for tag in tags], calls)
+        self.assertEqual(''.join(published).strip(), clean)
+
+
+@tagged('-standard', 'ai_livebot_benchmark')
+class BenchmarkFunctionTags(BaseCase):
+    """
+    Microbenchmark del parser (`--test-tags ai_livebot_benchmark`): tempi
+    del parser precedente e di quello a passata singola al crescere dei tag.
+    """
+
+    def _best_of(self, parse, text, repeat=3):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parse(text)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_benchmark_linear(self):
+        timings = {}
+        for tags in (10, 100, 1000, 5000):
+            text = _benchmark_response(tags)
+            legacy = self._best_of(legacy_parse_function_tags, text)
+            current = self._best_of(parse_function_tags, text)
+            timings[tags] = current
+            _logger.info(
+                f"⏱️ {tags} tag, {len(text) / 1000:.1f}k caratteri: "
+                f"precedente {legacy * 1000:.2f} ms, passata singola {current * 1000:.2f} ms"
+            )
+        # Lineare: 500x i tag non costa più di ~1000x il tempo (margine per il rumore)
+        self.assertLess(timings[5000], timings[10] * 1000)
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.ai_livebot.models.llm_provider import CACHE_REFRESH_MARGIN, GeminiContextCache
+
+SYSTEM_PROMPT = "Sei l'assistente di magazzino. " * 100
+
+
+class _FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Endpoint `cachedContents` minimo: registra le richieste ricevute."""
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server.calls.append((self.command, self.path.split('?')[0], body))
+        if server.fail:
+            return self._reply(500, {'error': {'message': 'boom'}})
+        if self.command == 'POST':
+            server.created += 1
+            return self._reply(200, {'name': f'cachedContents/c{server.created}'})
+        return self._reply(200, {'name': self.path.split('?')[0].lstrip('/')})
+
+    do_POST = _handle
+    do_PATCH = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@tagged('post_install', '-at_install')
+class TestGeminiContextCache(BaseCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), _FakeGeminiHandler)
+        cls.server.calls = []
+        cls.server.created = 0
+        cls.server.fail = False
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.calls.clear()
+        self.server.created = 0
+        self.server.fail = False
+        self.client = requests.Session()
+        self.addCleanup(self.client.close)
+        self.cache = GeminiContextCache()
+
+    def _handle(self, **kwargs):
+        return self.cache.get_handle(
+            self.client, self.base_url, 'test-key', 'gemini-test', SYSTEM_PROMPT, timeout=5, **kwargs,
+        )
+
+    def test_create_then_reuse(self):
+        name = self._handle()
+        self.assertTrue(name.startswith('cachedContents/'))
+        self.assertEqual(self._handle(), name)
+
+        self.assertEqual(len(self.server.calls), 1, "il secondo turno deve riusare l'handle senza chiamate")
+        method, path, body = self.server.calls[0]
+        self.assertEqual((method, path), ('POST', '/cachedContents'))
+        self.assertEqual(body['model'], 'models/gemini-test')
+        self.assertEqual(body['systemInstruction']['parts'][0]['text'], SYSTEM_PROMPT)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_extra_fields_are_part_of_the_key(self):
+        tools = {'tools': [{'functionDeclarations': []}]}
+        plain = self._handle()
+        with_tools = self._handle(extra_fields=tools)
+        self.assertNotEqual(plain, with_tools)
+        self.assertEqual(self.server.calls[-1][2]['tools'], tools['tools'])
+
+    def test_refresh_before_expiry(self):
+        name = self._handle(ttl=600)
+        entry = next(iter(self.cache._entries.values()))
+        entry['expire_at'] = time.time() + CACHE_REFRESH_MARGIN / 2
+
+        self.assertEqual(self._handle(ttl=600), name)
+        method, path, body = self.server.calls[-1]
+        self.assertEqual((method, path, body), ('PATCH', f'/{name}', {'ttl': '600s'}))
+
+    def test_failure_falls_back_inline_with_cooldown(self):
+        self.server.fail = True
+        self.assertIsNone(self._handle())
+        self.server.fail = False
+        # In cooldown: nessun nuovo tentativo verso il server
+        self.assertIsNone(self._handle())
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_invalidate(self):
+        name = self._handle()
+        self.cache.invalidate(name)
+        self.assertNotEqual(self._handle(), name)
+        self.assertEqual(self.server.created, 2)
@@ -0,0 +1,47 @@
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.ai_livebot.models.product_normalizer import (
+    CONF_LEXICON,
+    normalize_term,
+    singularize,
+)
+
+# Soglia di default di `ai.config.normalizer_confidence_threshold`
+DEFAULT_THRESHOLD = 0.7
+
+
+@tagged('post_install', '-at_install')
+class TestProductNormalizer(BaseCase):
+
+    def test_lexicon_decides(self):
+        lexicon = frozenset({'verde', 'bicchiere', 'scatola', 'cestino'})
+        self.assertEqual(singularize('verde', lexicon), ('verde', CONF_LEXICON))
+        self.assertEqual(singularize('verdi', lexicon), ('verde', CONF_LEXICON))
+        self.assertEqual(singularize('bicchieri', lexicon), ('bicchiere', CONF_LEXICON))
+        self.assertEqual(singularize('scatole', lexicon), ('scatola', CONF_LEXICON))
+        self.assertEqual(normalize_term('i Cestini verdi', lexicon), ('cestino verde', CONF_LEXICON))
+
+    def test_generic_e_i_guess_is_below_threshold(self):
+        # Senza riscontro nel lessico il suffisso -e/-i non decide: il chiamante deve poter ricorrere all'LLM
+        for word in ('verde', 'verdi', 'bicchieri', 'scatole', 'rossi'):
+            with self.subTest(word=word):
+                _singular, confidence = singularize(word)
+                self.assertLess(confidence, DEFAULT_THRESHOLD)
+        _term, confidence = normalize_term('sedia verde')
+        self.assertLess(confidence, DEFAULT_THRESHOLD)
+
+    def test_ieri_plural(self):
+        self.assertEqual(singularize('bicchieri')[0], 'bicchiere')
+        self.assertEqual(singularize('taglieri')[0], 'tagliere')
+
+    def test_reliable_suffixes(self):
+        for word, expected in (('sedie', 'sedia'), ('bianche', 'bianca'), ('fiori', 'fiore'), ('armadi', 'armadio')):
+            with self.subTest(word=word):
+                singular, confidence = singularize(word)
+                self.assertEqual(singular, expected)
+                self.assertGreaterEqual(confidence, DEFAULT_THRESHOLD)
+
+    def test_invariants_and_stopwords(self):
+        self.assertEqual(singularize('mouse')[0], 'mouse')
+        self.assertEqual(singularize('led')[0], 'led')
+        self.assertEqual(normalize_term('mostrami 5 pz di kit')[0], 'kit')
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytz
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.ai_livebot.models.odoobot_override import BUSINESS_HOUR, _resolve_italian_when, _to_utc_naive
+
+# Venerdì 16 ottobre 2026, nel fuso dell'utente
+BASE = datetime(2026, 10, 16, 15, 30)
+# Stesso venerdì, prima dell'orario aziendale
+BASE_MORNING = datetime(2026, 10, 16, 8, 0)
+
+
+def _at(year, month, day):
+    return datetime(year, month, day, BUSINESS_HOUR)
+
+
+@tagged('post_install', '-at_install')
+class TestWhenResolver(BaseCase):
+
+    def test_explicit_dates(self):
+        self.assertEqual(_resolve_italian_when("consegna il 30 novembre", BASE), _at(2026, 11, 30))
+        self.assertEqual(_resolve_italian_when("per il 30/11", BASE), _at(2026, 11, 30))
+        self.assertEqual(_resolve_italian_when("entro il 2027-01-15", BASE), _at(2027, 1, 15))
+        self.assertEqual(_resolve_italian_when("il 3 marzo", BASE), _at(2027, 3, 3))
+
+    def test_invalid_explicit_date_is_not_resolved(self):
+        # Giorno inesistente: niente ripiego sulla regola "il <giorno>"
+        for text in ("consegna il 31 novembre", "per il 31/11", "entro il 2026-02-30", "il 30 febbraio 2027"):
+            with self.subTest(text=text):
+                self.assertIsNone(_resolve_italian_when(text, BASE))
+
+    def test_day_of_month(self):
+        self.assertEqual(_resolve_italian_when("consegna il 31", BASE), _at(2026, 10, 31))
+        self.assertEqual(_resolve_italian_when("consegna il 10", BASE), _at(2026, 11, 10))
+
+    def test_relative(self):
+        self.assertEqual(_resolve_italian_when("domani", BASE), _at(2026, 10, 17))
+        self.assertEqual(_resolve_italian_when("tra 5 giorni", BASE), _at(2026, 10, 21))
+        self.assertEqual(_resolve_italian_when("lunedì", BASE), _at(2026, 10, 19))
+        self.assertIsNone(_resolve_italian_when("3 cestini rossi", BASE))
+
+    def test_relative_hours_from_now(self):
+        self.assertEqual(_resolve_italian_when("tra 2 ore", BASE), datetime(2026, 10, 16, 17, 30))
+        self.assertEqual(_resolve_italian_when("entro 20 ore", BASE), datetime(2026, 10, 17, 11, 30))
+
+    def test_past_explicit_date_is_rejected(self):
+        self.assertIsNone(_resolve_italian_when("consegna il 5 marzo 2025", BASE))
+        self.assertIsNone(_resolve_italian_when("per il 2026-10-15", BASE))
+        self.assertIsNone(_resolve_italian_when("entro il 01/09/2026", BASE))
+
+    def test_fraction_is_not_a_date(self):
+        self.assertIsNone(_resolve_italian_when("aggiungi 1/2 bancale", BASE))
+        self.assertIsNone(_resolve_italian_when("3/4 di cartone", BASE))
+        self.assertEqual(_resolve_italian_when("per il 1/2", BASE), _at(2027, 2, 1))
+        self.assertEqual(_resolve_italian_when("consegna lunedì 19/10", BASE), _at(2026, 10, 19))
+
+    def test_this_weekday_includes_today(self):
+        # BASE è un venerdì
+        self.assertEqual(_resolve_italian_when("questo venerdì", BASE_MORNING), _at(2026, 10, 16))
+        self.assertEqual(_resolve_italian_when("venerdì", BASE_MORNING), _at(2026, 10, 23))
+        self.assertEqual(_resolve_italian_when("questa domenica", BASE_MORNING), _at(2026, 10, 18))
+
+    def test_today_after_business_hour_is_now(self):
+        self.assertEqual(_resolve_italian_when("oggi", BASE_MORNING), _at(2026, 10, 16))
+        self.assertEqual(_resolve_italian_when("oggi", BASE), BASE)
+        self.assertEqual(_resolve_italian_when("questo venerdì", BASE), BASE)
+
+    def test_naive_utc(self):
+        rome = pytz.timezone('Europe/Rome')
+        # Ottobre: ora legale (UTC+2); gennaio: UTC+1
+        self.assertEqual(_to_utc_naive(rome.localize(_at(2026, 10, 16)), 'Europe/Rome'), datetime(2026, 10, 16, 8))
+        self.assertEqual(_to_utc_naive(_at(2027, 1, 15), 'Europe/Rome'), datetime(2027, 1, 15, 9))
+        aware = _to_utc_naive(rome.localize(_at(2027, 1, 15)), 'UTC')
+        self.assertIsNone(aware.tzinfo)
+        self.assertEqual(aware, datetime(2027, 1, 15, 9))